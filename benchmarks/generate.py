@@ -0,0 +1,283 @@
+"""Generate a synthetic Sphinx project exercising jupyterlite-sphinx.
+
+The project is made of:
+
+- a module of autodoc'd functions whose numpydoc docstrings have an Examples
+  section, turned into ``try_examples`` directives by
+  ``global_enable_try_examples``;
+- ``notebooklite`` and ``jupyterlite`` directives over ``.ipynb`` notebooks
+  and, if jupytext is installed, jupytext Markdown notebooks;
+- a ``jupyterlite_contents`` tree of a given total size.
+
+Usage::
+
+    python benchmarks/generate.py DEST [--functions N] [--notebooks M] ...
+"""
+
+import argparse
+import json
+import random
+import shutil
+import textwrap
+from pathlib import Path
+
+# Number of functions or notebook directives per generated page.
+ITEMS_PER_PAGE = 20
+
+CONF_PY = """\
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+project = "jupyterlite-sphinx benchmark"
+extensions = ["sphinx.ext.autodoc", "sphinx.ext.napoleon", "jupyterlite_sphinx"]
+global_enable_try_examples = True
+jupyterlite_contents = ["contents"]
+jupyterlite_bind_ipynb_suffix = False
+exclude_patterns = ["_build", "notebooks"]
+"""
+
+
+def _parse_size(size: str) -> int:
+    """Parse a size such as ``512``, ``64KB`` or ``10MB`` into bytes."""
+    size = size.strip().upper()
+    for suffix, factor in [("GB", 1 << 30), ("MB", 1 << 20), ("KB", 1 << 10)]:
+        if size.endswith(suffix):
+            return int(float(size[: -len(suffix)]) * factor)
+    return int(size.rstrip("B"))
+
+
+def _function_source(index: int) -> str:
+    return textwrap.dedent(f'''
+        def function_{index}(x, y=1):
+            """Compute something with ``x`` and ``y``.
+
+            Parameters
+            ----------
+            x : int
+                The first operand.
+            y : int, optional
+                The second operand.
+
+            Returns
+            -------
+            int
+                The result.
+
+            Examples
+            --------
+            >>> function_{index}(2)
+            {2 + index}
+            >>> function_{index}(2, y=3)
+            {2 + 3 * index}
+            """
+            return x + y * {index}
+        ''')
+
+
+def _notebook(index: int, cells: int) -> dict:
+    return {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": None,
+                "id": f"cell-{cell}",
+                "metadata": {"tags": ["jupyterlite_sphinx_strip"] if cell == 0 else []},
+                "outputs": [],
+                "source": f"x = {index} * {cell}\nprint(x)",
+            }
+            for cell in range(cells)
+        ],
+        "metadata": {
+            "kernelspec": {
+                "display_name": "Python (Pyodide)",
+                "language": "python",
+                "name": "python",
+            }
+        },
+        "nbformat": 4,
+        "nbformat_minor": 5,
+    }
+
+
+def _markdown_notebook(index: int, cells: int) -> str:
+    header = textwrap.dedent("""\
+        ---
+        jupytext:
+          text_representation:
+            extension: .md
+            format_name: myst
+        kernelspec:
+          display_name: Python (Pyodide)
+          language: python
+          name: python
+        ---
+        """)
+    body = "\n".join(
+        f"```{{code-cell}}\nx = {index} * {cell}\nprint(x)\n```\n"
+        for cell in range(cells)
+    )
+    return f"{header}\n# Notebook {index}\n\n{body}"
+
+
+def _write_contents(root: Path, total_size: int, files: int, seed: int) -> None:
+    rng = random.Random(seed)
+    files = max(files, 1) if total_size else 0
+    for index in range(files):
+        size = total_size // files + (1 if index < total_size % files else 0)
+        path = root / f"dir_{index % 10}" / f"data_{index}.bin"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(rng.randbytes(size))
+
+
+def _pages(prefix: str, title: str, items: list[str]) -> list[tuple[str, str]]:
+    """Split the given directive blocks into pages of ITEMS_PER_PAGE items,
+    returned as (name, source) pairs."""
+    pages = []
+    for start in range(0, len(items), ITEMS_PER_PAGE):
+        number = start // ITEMS_PER_PAGE
+        heading = f"{title} {number}"
+        pages.append(
+            (
+                f"{prefix}_{number}",
+                f"{heading}\n{'=' * len(heading)}\n\n"
+                + "\n\n".join(items[start : start + ITEMS_PER_PAGE])
+                + "\n",
+            )
+        )
+    return pages
+
+
+def generate_project(
+    dest: Path,
+    *,
+    functions: int = 100,
+    notebooks: int = 20,
+    notebook_cells: int = 10,
+    markdown_notebooks: bool = True,
+    contents_size: int = 1 << 20,
+    contents_files: int = 100,
+    seed: int = 0,
+) -> dict:
+    """Generate the project into ``dest``, replacing it if it exists.
+
+    Returns
+    -------
+    dict
+        The parameters of the project, as recorded in the benchmark results.
+    """
+    dest = Path(dest)
+    shutil.rmtree(dest, ignore_errors=True)
+    dest.mkdir(parents=True)
+    (dest / "conf.py").write_text(CONF_PY, encoding="utf-8")
+
+    if markdown_notebooks:
+        try:
+            import jupytext  # noqa: F401
+        except ImportError:
+            markdown_notebooks = False
+
+    (dest / "benchmod.py").write_text(
+        "".join(_function_source(index) for index in range(functions)),
+        encoding="utf-8",
+    )
+    api_pages = _pages(
+        "api",
+        "API",
+        [f".. autofunction:: benchmod.function_{index}" for index in range(functions)],
+    )
+
+    notebooks_dir = dest / "notebooks"
+    notebooks_dir.mkdir()
+    directives = []
+    for index in range(notebooks):
+        if markdown_notebooks and index % 2:
+            name = f"notebook_{index}.md"
+            (notebooks_dir / name).write_text(
+                _markdown_notebook(index, notebook_cells), encoding="utf-8"
+            )
+        else:
+            name = f"notebook_{index}.ipynb"
+            with open(notebooks_dir / name, "w", encoding="utf-8") as f:
+                json.dump(_notebook(index, notebook_cells), f, indent=1)
+        directive = "notebooklite" if index % 4 < 2 else "jupyterlite"
+        directives.append(f".. {directive}:: ../notebooks/{name}")
+    notebook_pages = _pages("notebooks", "Notebooks", directives)
+
+    pages_dir = dest / "pages"
+    pages_dir.mkdir()
+    for name, source in [*api_pages, *notebook_pages]:
+        (pages_dir / f"{name}.rst").write_text(source, encoding="utf-8")
+
+    toctree = "\n".join(f"   pages/{name}" for name, _ in [*api_pages, *notebook_pages])
+    (dest / "index.rst").write_text(
+        f"Benchmark\n=========\n\n.. toctree::\n\n{toctree}\n", encoding="utf-8"
+    )
+
+    _write_contents(dest / "contents", contents_size, contents_files, seed)
+
+    return {
+        "functions": functions,
+        "notebooks": notebooks,
+        "notebook_cells": notebook_cells,
+        "markdown_notebooks": markdown_notebooks,
+        "contents_size": contents_size,
+        "contents_files": contents_files,
+    }
+
+
+def add_project_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--functions", type=int, default=100, help="number of autodoc'd functions"
+    )
+    parser.add_argument(
+        "--notebooks", type=int, default=20, help="number of notebook directives"
+    )
+    parser.add_argument(
+        "--notebook-cells", type=int, default=10, help="number of cells per notebook"
+    )
+    parser.add_argument(
+        "--no-markdown-notebooks",
+        dest="markdown_notebooks",
+        action="store_false",
+        help="only generate .ipynb notebooks",
+    )
+    parser.add_argument(
+        "--contents-size",
+        type=_parse_size,
+        default="1MB",
+        help="total size of the jupyterlite_contents tree, e.g. 512KB or 10MB",
+    )
+    parser.add_argument(
+        "--contents-files",
+        type=int,
+        default=100,
+        help="number of files of the jupyterlite_contents tree",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def project_kwargs(args: argparse.Namespace) -> dict:
+    return {
+        "functions": args.functions,
+        "notebooks": args.notebooks,
+        "notebook_cells": args.notebook_cells,
+        "markdown_notebooks": args.markdown_notebooks,
+        "contents_size": args.contents_size,
+        "contents_files": args.contents_files,
+        "seed": args.seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("dest", type=Path, help="directory of the generated project")
+    add_project_arguments(parser)
+    args = parser.parse_args()
+    params = generate_project(args.dest, **project_kwargs(args))
+    print(f"Generated {args.dest}: {params}")
+
+
+if __name__ == "__main__":
+    main()
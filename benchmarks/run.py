@@ -0,0 +1,268 @@
+"""Benchmark jupyterlite-sphinx builds of a synthetic project.
+
+Each scenario builds the project generated by ``generate.py`` in a fresh
+Python process, and records the duration of the Sphinx read phase, of the
+staging of the notebooks referenced by the directives and of the
+``jupyterlite_contents``, of the JupyterLite build itself and of the whole build, as well as the peak
+resident set size of the Sphinx process and of its subprocesses.
+
+Scenarios:
+
+- ``cold``: build from scratch, without any output or staged contents;
+- ``noop``: rebuild without any change;
+- ``touch``: rebuild after changing one notebook.
+
+Usage::
+
+    python benchmarks/run.py --output results.json [--repeat 3] [project options]
+    python benchmarks/run.py --output results.json --baseline baseline.json
+    python benchmarks/run.py --compare results.json --baseline baseline.json
+
+When a baseline is given, the exit status is 1 if any metric regressed by
+more than ``--threshold`` compared to the baseline.
+"""
+
+import argparse
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from importlib import metadata
+from pathlib import Path
+
+from generate import add_project_arguments, generate_project, project_kwargs
+
+SCENARIOS = ["cold", "noop", "touch"]
+
+# Differences below these are considered noise, whatever the threshold.
+MIN_SECONDS_DELTA = 0.05
+MIN_RSS_DELTA_MB = 5
+
+
+def _peak_rss_mb(children: bool = False):
+    """Peak resident set size of this process or of its terminated children,
+    in MB, or None where it is not available (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(
+        resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    ).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+def build_once(project: Path, jobs: int) -> dict:
+    """Build ``project`` in the current process and time its phases."""
+    from sphinx.application import Sphinx
+
+    import jupyterlite_sphinx.jupyterlite_sphinx as ext
+
+    marks = {}
+    durations = {"staging": 0.0, "lite_staging": 0.0}
+
+    def timed(function, *keys):
+        def wrapper(*args):
+            start = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                for key in keys:
+                    durations[key] += time.perf_counter() - start
+
+        return wrapper
+
+    # The notebooks are staged at the end of the read phase, the
+    # jupyterlite_contents right before the JupyterLite build, within the
+    # build-finished event.
+    ext._stage_notebooks = timed(ext._stage_notebooks, "staging")
+    ext._prepare_lite_build = timed(ext._prepare_lite_build, "staging", "lite_staging")
+
+    def mark(name):
+        def handler(*args):
+            marks.setdefault(name, time.perf_counter())
+
+        return handler
+
+    start = time.perf_counter()
+    app = Sphinx(
+        str(project),
+        str(project),
+        str(project / "_build" / "html"),
+        str(project / "_build" / "doctrees"),
+        "html",
+        status=None,
+        warning=sys.stderr,
+        parallel=jobs,
+    )
+    app.connect("env-before-read-docs", mark("read_start"), priority=0)
+    app.connect("env-updated", mark("read_end"), priority=0)
+    app.connect("build-finished", mark("lite_start"), priority=0)
+    app.connect("build-finished", mark("lite_end"), priority=1000)
+    app.build()
+    end = time.perf_counter()
+
+    read = marks.get("read_end", end) - marks.get("read_start", end)
+    lite = marks.get("lite_end", end) - marks.get("lite_start", end)
+    return {
+        "read": read,
+        "staging": durations["staging"],
+        "lite_build": lite - durations["lite_staging"],
+        "total": end - start,
+        "peak_rss_mb": _peak_rss_mb(),
+        "children_peak_rss_mb": _peak_rss_mb(children=True),
+    }
+
+
+def _prepare_scenario(project: Path, scenario: str) -> None:
+    if scenario == "cold":
+        shutil.rmtree(project / "_build", ignore_errors=True)
+        shutil.rmtree(project / "_contents", ignore_errors=True)
+    elif scenario == "touch":
+        notebook = project / "notebooks" / "notebook_0.ipynb"
+        if notebook.exists():
+            nb = json.loads(notebook.read_text(encoding="utf-8"))
+            nb["cells"][-1]["source"] += "\n# touched"
+            notebook.write_text(json.dumps(nb, indent=1), encoding="utf-8")
+
+
+def run_scenario(project: Path, scenario: str, jobs: int) -> dict:
+    """Prepare ``scenario`` and build the project in a fresh process."""
+    _prepare_scenario(project, scenario)
+    output = subprocess.run(
+        [sys.executable, __file__, "--build-once", str(project), "--jobs", str(jobs)],
+        cwd=Path(__file__).parent,
+        check=True,
+        stdout=subprocess.PIPE,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run_benchmarks(project: Path, repeat: int, jobs: int) -> dict:
+    """Run every scenario ``repeat`` times and keep the median of each
+    metric."""
+    results = {}
+    for scenario in SCENARIOS:
+        runs = []
+        for _ in range(repeat):
+            # Every repetition of a warm scenario starts from a built project.
+            if scenario != "cold":
+                run_scenario(project, "noop", jobs)
+            runs.append(run_scenario(project, scenario, jobs))
+        results[scenario] = {
+            metric: statistics.median(run[metric] for run in runs)
+            for metric in runs[0]
+            if runs[0][metric] is not None
+        }
+        print(
+            f"{scenario:>6}: "
+            + ", ".join(
+                f"{name} {value:.2f}" for name, value in results[scenario].items()
+            ),
+            file=sys.stderr,
+        )
+    return results
+
+
+def _versions() -> dict:
+    versions = {"python": platform.python_version()}
+    for name in ["sphinx", "jupyterlite-core", "jupyterlite-sphinx", "jupytext"]:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            pass
+    return versions
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Describe every metric of ``results`` which regressed by more than
+    ``threshold`` (a fraction) compared to ``baseline``."""
+    regressions = []
+    for scenario, metrics in results["results"].items():
+        for metric, value in metrics.items():
+            base = baseline["results"].get(scenario, {}).get(metric)
+            if base is None:
+                continue
+            min_delta = (
+                MIN_RSS_DELTA_MB if metric.endswith("_mb") else MIN_SECONDS_DELTA
+            )
+            if value > base * (1 + threshold) and value - base > min_delta:
+                regressions.append(
+                    f"{scenario} {metric}: {value:.2f} vs {base:.2f} in the baseline"
+                    f" (+{(value / base - 1) * 100 if base else float('inf'):.0f}%)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--output", type=Path, help="where to write the results")
+    parser.add_argument(
+        "--baseline", type=Path, help="results to compare against, as JSON"
+    )
+    parser.add_argument(
+        "--compare",
+        type=Path,
+        help="compare these results to the baseline instead of running benchmarks",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative increase over the baseline considered a regression",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--jobs", type=int, default=1, help="sphinx-build -j")
+    parser.add_argument(
+        "--workdir",
+        type=Path,
+        help="where to generate the project, a temporary directory by default",
+    )
+    parser.add_argument("--build-once", type=Path, help=argparse.SUPPRESS)
+    add_project_arguments(parser)
+    args = parser.parse_args()
+
+    if args.build_once is not None:
+        # Child process of run_scenario.
+        print(json.dumps(build_once(args.build_once, args.jobs)))
+        return
+
+    if args.compare is not None:
+        results = json.loads(args.compare.read_text(encoding="utf-8"))
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            project = (args.workdir or Path(tmp_dir)) / "project"
+            params = generate_project(project, **project_kwargs(args))
+            results = {
+                "params": {**params, "repeat": args.repeat, "jobs": args.jobs},
+                "versions": _versions(),
+                "results": run_benchmarks(project, args.repeat, args.jobs),
+            }
+        if args.output is not None:
+            args.output.write_text(json.dumps(results, indent=1), encoding="utf-8")
+        else:
+            print(json.dumps(results, indent=1))
+
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        if baseline.get("params") != results.get("params"):
+            print("Warning: the baseline was run with different parameters")
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression over {args.threshold:.0%} compared to the baseline")
+
+
+if __name__ == "__main__":
+    main()
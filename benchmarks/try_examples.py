@@ -0,0 +1,116 @@
+"""Micro-benchmark of the conversion of docstring examples to notebooks.
+
+Times ``examples_to_notebook``, which the ``try_examples`` directive runs
+once per Examples section, on synthetic Examples sections mixing doctest
+code, prose, inline and block math, literal blocks, references and links.
+
+Usage::
+
+    python benchmarks/try_examples.py [--docstrings 9000] [--repeat 3]
+    python benchmarks/try_examples.py --output results.json
+    python benchmarks/try_examples.py --baseline baseline.json
+
+When a baseline is given, the exit status is 1 if the conversion got slower
+by more than ``--threshold`` compared to the baseline.
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from jupyterlite_sphinx._try_examples import examples_to_notebook
+
+EXAMPLES = """\
+Compute the function for a couple of values, see [R4c2dbc17006a-1]_ and
+`the reference documentation <https://example.org/function_{index}.html>`_
+for the details. The result is :math:`x + {index} y`, that is
+
+.. math::
+
+    f(x, y) = x + {index} y
+
+>>> function_{index}(2)
+{a}
+>>> function_{index}(2,
+...             y=3)
+{b}
+
+The values can also be given as keyword arguments::
+
+    function_{index}(x=2, y=3)
+
+>>> function_{index}(x=2, y=3)
+{b}
+"""
+
+
+def examples_lines(index: int) -> list[str]:
+    """The lines of the Examples section of the ``index``-th docstring."""
+    return EXAMPLES.format(index=index, a=2 + index, b=2 + 3 * index).splitlines(
+        keepends=True
+    )
+
+
+def run(docstrings: int, repeat: int) -> dict:
+    """Convert ``docstrings`` Examples sections ``repeat`` times and keep the
+    median duration."""
+    sections = [examples_lines(index) for index in range(docstrings)]
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for lines in sections:
+            examples_to_notebook(lines)
+        durations.append(time.perf_counter() - start)
+    total = statistics.median(durations)
+    return {"total": total, "per_docstring_us": total / docstrings * 1e6}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--docstrings", type=int, default=9000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=Path, help="where to write the results")
+    parser.add_argument(
+        "--baseline", type=Path, help="results to compare against, as JSON"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative increase over the baseline considered a regression",
+    )
+    args = parser.parse_args()
+
+    results = {
+        "params": {"docstrings": args.docstrings, "repeat": args.repeat},
+        "results": run(args.docstrings, args.repeat),
+    }
+    print(
+        f"{args.docstrings} docstrings: {results['results']['total']:.3f} s, "
+        f"{results['results']['per_docstring_us']:.1f} us per docstring",
+        file=sys.stderr,
+    )
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=1), encoding="utf-8")
+
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        value = results["results"]["per_docstring_us"]
+        base = baseline["results"]["per_docstring_us"]
+        if value > base * (1 + args.threshold):
+            print(
+                f"Regression: {value:.1f} us per docstring vs {base:.1f} us in the"
+                f" baseline (+{(value / base - 1) * 100:.0f}%)"
+            )
+            sys.exit(1)
+        print(f"No regression over {args.threshold:.0%} compared to the baseline")
+
+
+if __name__ == "__main__":
+    main()
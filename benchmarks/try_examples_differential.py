@@ -0,0 +1,215 @@
+"""Differential test of the conversion of docstring examples to notebooks.
+
+Replays random Examples sections, built from the constructs handled by
+``examples_to_notebook`` (doctest code and output, prose, inline and block
+math, literal blocks, references, links and ignored directives), through
+``examples_to_notebook`` and through the markdown pipeline it replaced,
+vendored below, and compares the cells of the notebooks.
+
+Usage::
+
+    python benchmarks/try_examples_differential.py [--cases 100000] [--seed 0]
+
+The exit status is 1 if any case differs, the first ones being printed.
+"""
+
+import argparse
+import random
+import re
+import sys
+from unittest import mock
+
+from jupyterlite_sphinx import _try_examples
+from jupyterlite_sphinx._try_examples import examples_to_notebook
+
+# The markdown pipeline of jupyterlite_sphinx/_try_examples.py before the
+# markdown cells were converted by _compile_markdown, vendored as is.
+
+_ref_identifier_pattern = re.compile(r"\[R[a-f0-9]+-(?P<ref_num>\d+)\]_")
+_link_pattern = re.compile(r"`(?P<link_text>[^`<]+)<(?P<url>[^`>]+)>`_")
+
+
+def _convert_sphinx_link(match):
+    link_text = match.group("link_text").rstrip()
+    url = match.group("url")
+    return f"[{link_text}]({url})"
+
+
+def _convert_links(md_text):
+    return _link_pattern.sub(_convert_sphinx_link, md_text)
+
+
+def _strip_ref_identifiers(md_text):
+    return _ref_identifier_pattern.sub(r"[\g<ref_num>]", md_text)
+
+
+def _process_latex(md_text):
+    md_text = re.sub(
+        r":math:\s*`(?P<latex>.*?)`", r"$\g<latex>$", md_text, flags=re.DOTALL
+    )
+
+    lines = md_text.split("\n")
+    in_math_block = False
+    wrapped_lines = []
+    equation_lines = []
+
+    for line in lines:
+        if line.strip() == ".. math::":
+            in_math_block = True
+            continue
+
+        if in_math_block:
+            if line.strip() == "":
+                if equation_lines:
+                    wrapped_lines.append(f"$$ {' '.join(equation_lines)} $$")
+                    equation_lines = []
+            elif line.startswith((" ", "\t")):
+                equation_lines.append(line.strip())
+        else:
+            wrapped_lines.append(line)
+
+        if in_math_block and not (line.startswith((" ", "\t")) or line.strip() == ""):
+            in_math_block = False
+            if equation_lines:
+                wrapped_lines.append(f"$$ {' '.join(equation_lines)} $$")
+            equation_lines = []
+            wrapped_lines.append(line)
+
+    if in_math_block and equation_lines:
+        wrapped_lines.append(f"$$ {' '.join(equation_lines)} $$")
+
+    return "\n".join(wrapped_lines)
+
+
+def _process_literal_blocks(md_text):
+    md_lines = md_text.split("\n")
+    new_lines = []
+    in_literal_block = False
+    literal_block_accumulator = []
+
+    for line in md_lines:
+        indent_level = len(line) - len(line.lstrip())
+
+        if in_literal_block and (indent_level > 0 or line.strip() == ""):
+            literal_block_accumulator.append(line.lstrip())
+        elif in_literal_block:
+            new_lines.extend(["```"] + literal_block_accumulator + ["```"])
+            literal_block_accumulator = []
+            if line.endswith("::"):
+                line = line[:-2]
+                if not line:
+                    continue
+            else:
+                in_literal_block = False
+            new_lines.append(line)
+        else:
+            if line.endswith("::"):
+                in_literal_block = True
+                line = line[:-2]
+                if not line:
+                    continue
+            new_lines.append(line)
+
+    if literal_block_accumulator:
+        new_lines.extend(["```"] + literal_block_accumulator + ["```"])
+
+    return "\n".join(new_lines)
+
+
+def reference_markdown(lines):
+    """The markdown of the cell made of ``lines``, as converted before."""
+    markdown_text = "\n".join(lines)
+    markdown_text = _process_latex(markdown_text)
+    markdown_text = _process_literal_blocks(markdown_text)
+    markdown_text = _strip_ref_identifiers(markdown_text)
+    return _convert_links(markdown_text)
+
+
+# Fragments of lines, put together at random so that the constructs overlap,
+# nest and end at unusual places.
+FRAGMENTS = [
+    "",
+    " ",
+    "Some prose",
+    "x",
+    ":math:`x + y`",
+    ":math: `a_1",
+    "b^2`",
+    ":math:``",
+    "`",
+    "``",
+    ".. math::",
+    "  .. math::",
+    "::",
+    " ::",
+    ":",
+    "[R4c2dbc17006a-1]_",
+    "[Rab-23]_",
+    "[R-1]_",
+    "`link text <https://example.org>`_",
+    "`text [R0f-2]_ <https://example.org/[R1-3]_>`_",
+    "`broken <link`_",
+    "<url>`_",
+    "`text ",
+    "$",
+    "```",
+    "\t",
+    "\n",
+    ">>> x = 1",
+    ">>> ",
+    "... y",
+    "...",
+    ".. plot::",
+    ".. only:: html",
+]
+INDENTS = ["", "", "", "    ", "  ", "\t", " \t"]
+
+
+def random_line(rng):
+    fragments = rng.choices(FRAGMENTS, k=rng.randint(0, 3))
+    return rng.choice(INDENTS) + rng.choice(["", " "]).join(fragments)
+
+
+def random_section(rng):
+    return [random_line(rng) + "\n" for _ in range(rng.randint(0, 12))]
+
+
+def cells(notebook):
+    return [
+        (cell.cell_type, cell.source, cell.get("outputs")) for cell in notebook.cells
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--cases", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--show", type=int, default=5, help="number of differences to print"
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    failures = 0
+    for _ in range(args.cases):
+        lines = random_section(rng)
+        actual = cells(examples_to_notebook(lines))
+        with mock.patch.object(_try_examples, "_compile_markdown", reference_markdown):
+            expected = cells(examples_to_notebook(lines))
+        if actual != expected:
+            failures += 1
+            if failures <= args.show:
+                print(
+                    f"Input: {lines!r}\n  expected: {expected!r}\n  actual: {actual!r}"
+                )
+
+    print(f"{failures} of {args.cases} cases differ (seed {args.seed})")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
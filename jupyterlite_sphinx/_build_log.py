@@ -0,0 +1,146 @@
+"""Capture of the output of ``jupyter lite build``.
+
+The build runs with ``--debug``, which makes it very verbose. Its output is
+streamed line by line into a log file in the Sphinx doctree directory, rotated
+so that it stays bounded, while only the last lines are kept in memory to be
+reported if the build fails. The task lines printed by ``doit`` are parsed on
+the fly to time every JupyterLite task, and thus every addon.
+"""
+
+import os
+import re
+import sys
+import time
+from collections import deque
+from pathlib import Path
+
+# Name of the log file, stored in the Sphinx doctree directory.
+LOG_FILE = "jupyterlite_build.log"
+
+# The log file is rotated at the start of each build and whenever it grows
+# larger than MAX_LOG_BYTES, keeping LOG_BACKUPS previous files.
+MAX_LOG_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 3
+
+# Number of lines kept in memory for error reports.
+TAIL_LINES = 200
+
+# The lines printed by the doit console reporter when a task starts, is up to
+# date or is ignored.
+_TASK_LINE = re.compile(r"^(?P<status>\.  |-- |!! )(?P<name>\S+)")
+
+
+class TaskTimings:
+    """Wall-clock durations of the JupyterLite build tasks.
+
+    doit runs the tasks one after the other, so a task ends when the next one
+    starts, or when the build ends.
+    """
+
+    def __init__(self):
+        self.durations = {}
+        self._current = None
+
+    def start(self, name: str) -> None:
+        self.finish()
+        self._current = (name, time.perf_counter())
+
+    def finish(self) -> None:
+        """End the current task, if any."""
+        if self._current is not None:
+            name, start = self._current
+            self.durations[name] = (
+                self.durations.get(name, 0.0) + time.perf_counter() - start
+            )
+            self._current = None
+
+    def by_addon(self) -> dict[str, float]:
+        """Total duration of the tasks of each addon, slowest first.
+
+        Task names look like ``<step>:<addon>:<target>``.
+        """
+        durations = {}
+        for name, duration in self.durations.items():
+            parts = name.split(":")
+            addon = parts[1] if len(parts) > 1 else name
+            durations[addon] = durations.get(addon, 0.0) + duration
+        return dict(sorted(durations.items(), key=lambda item: -item[1]))
+
+    def format_table(self) -> str:
+        """A table of the duration of every task, slowest first."""
+        if not self.durations:
+            return ""
+        width = max(len(name) for name in self.durations)
+        rows = sorted(self.durations.items(), key=lambda item: -item[1])
+        lines = [f"{'task':<{width}}  seconds"]
+        lines.extend(f"{name:<{width}}  {duration:7.2f}" for name, duration in rows)
+        return "\n".join(lines)
+
+
+class BuildLog:
+    """A log file receiving the output of one ``jupyter lite build`` run.
+
+    Parameters
+    ----------
+    path : Path
+        The log file.
+    echo : bool
+        If True, the output is also written to the standard output as it
+        comes.
+    """
+
+    def __init__(self, path: Path, *, echo: bool = False):
+        self.path = Path(path)
+        self.echo = echo
+        self.tail = deque(maxlen=TAIL_LINES)
+        self.timings = TaskTimings()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._rotate()
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._size = 0
+
+    def _rotate(self) -> None:
+        for index in range(LOG_BACKUPS - 1, 0, -1):
+            backup = self.path.with_name(f"{self.path.name}.{index}")
+            if backup.exists():
+                os.replace(backup, self.path.with_name(f"{self.path.name}.{index + 1}"))
+        if self.path.exists():
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+
+    def write(self, line: str) -> None:
+        """Record one line of output."""
+        if self._size + len(line) > MAX_LOG_BYTES:
+            self._file.close()
+            self._rotate()
+            self._file = open(self.path, "w", encoding="utf-8")
+            self._size = 0
+        self._file.write(line)
+        self._size += len(line)
+        self.tail.append(line)
+
+        match = _TASK_LINE.match(line)
+        if match is not None:
+            if match["status"] == ".  ":
+                self.timings.start(match["name"])
+            else:
+                self.timings.finish()
+
+        if self.echo:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+
+    def consume(self, stream) -> None:
+        """Record every line read from the binary ``stream`` until its end."""
+        for raw_line in iter(stream.readline, b""):
+            self.write(raw_line.decode("utf-8", errors="replace"))
+        self.timings.finish()
+
+    def format_tail(self) -> str:
+        return "".join(self.tail)
+
+    def close(self) -> None:
+        self.timings.finish()
+        table = self.timings.format_table()
+        if table:
+            self._file.write(f"\nJupyterLite task timings:\n{table}\n")
+        self._file.close()
@@ -0,0 +1,230 @@
+"""Fingerprinting of the inputs of the ``jupyter lite build`` step.
+
+The JupyterLite build is by far the slowest part of a jupyterlite-sphinx docs
+build. Its output only depends on the build command, a handful of
+configuration files, the staged contents and the installed JupyterLite
+packages, so we hash all of those and skip the build entirely when nothing
+changed since the last successful run.
+"""
+
+import hashlib
+import json
+import os
+from importlib import metadata
+from pathlib import Path
+
+# Name of the file, stored in the Sphinx doctree directory, which records the
+# fingerprint of the last successful JupyterLite build.
+FINGERPRINT_FILE = "jupyterlite_sphinx_build.json"
+
+# Files read by ``jupyter lite build`` from the lite dir, whether or not they
+# are passed explicitly on the command line.
+LITE_DIR_FILES = [
+    "jupyter_lite_config.json",
+    "jupyter-lite.json",
+    "jupyter-lite.ipynb",
+    "overrides.json",
+    "environment.yml",
+]
+
+# Distributions whose version changes what ends up in the lite output, on top
+# of the ones providing JupyterLite addons.
+VERSIONED_DISTRIBUTIONS = ["jupyterlite-core", "voici"]
+
+_CHUNK_SIZE = 1 << 20
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileHasher:
+    """Hash files, reusing the digests of files whose size and modification
+    time did not change since they were last hashed.
+
+    Parameters
+    ----------
+    known : dict
+        Mapping of absolute path to ``[size, mtime_ns, digest]``, as returned
+        by :attr:`FileHasher.seen` during a previous build.
+    """
+
+    def __init__(self, known=None):
+        self.known = known if known is not None else {}
+        self.seen = {}
+
+    def digest(self, path: Path) -> str:
+        key = str(path)
+        stat = path.stat()
+        cached = self.known.get(key)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            digest = cached[2]
+        else:
+            digest = file_digest(path)
+        self.seen[key] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def update_with_file(self, sha, path: Path, label: str):
+        """Feed ``label`` and the digest of ``path`` (if it exists) into ``sha``."""
+        sha.update(label.encode())
+        sha.update(b"\0")
+        if path.is_file():
+            sha.update(self.digest(path).encode())
+        else:
+            sha.update(b"<missing>")
+        sha.update(b"\0")
+
+    def update_with_tree(self, sha, root: Path):
+        """Feed the relative path and digest of every file below ``root`` into
+        ``sha``, in a deterministic order."""
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = Path(dirpath) / filename
+                self.update_with_file(sha, path, path.relative_to(root).as_posix())
+
+
+def installed_versions() -> dict[str, str]:
+    """Versions of the installed distributions that shape the lite output:
+    jupyterlite-core, voici, every distribution providing a JupyterLite addon
+    and every federated (lab)extension."""
+    versions = {}
+    for name in VERSIONED_DISTRIBUTIONS:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            pass
+
+    for entry_point in metadata.entry_points(group="jupyterlite.addon.v0"):
+        dist = getattr(entry_point, "dist", None)
+        if dist is not None:
+            versions[dist.name] = dist.version
+
+    try:
+        from jupyter_core.paths import jupyter_path
+    except ImportError:
+        return versions
+
+    for labextensions_dir in map(Path, jupyter_path("labextensions")):
+        package_jsons = [
+            *labextensions_dir.glob("*/package.json"),
+            *labextensions_dir.glob("@*/*/package.json"),
+        ]
+        for package_json in sorted(package_jsons):
+            try:
+                package = json.loads(package_json.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            if isinstance(package, dict) and "name" in package:
+                versions.setdefault(
+                    f"labextension:{package['name']}", package.get("version", "")
+                )
+
+    return versions
+
+
+def compute_build_fingerprint(
+    hasher: FileHasher,
+    *,
+    command: list[str],
+    cwd: Path,
+    lite_dir: Path,
+    content_dirs: list[Path],
+    content_files: list[Path],
+    input_files: list[Path],
+) -> str:
+    """Compute a fingerprint over everything that feeds ``jupyter lite build``.
+
+    Parameters
+    ----------
+    hasher : FileHasher
+        Used to hash the files that are part of the fingerprint.
+    command : list of str
+        The full ``jupyter lite build`` command.
+    cwd : Path
+        Directory the command is run from, used to resolve relative paths.
+    lite_dir : Path
+        The JupyterLite ``--lite-dir``.
+    content_dirs : list of Path
+        Directories whose whole tree is passed as contents.
+    content_files : list of Path
+        Individual files passed as contents.
+    input_files : list of Path
+        Additional files read by the build, e.g. the JupyterLite config and
+        settings overrides files.
+
+    Returns
+    -------
+    str
+        Hex digest which changes whenever any of the inputs changes.
+    """
+    sha = hashlib.sha256()
+    sha.update(json.dumps(command).encode())
+    sha.update(json.dumps(installed_versions(), sort_keys=True).encode())
+
+    for name in LITE_DIR_FILES:
+        hasher.update_with_file(sha, lite_dir / name, f"lite-dir:{name}")
+
+    for path in input_files:
+        path = path if path.is_absolute() else cwd / path
+        hasher.update_with_file(sha, path, f"input:{path}")
+
+    for path in content_files:
+        path = path if path.is_absolute() else cwd / path
+        hasher.update_with_file(sha, path, f"contents:{path}")
+
+    for root in content_dirs:
+        sha.update(f"tree:{root}".encode())
+        hasher.update_with_tree(sha, root)
+
+    return sha.hexdigest()
+
+
+def _output_signature(output_dir: Path):
+    # ``jupyter-lite.json`` is (re)written by every successful lite build, so
+    # its stat is a cheap way to detect an output dir that was deleted or
+    # rebuilt behind our back.
+    try:
+        stat = (output_dir / "jupyter-lite.json").stat()
+    except OSError:
+        return None
+    return [str(output_dir), stat.st_size, stat.st_mtime_ns]
+
+
+def load_build_record(record_path: Path) -> dict:
+    try:
+        with open(record_path, encoding="utf-8") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return record if isinstance(record, dict) else {}
+
+
+def build_is_up_to_date(record: dict, fingerprint: str, output_dir: Path) -> bool:
+    """Whether the lite output in ``output_dir`` was built from inputs with the
+    given ``fingerprint`` and has not been modified since."""
+    signature = _output_signature(output_dir)
+    return (
+        signature is not None
+        and record.get("fingerprint") == fingerprint
+        and record.get("output") == signature
+    )
+
+
+def save_build_record(
+    record_path: Path, fingerprint: str, output_dir: Path, hasher: FileHasher
+):
+    record = {
+        "fingerprint": fingerprint,
+        "output": _output_signature(output_dir),
+        "files": hasher.seen,
+    }
+    record_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = record_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(record, f)
+    os.replace(tmp_path, record_path)
@@ -0,0 +1,294 @@
+"""Alternative ways of running the JupyterLite build.
+
+``run_lite_build`` runs it inside the Sphinx process: instead of launching
+``jupyter lite build`` in a subprocess, it drives the jupyterlite-core
+``LiteManager`` and its ``doit`` tasks directly, which saves the startup of a
+new interpreter and the discovery of all the JupyterLite addons, reports task
+progress through the Sphinx logger and surfaces failures as Python exceptions.
+
+``LiteBuildProcess`` runs ``jupyter lite build`` in a subprocess, whose output
+is streamed into a ``BuildLog``. It can be waited for right away, or run
+concurrently with the Sphinx write phase.
+"""
+
+import logging
+import os
+import subprocess
+import threading
+from importlib import metadata
+from pathlib import Path
+from typing import Optional
+
+from doit.reporter import ConsoleReporter
+from sphinx.util import logging as sphinx_logging
+from traitlets import default
+
+from ._build_log import BuildLog, TaskTimings
+
+logger = sphinx_logging.getLogger(__name__)
+
+
+class JupyterLiteBuildError(RuntimeError):
+    """Raised when the JupyterLite build fails."""
+
+
+class _NullStream:
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+class _SphinxReporter(ConsoleReporter):
+    """A ``doit`` reporter which reports task progress through the Sphinx
+    logger and keeps track of failures."""
+
+    quiet = False
+    timings = None
+
+    def __init__(self, outstream, options):
+        super().__init__(_NullStream(), options)
+
+    def _log(self, message):
+        if self.quiet:
+            logger.verbose(message)
+        else:
+            logger.info(message)
+
+    def execute_task(self, task):
+        # Only the tasks reported by the doit console reporter are timed, as
+        # when parsing the output of a subprocess.
+        if task.actions and task.name[0] != "_":
+            if self.timings is not None:
+                self.timings.start(task.name)
+            self._log(f"[jupyterlite-sphinx] .  {task.title()}")
+        elif self.timings is not None:
+            self.timings.finish()
+
+    def skip_uptodate(self, task):
+        if self.timings is not None:
+            self.timings.finish()
+        if task.name[0] != "_":
+            logger.verbose(f"[jupyterlite-sphinx] -- {task.title()}")
+
+    def skip_ignore(self, task):
+        if self.timings is not None:
+            self.timings.finish()
+        logger.verbose(f"[jupyterlite-sphinx] !! {task.title()}")
+
+    def cleanup_error(self, exception):
+        self.runtime_errors.append(exception.get_msg())
+
+    def complete_run(self):
+        # Failures are raised as a JupyterLiteBuildError by run_lite_build.
+        if self.timings is not None:
+            self.timings.finish()
+
+
+def _format_failures(reporter: _SphinxReporter) -> str:
+    messages = []
+    for failure in reporter.failures:
+        exception = failure["exception"]
+        messages.append(
+            f"{exception.get_name()} - taskid:{failure['task'].name}\n"
+            f"{exception.get_msg()}"
+        )
+    messages.extend(reporter.runtime_errors)
+    return "\n".join(messages)
+
+
+# The options of ``jupyter lite build`` taking a path, which is resolved
+# against the directory the build is run from.
+PATH_OPTIONS = {
+    "--app-archive",
+    "--config",
+    "--contents",
+    "--lite-dir",
+    "--output-archive",
+    "--output-dir",
+    "--settings-overrides",
+}
+
+
+def _absolute_build_args(build_args: list[str], cwd: Path) -> list[str]:
+    """``build_args`` with the paths of the ``PATH_OPTIONS`` made absolute."""
+    absolute_args = []
+    expects_path = False
+    for arg in build_args:
+        if expects_path:
+            arg = str(cwd / arg)
+            expects_path = False
+        elif arg in PATH_OPTIONS:
+            expects_path = True
+        elif arg.split("=", 1)[0] in PATH_OPTIONS:
+            option, path = arg.split("=", 1)
+            arg = f"{option}={cwd / path}"
+        absolute_args.append(arg)
+    return absolute_args
+
+
+def in_process_build_unsupported() -> Optional[str]:
+    """Why the installed jupyterlite-core can not be driven in process, or
+    None if it can.
+
+    The build relies on internals of jupyterlite-core, checked against
+    jupyterlite-core 0.2 to 0.8: the ``_doit_config`` of its ``LiteManager``,
+    to set the ``doit`` reporter, and the ``_doit_cmd`` of its
+    ``LiteBuildApp``, the tasks to run.
+    """
+    from jupyterlite_core.app import LiteBuildApp
+    from jupyterlite_core.manager import LiteManager
+
+    missing = [
+        name
+        for cls, name in [
+            (LiteManager, "_doit_config"),
+            (LiteManager, "doit_run"),
+            (LiteBuildApp, "_doit_cmd"),
+        ]
+        if not hasattr(cls, name)
+    ]
+    if missing:
+        version = metadata.version("jupyterlite-core")
+        return f"jupyterlite-core {version} has no {', '.join(missing)}"
+    return None
+
+
+def run_lite_build(
+    build_args: list[str],
+    cwd,
+    *,
+    quiet: bool = False,
+    timings: Optional[TaskTimings] = None,
+) -> None:
+    """Run ``jupyter lite build`` in the current process.
+
+    The working directory of the process is left unchanged: the paths of the
+    build are made absolute instead, so that other threads are not affected.
+    Check ``in_process_build_unsupported`` first.
+
+    Parameters
+    ----------
+    build_args : list of str
+        The command line arguments of ``jupyter lite build``.
+    cwd : path-like
+        Directory to run the build from. Relative paths in ``build_args`` are
+        resolved against it, as for the ``jupyter lite build`` command, and
+        it is searched for the JupyterLite configuration files.
+    quiet : bool
+        If True, the JupyterLite log and task progress are only shown in
+        verbose mode (``sphinx-build -v``), and the output of the tasks is
+        captured and only reported if they fail.
+    timings : TaskTimings, optional
+        Records the duration of every task.
+
+    Raises
+    ------
+    JupyterLiteBuildError
+        If any of the JupyterLite build tasks fails.
+    """
+    from jupyterlite_core.app import LiteBuildApp
+
+    cwd = Path(cwd).resolve()
+    build_args = _absolute_build_args(build_args, cwd)
+    reporters = []
+
+    class Reporter(_SphinxReporter):
+        def __init__(self, outstream, options):
+            super().__init__(outstream, options)
+            self.quiet = quiet
+            self.timings = timings
+            reporters.append(self)
+
+    class App(LiteBuildApp):
+        @default("config_file_paths")
+        def _config_file_paths_default(self):
+            # Search cwd for the configuration files rather than the working
+            # directory of the process.
+            return [
+                str(cwd) if path == os.getcwd() else path
+                for path in super()._config_file_paths_default()
+            ]
+
+    if quiet:
+        lite_app = App(log_level=logging.WARNING)
+        lite_app.initialize([arg for arg in build_args if arg != "--debug"])
+    else:
+        lite_app = App()
+        lite_app.initialize(build_args)
+
+    manager = lite_app.lite_manager
+    manager._doit_config = {
+        **manager._doit_config,
+        "dep_file": str(cwd / manager._doit_config["dep_file"]),
+        "reporter": Reporter,
+        # A verbosity of 0 captures the output of the tasks, which is then
+        # only reported on failure.
+        "verbosity": 0 if quiet else 2,
+    }
+    manager.initialize()
+    return_code = manager.doit_run(*lite_app._doit_cmd)
+
+    if return_code != 0:
+        details = "\n".join(_format_failures(reporter) for reporter in reporters)
+        raise JupyterLiteBuildError(
+            f"The JupyterLite build failed (doit exit code {return_code}) in "
+            f"{cwd}.\n{details}"
+        )
+
+
+class LiteBuildProcess:
+    """A ``jupyter lite build`` subprocess.
+
+    Its standard output and error are read line by line by a thread, which
+    records them in ``log``, so that the process never blocks on a full pipe
+    and its output is never held in memory as a whole.
+
+    Parameters
+    ----------
+    command : list of str
+        The full ``jupyter lite build`` command.
+    cwd : path-like
+        Directory to run the command from.
+    log : BuildLog
+        Receives the output of the command.
+    """
+
+    def __init__(self, command: list[str], cwd, *, log: BuildLog):
+        self.command = command
+        self.log = log
+        self.process = subprocess.Popen(
+            command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+        self._reader = threading.Thread(
+            target=log.consume, args=(self.process.stdout,), daemon=True
+        )
+        self._reader.start()
+
+    def _close(self) -> int:
+        return_code = self.process.wait()
+        self._reader.join()
+        self.process.stdout.close()
+        self.log.close()
+        return return_code
+
+    def wait(self) -> None:
+        """Wait for the build to finish.
+
+        Raises
+        ------
+        subprocess.CalledProcessError
+            If the build failed, with the last lines of its output.
+        """
+        return_code = self._close()
+        if return_code != 0:
+            raise subprocess.CalledProcessError(
+                return_code, self.command, output=self.log.format_tail()
+            )
+
+    def terminate(self) -> None:
+        """Stop the build, e.g. because the Sphinx build failed. A pending
+        :meth:`wait` then raises."""
+        if self.process.poll() is None:
+            self.process.terminate()
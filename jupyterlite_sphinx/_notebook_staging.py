@@ -0,0 +1,178 @@
+"""Deferred staging of the notebooks referenced by the directives.
+
+Converting jupytext notebooks and stripping tagged cells means reading and
+writing whole notebooks, which would stall the read of the documents that
+reference them. Instead, the directives only record a staging job per
+notebook, and all the jobs are run at the end of the read phase: deduplicated
+by target, on a process pool for the conversions and strips, and on a thread
+pool for the verbatim copies.
+
+A job is a dict with the following keys:
+
+- ``kind``: ``"convert"`` for jupytext notebooks, ``"rewrite"`` for notebooks
+  whose tagged cells are stripped or which are transformed, or ``"copy"``;
+- ``source``: the absolute path of the notebook;
+- ``target``: its path in the contents directory;
+- ``strip``: whether tagged cells are stripped;
+- ``transforms``: the notebook transforms to apply, see
+  ``_notebook_transforms``;
+- ``max_output_size``: the output size above which ``cap_outputs`` truncates
+  outputs;
+- ``producer``: the producer of the staged file;
+- ``lineno``: the line of the directive which recorded the job.
+"""
+
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import nbformat
+
+from ._notebook_stream import NotStreamable, strip_tagged_cells
+from ._notebook_transforms import apply_transforms
+
+try:
+    import jupytext
+except ImportError:
+    jupytext = None
+
+# Tag of the cells removed when ``strip_tagged_cells`` is enabled.
+STRIP_TAG = "jupyterlite_sphinx_strip"
+
+
+def strip_notebook_cells(nb: nbformat.NotebookNode) -> list[nbformat.NotebookNode]:
+    """The cells of ``nb`` which are not tagged with ``STRIP_TAG``."""
+    return [cell for cell in nb.cells if STRIP_TAG not in cell.metadata.get("tags", [])]
+
+
+def write_notebook(
+    source: str,
+    target: Path,
+    *,
+    convert: bool,
+    strip: bool,
+    transforms: tuple = (),
+    max_output_size: Optional[int] = None,
+) -> Optional[dict]:
+    """Write the notebook ``source`` to ``target``, converting it from a
+    jupytext format, stripping its tagged cells and applying ``transforms``
+    if requested.
+
+    Returns
+    -------
+    dict or None
+        The bytes saved by each transform, under the ``transforms`` key, if
+        any transform was applied.
+    """
+    if strip and not convert and not transforms:
+        # Fast path, which neither loads the whole notebook nor validates it.
+        try:
+            strip_tagged_cells(source, target, STRIP_TAG)
+            return
+        except NotStreamable:
+            # e.g. an nbformat 3 notebook, which nbformat converts, or an
+            # invalid one, for which it gives a better error.
+            pass
+
+    if convert:
+        nb = jupytext.read(source)
+    else:
+        nb = nbformat.read(source, as_version=4)
+    if strip:
+        nb.cells = strip_notebook_cells(nb)
+    if not transforms:
+        with open(target, "w", encoding="utf-8") as f:
+            nbformat.write(nb, f, version=4)
+        return None
+
+    text, saved = apply_transforms(
+        nb, list(transforms), max_output_size=max_output_size
+    )
+    with open(target, "w", encoding="utf-8") as f:
+        f.write(text)
+    return {"transforms": saved}
+
+
+def job_identity(job: dict) -> tuple:
+    """What must be equal for two jobs staging the same target to produce the
+    same file."""
+    return (
+        job["kind"],
+        job["source"],
+        job["strip"],
+        tuple(job.get("transforms", ())),
+        job.get("max_output_size"),
+    )
+
+
+def staging_options(job: dict) -> str:
+    """The options of :meth:`StagingArea.stage_generated` for ``job``: the
+    strip setting, the transforms and the versions of the packages which read
+    and write the notebook, so that the staged notebook is generated again
+    when any of them changes."""
+    options = f"nbformat={nbformat.__version__},strip={job['strip']}"
+    if job["kind"] == "convert":
+        options += f",jupytext={jupytext.__version__}"
+    transforms = job.get("transforms")
+    if transforms:
+        options += f",transforms={'+'.join(transforms)}"
+        if "cap_outputs" in transforms:
+            options += f",max_output_size={job.get('max_output_size')}"
+        if "reencode_png" in transforms:
+            from PIL import __version__ as pillow_version
+
+            options += f",pillow={pillow_version}"
+    return options
+
+
+def run_staging_jobs(staging_area, jobs: list[dict], *, max_workers=None) -> dict:
+    """Stage the files of ``jobs``, which must have distinct targets.
+
+    Returns
+    -------
+    dict
+        The manifest entry of each staged file, or the exception raised while
+        staging it, keyed by target path.
+    """
+    copies = [job for job in jobs if job["kind"] == "copy"]
+    generated = [job for job in jobs if job["kind"] != "copy"]
+
+    results = staging_area.stage_generated_many(
+        [
+            {
+                "target": job["target"],
+                "source": job["source"],
+                "producer": job["producer"],
+                "write": functools.partial(
+                    write_notebook,
+                    job["source"],
+                    convert=job["kind"] == "convert",
+                    strip=job["strip"],
+                    transforms=tuple(job.get("transforms", ())),
+                    max_output_size=job.get("max_output_size"),
+                ),
+                "options": staging_options(job),
+            }
+            for job in generated
+        ],
+        max_workers=max_workers,
+    )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            job["target"]: executor.submit(
+                staging_area.stage_file,
+                job["target"],
+                source=Path(job["source"]),
+                producer=job["producer"],
+            )
+            for job in copies
+        }
+    for target, future in futures.items():
+        try:
+            results[target] = future.result()
+        except OSError as e:
+            results[target] = e
+
+    return results
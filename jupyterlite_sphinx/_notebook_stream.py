@@ -0,0 +1,278 @@
+"""Streaming removal of tagged cells from ``.ipynb`` notebooks.
+
+``nbformat.read`` loads and validates a whole notebook, outputs included,
+which takes several times the size of the notebook in memory. Stripping tagged
+cells does not need any of that: this module scans the notebook JSON as a
+stream of bytes, parses only the metadata of each cell to look for the strip
+tag, and copies the original bytes of the kept cells, and of everything but
+the removed cells, to the output.
+
+A cell is buffered, in a temporary file past ``SPOOL_SIZE`` bytes, until its
+metadata has been read. nbformat writes the keys of cells in alphabetical
+order, so the metadata of a cell comes before its outputs and memory usage
+does not depend on the size of the notebook.
+"""
+
+import json
+import re
+import tempfile
+
+CHUNK_SIZE = 1 << 20
+
+# Cells are kept in memory up to this size while their metadata has not been
+# read yet.
+SPOOL_SIZE = 8 << 20
+
+_WHITESPACE = re.compile(rb"[ \t\r\n]*")
+_STRING_SPECIAL = re.compile(rb'["\\]')
+_STRUCTURAL = re.compile(rb'["{}\[\]]')
+_SCALAR_END = re.compile(rb"[,}\] \t\r\n]")
+
+
+class NotStreamable(ValueError):
+    """Raised when a notebook can't be stripped by streaming, e.g. because it
+    is not a valid nbformat 4 notebook."""
+
+
+class _Scanner:
+    """Consume a JSON document from a binary stream, sending the consumed bytes
+    to ``sink`` unless they are captured."""
+
+    def __init__(self, stream, sink):
+        self.stream = stream
+        self.sink = sink
+        self.buf = b""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, needed: int = 1) -> bool:
+        """Make sure at least ``needed`` bytes are buffered after ``pos``,
+        flushing the consumed ones. Returns False at the end of the stream."""
+        while len(self.buf) - self.pos < needed:
+            if self.eof:
+                return False
+            chunk = self.stream.read(CHUNK_SIZE)
+            if not chunk:
+                self.eof = True
+                return False
+            self.buf = self.buf[self.pos :] + chunk
+            self.pos = 0
+        return True
+
+    def _emit(self, end: int, capture=None) -> None:
+        data = self.buf[self.pos : end]
+        self.pos = end
+        if capture is not None:
+            capture.append(data)
+        elif self.sink is not None:
+            self.sink(data)
+
+    def peek(self) -> bytes:
+        if not self._fill():
+            raise NotStreamable("Unexpected end of the notebook")
+        return self.buf[self.pos : self.pos + 1]
+
+    def expect(self, char: bytes, capture=None) -> None:
+        if self.peek() != char:
+            raise NotStreamable(
+                f"Expected {char!r} at {self.buf[self.pos : self.pos + 20]!r}"
+            )
+        self._emit(self.pos + 1, capture)
+
+    def whitespace(self, capture=None) -> None:
+        while self._fill():
+            end = _WHITESPACE.match(self.buf, self.pos).end()
+            self._emit(end, capture)
+            if end < len(self.buf):
+                return
+
+    def string(self, capture=None) -> None:
+        self.expect(b'"', capture)
+        while True:
+            if not self._fill():
+                raise NotStreamable("Unterminated string")
+            match = _STRING_SPECIAL.search(self.buf, self.pos)
+            if match is None:
+                self._emit(len(self.buf), capture)
+                continue
+            if match.group() == b'"':
+                self._emit(match.end(), capture)
+                return
+            # An escape sequence, of which only the next byte matters.
+            self._emit(match.start(), capture)
+            if not self._fill(2):
+                raise NotStreamable("Unterminated string")
+            self._emit(self.pos + 2, capture)
+
+    def key(self) -> str:
+        captured = []
+        self.string(capture=captured)
+        key = b"".join(captured)
+        if self.sink is not None:
+            self.sink(key)
+        return json.loads(key)
+
+    def value(self, capture=None) -> None:
+        """Consume a whole JSON value."""
+        char = self.peek()
+        if char == b'"':
+            self.string(capture)
+            return
+        if char not in (b"{", b"["):
+            # A number, true, false or null.
+            while True:
+                if not self._fill():
+                    return
+                match = _SCALAR_END.search(self.buf, self.pos)
+                if match is not None:
+                    self._emit(match.start(), capture)
+                    return
+                self._emit(len(self.buf), capture)
+
+        depth = 0
+        while True:
+            if not self._fill():
+                raise NotStreamable("Unexpected end of the notebook")
+            match = _STRUCTURAL.search(self.buf, self.pos)
+            if match is None:
+                self._emit(len(self.buf), capture)
+                continue
+            self._emit(match.start(), capture)
+            char = match.group()
+            if char == b'"':
+                self.string(capture)
+            elif char in (b"{", b"["):
+                depth += 1
+                self._emit(self.pos + 1, capture)
+            else:
+                depth -= 1
+                self._emit(self.pos + 1, capture)
+                if depth == 0:
+                    return
+
+
+def _is_stripped(metadata: bytes, tag: str) -> bool:
+    try:
+        metadata = json.loads(metadata)
+    except ValueError as e:
+        raise NotStreamable(f"Invalid cell metadata: {e}") from e
+    tags = metadata.get("tags", []) if isinstance(metadata, dict) else []
+    return isinstance(tags, list) and tag in tags
+
+
+def _copy_cell(scanner: _Scanner, write, prefix: bytes, tag: str) -> bool:
+    """Copy the cell at the position of ``scanner``, preceded by ``prefix``,
+    to ``write`` unless it is tagged with ``tag``. Returns whether the cell was
+    kept."""
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spool:
+        spool.write(prefix)
+        scanner.sink = spool.write
+        decided = False
+        kept = True
+
+        scanner.expect(b"{")
+        scanner.whitespace()
+        if scanner.peek() == b"}":
+            scanner.expect(b"}")
+        else:
+            while True:
+                key = scanner.key()
+                scanner.whitespace()
+                scanner.expect(b":")
+                scanner.whitespace()
+                if key == "metadata" and not decided:
+                    captured = []
+                    scanner.value(capture=captured)
+                    metadata = b"".join(captured)
+                    spool.write(metadata)
+                    decided = True
+                    kept = not _is_stripped(metadata, tag)
+                    if kept:
+                        spool.seek(0)
+                        for chunk in iter(lambda: spool.read(CHUNK_SIZE), b""):
+                            write(chunk)
+                        scanner.sink = write
+                    else:
+                        scanner.sink = None
+                else:
+                    scanner.value()
+                scanner.whitespace()
+                if scanner.peek() == b",":
+                    scanner.expect(b",")
+                    scanner.whitespace()
+                    continue
+                scanner.expect(b"}")
+                break
+
+        if not decided:
+            spool.seek(0)
+            for chunk in iter(lambda: spool.read(CHUNK_SIZE), b""):
+                write(chunk)
+    return kept
+
+
+def _copy_cells(scanner: _Scanner, write, tag: str) -> None:
+    scanner.expect(b"[")
+    # The separators are written along with the kept cells.
+    scanner.sink = None
+    kept_any = False
+    leading = []
+    scanner.whitespace(capture=leading)
+    while scanner.peek() != b"]":
+        prefix = (b"," if kept_any else b"") + b"".join(leading)
+        kept_any |= _copy_cell(scanner, write, prefix, tag)
+        scanner.sink = None
+        leading = []
+        scanner.whitespace(capture=leading)
+        if scanner.peek() == b",":
+            scanner.expect(b",")
+            leading = []
+            scanner.whitespace(capture=leading)
+    write(b"".join(leading))
+    scanner.sink = write
+    scanner.expect(b"]")
+
+
+def strip_tagged_cells(source, target, tag: str) -> None:
+    """Copy the notebook ``source`` to ``target`` without the cells tagged
+    with ``tag``.
+
+    Raises
+    ------
+    NotStreamable
+        If ``source`` is not an nbformat 4 notebook in valid JSON. ``target``
+        may then have been partially written.
+    """
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        write = dst.write
+        scanner = _Scanner(src, write)
+        found_cells = False
+
+        scanner.whitespace()
+        scanner.expect(b"{")
+        scanner.whitespace()
+        if scanner.peek() != b"}":
+            while True:
+                key = scanner.key()
+                scanner.whitespace()
+                scanner.expect(b":")
+                scanner.whitespace()
+                if key == "cells" and not found_cells:
+                    found_cells = True
+                    _copy_cells(scanner, write, tag)
+                else:
+                    scanner.value()
+                scanner.whitespace()
+                if scanner.peek() == b",":
+                    scanner.expect(b",")
+                    scanner.whitespace()
+                    continue
+                break
+        scanner.expect(b"}")
+        scanner.whitespace()
+        if scanner._fill():
+            raise NotStreamable("Unexpected data after the notebook")
+
+    if not found_cells:
+        # e.g. an nbformat 3 notebook, with worksheets.
+        raise NotStreamable("The notebook has no cells")
@@ -0,0 +1,218 @@
+"""Transforms shrinking the notebooks staged into the contents directory.
+
+Readers download every staged notebook in full, outputs and metadata
+included. The transforms below are applied to the notebooks of the
+``jupyterlite``, ``notebooklite``, ``voici`` and ``try_examples`` directives
+when enabled with ``jupyterlite_notebook_transforms`` or the ``:transforms:``
+option of a directive:
+
+- ``drop_volatile_metadata``: drop execution counts, cell ids and execution
+  timings, which change at every execution of the notebook;
+- ``reencode_png``: re-encode large PNG outputs with Pillow, keeping them
+  only if they are smaller;
+- ``cap_outputs``: truncate text outputs and drop rich outputs larger than
+  ``jupyterlite_max_output_size``;
+- ``compact_json``: write the notebook without indentation.
+
+The number of bytes saved by each transform is measured by serializing the
+notebook before and after it.
+"""
+
+import base64
+import io
+import json
+from typing import Optional, Union
+
+# In the order they are applied.
+NOTEBOOK_TRANSFORMS = [
+    "drop_volatile_metadata",
+    "reencode_png",
+    "cap_outputs",
+    "compact_json",
+]
+
+# Default of ``jupyterlite_max_output_size``, in bytes.
+DEFAULT_MAX_OUTPUT_SIZE = 256 * 1024
+
+# PNG outputs smaller than this are not worth re-encoding.
+PNG_REENCODE_MIN_SIZE = 64 * 1024
+
+# Cell metadata recording when and how long a cell was executed.
+_VOLATILE_CELL_METADATA = ["execution", "ExecuteTime"]
+
+
+def parse_transforms(value: Union[str, list, tuple, None]) -> list[str]:
+    """Parse a list of transforms, or a comma-separated string of transform
+    names as given to the ``:transforms:`` option, into the list of
+    transforms to apply, in the order they are applied. ``"none"`` or an empty
+    value disables every transform.
+
+    Raises
+    ------
+    ValueError
+        If a transform is unknown.
+    """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    names = {name.strip() for name in value} - {"", "none"}
+    unknown = names - set(NOTEBOOK_TRANSFORMS)
+    if unknown:
+        raise ValueError(
+            f"Unknown notebook transform(s) {', '.join(sorted(unknown))}, "
+            f"expected some of {', '.join(NOTEBOOK_TRANSFORMS)}"
+        )
+    return [name for name in NOTEBOOK_TRANSFORMS if name in names]
+
+
+def check_transforms_available(transforms: list[str]) -> None:
+    """Raise an ImportError if a package needed by ``transforms`` is
+    missing."""
+    if "reencode_png" in transforms:
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            raise ImportError(
+                "The reencode_png notebook transform requires the Pillow package. "
+                'Install "pillow" with your package manager of choice.'
+            ) from None
+
+
+def _text(value) -> str:
+    # nbformat stores multiline strings as lists of lines on disk.
+    return "".join(value) if isinstance(value, list) else value
+
+
+def _truncate(text: str, max_size: int) -> str:
+    data = text.encode("utf-8")
+    if len(data) <= max_size:
+        return text
+    kept = data[:max_size].decode("utf-8", errors="ignore")
+    return (
+        f"{kept}\n[... {len(data) - len(kept.encode('utf-8'))} bytes of output "
+        "truncated by jupyterlite-sphinx]\n"
+    )
+
+
+def _drop_volatile_metadata(nb: dict, **kwargs) -> None:
+    # Cell ids are required from nbformat 4.5.
+    if nb.get("nbformat_minor", 0) > 4:
+        nb["nbformat_minor"] = 4
+    for cell in nb.get("cells", []):
+        cell.pop("id", None)
+        metadata = cell.get("metadata", {})
+        for key in _VOLATILE_CELL_METADATA:
+            metadata.pop(key, None)
+        if cell.get("cell_type") == "code":
+            cell["execution_count"] = None
+            for output in cell.get("outputs", []):
+                if "execution_count" in output:
+                    output["execution_count"] = None
+
+
+def _reencode_png(nb: dict, **kwargs) -> None:
+    from PIL import Image
+
+    for cell in nb.get("cells", []):
+        for output in cell.get("outputs", []):
+            data = output.get("data", {})
+            if "image/png" not in data:
+                continue
+            encoded = _text(data["image/png"])
+            try:
+                png = base64.b64decode(encoded)
+                if len(png) < PNG_REENCODE_MIN_SIZE:
+                    continue
+                image = Image.open(io.BytesIO(png))
+                buffer = io.BytesIO()
+                image.save(buffer, format="PNG", optimize=True)
+            except (ValueError, OSError):
+                # Not a valid PNG, which is left as is.
+                continue
+            if buffer.tell() < len(png):
+                data["image/png"] = base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def _cap_outputs(nb: dict, *, max_output_size: int, **kwargs) -> None:
+    for cell in nb.get("cells", []):
+        for output in cell.get("outputs", []):
+            if output.get("output_type") == "stream":
+                output["text"] = _truncate(
+                    _text(output.get("text", "")), max_output_size
+                )
+            elif "data" in output:
+                data = output["data"]
+                size = len(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+                if size <= max_output_size:
+                    continue
+                # Keep a truncated plain text representation of rich outputs.
+                text = _truncate(_text(data.get("text/plain", "")), max_output_size)
+                if text and not text.endswith("\n"):
+                    text += "\n"
+                output["data"] = {
+                    "text/plain": f"{text}[{size} bytes of output dropped by "
+                    "jupyterlite-sphinx]"
+                }
+                output["metadata"] = {}
+
+
+_TRANSFORM_FUNCTIONS = {
+    "drop_volatile_metadata": _drop_volatile_metadata,
+    "reencode_png": _reencode_png,
+    "cap_outputs": _cap_outputs,
+}
+
+
+def serialize_notebook(nb: dict, *, compact: bool = False, indent: int = 1) -> str:
+    """Serialize ``nb`` as nbformat does, or without any whitespace if
+    ``compact``."""
+    if compact:
+        return json.dumps(nb, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+    return json.dumps(nb, ensure_ascii=False, indent=indent, sort_keys=True) + "\n"
+
+
+def apply_transforms(
+    nb: dict,
+    transforms: list[str],
+    *,
+    max_output_size: Optional[int] = None,
+    indent: int = 1,
+) -> tuple[str, dict[str, int]]:
+    """Apply ``transforms`` to ``nb``, in place, and serialize it.
+
+    Parameters
+    ----------
+    nb : dict
+        The notebook, which is modified.
+    transforms : list of str
+        The transforms to apply, as returned by :func:`parse_transforms`.
+    max_output_size : int, optional
+        The size above which ``cap_outputs`` truncates outputs, defaults to
+        ``DEFAULT_MAX_OUTPUT_SIZE``.
+    indent : int
+        The indentation of the notebook JSON, unless ``compact_json`` is
+        applied.
+
+    Returns
+    -------
+    text : str
+        The serialized notebook.
+    saved : dict
+        The number of bytes saved by each transform.
+    """
+    if max_output_size is None:
+        max_output_size = DEFAULT_MAX_OUTPUT_SIZE
+    saved = {}
+    text = serialize_notebook(nb, indent=indent)
+    size = len(text.encode("utf-8"))
+    for name in transforms:
+        if name == "compact_json":
+            text = serialize_notebook(nb, compact=True)
+        else:
+            _TRANSFORM_FUNCTIONS[name](nb, max_output_size=max_output_size)
+            text = serialize_notebook(nb, indent=indent)
+        new_size = len(text.encode("utf-8"))
+        saved[name] = size - new_size
+        size = new_size
+    return text, saved
@@ -0,0 +1,72 @@
+"""Payloads of the code of the replite directive.
+
+JupyterLite's REPL takes the code to run from the ``code`` query parameter
+of its URL. Passing it there as is makes the URL grow with the code, and
+the URL is repeated in the HTML of the page. The code can instead be passed
+to jupyterlite_sphinx.js, which adds it to the URL of the REPL when the
+iframe is shown or the tab opened, either:
+
+- ``compressed``: compressed with zlib and base64url-encoded in a
+  ``data-code-payload`` attribute, decompressed by the browser, or
+- ``staged``: staged as a file of the JupyterLite contents, named after the
+  hash of the code, fetched from its ``data-code-path`` attribute.
+"""
+
+import base64
+import hashlib
+import zlib
+from urllib.parse import quote
+
+CODE_PAYLOAD_MODES = ("auto", "query", "compressed", "staged")
+
+# Directory of the JupyterLite contents with the staged code, hidden from the
+# file browser.
+REPLITE_CODE_DIR = "_replite"
+
+
+def compress_code(code: str) -> str:
+    """The zlib-compressed ``code``, base64url-encoded without padding."""
+    compressed = zlib.compress(code.encode("utf-8"), 9)
+    return base64.urlsafe_b64encode(compressed).decode("ascii").rstrip("=")
+
+
+def staged_code_name(code: str) -> str:
+    """The path of the staged ``code`` in the JupyterLite contents, named
+    after its content so that identical snippets share a single file."""
+    content_hash = hashlib.sha256(code.encode("utf-8")).hexdigest()
+    return f"{REPLITE_CODE_DIR}/{content_hash[:32]}.txt"
+
+
+def choose_code_payload(code: str, mode: str, threshold: int) -> tuple[str, str]:
+    """The payload mode of ``code`` and its payload.
+
+    Parameters
+    ----------
+    code : str
+        The code of the replite directive.
+    mode : str
+        One of ``CODE_PAYLOAD_MODES``. In ``auto`` mode, the code is passed
+        in the query string when it fits in ``threshold`` bytes once quoted,
+        compressed when the compressed payload does, and staged otherwise.
+    threshold : int
+        The maximum size, in bytes, added to the HTML by the code in ``auto``
+        mode.
+
+    Returns
+    -------
+    tuple of str
+        The mode, ``query``, ``compressed`` or ``staged``, and the code, its
+        compressed payload or its staged path respectively.
+    """
+    if mode not in CODE_PAYLOAD_MODES:
+        raise ValueError(
+            f"The code payload must be one of {', '.join(CODE_PAYLOAD_MODES)}, "
+            f"not {mode}"
+        )
+    if mode == "query" or (mode == "auto" and len(quote(code)) <= threshold):
+        return "query", code
+    if mode in ("auto", "compressed"):
+        payload = compress_code(code)
+        if mode == "compressed" or len(payload) <= threshold:
+            return "compressed", payload
+    return "staged", staged_code_name(code)
@@ -0,0 +1,192 @@
+"""Precaching of the JupyterLite output with a service worker.
+
+JupyterLite already registers its own service worker, ``service-worker.js``
+at the root of the lite output, to serve the contents to the kernels. A page
+can only have one service worker per scope, so instead of registering a
+second one over ``lite/``, the precaching code of
+``jupyterlite_sphinx_precache.js`` is prepended to the JupyterLite one, along
+with a manifest of the files to precache and their content hashes. The
+service worker then changes, and is updated by the browsers, only when the
+lite output changes.
+
+The manifest is also written next to the service worker, as
+``jupyterlite_sphinx_precache.json``.
+"""
+
+import fnmatch
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Optional
+
+from ._fingerprint import FileHasher
+
+HERE = Path(__file__).parent
+
+SERVICE_WORKER_FILE = "service-worker.js"
+
+PRECACHE_MANIFEST_FILE = "jupyterlite_sphinx_precache.json"
+
+# Name of the file, stored in the Sphinx doctree directory, which records the
+# digests of the precached files to avoid hashing them again.
+PRECACHE_RECORD_FILE = "jupyterlite_sphinx_precache_files.json"
+
+# The files of the application shell, which are precached: the bundles, the
+# federated extensions, the kernels' static files (Pyodide, wheels,
+# environments), the pages of the apps and their configuration. Patterns are
+# relative to the lite output, where "*" also matches "/".
+SHELL_INCLUDED = [
+    "build/*",
+    "extensions/*",
+    "static/*",
+    "pyodide/*",
+    "pypi/*",
+    "xeus/*",
+    "api/translations/*",
+    "index.html",
+    "*/index.html",
+    "jupyter-lite.json",
+    "*/jupyter-lite.json",
+    "jupyter-lite.ipynb",
+    "*/jupyter-lite.ipynb",
+    "bootstrap.js",
+    "config-utils.js",
+    "manifest.webmanifest",
+    "*.png",
+    "*.ico",
+]
+
+# Files of the lite output which are never precached: the contents, which are
+# served by the JupyterLite service worker and can be large, source maps, the
+# service worker itself and the files used to build the application.
+ALWAYS_EXCLUDED = [
+    "files/*",
+    "api/contents/*",
+    "*.map",
+    SERVICE_WORKER_FILE,
+    "build/service-worker.js",
+    PRECACHE_MANIFEST_FILE,
+    "package.json",
+    "rspack.config*.js",
+    "webpack.config*.js",
+]
+
+_TEMPLATE = HERE / "jupyterlite_sphinx_precache.js"
+_PLACEHOLDER = "__JUPYTERLITE_SPHINX_PRECACHE__"
+_BEGIN = "/* jupyterlite-sphinx precache: begin */\n"
+_END = "/* jupyterlite-sphinx precache: end */\n"
+_PRECACHE_BLOCK = re.compile(re.escape(_BEGIN) + ".*?" + re.escape(_END), re.DOTALL)
+# The precaching code goes after the directive prologue of the service worker,
+# which would otherwise no longer apply.
+_PROLOGUE = re.compile(r"""\s*(?:(["'])use strict\1;?\n?)?""")
+
+
+def _is_excluded(path: str, exclude: list[str]) -> bool:
+    return any(fnmatch.fnmatch(path, pattern) for pattern in exclude)
+
+
+def build_precache_manifest(
+    lite_dir: Path, hasher: FileHasher, exclude: Optional[list[str]] = None
+) -> dict:
+    """The precache manifest of the lite output in ``lite_dir``.
+
+    Parameters
+    ----------
+    lite_dir : Path
+        The JupyterLite output directory.
+    hasher : FileHasher
+        Hashes the files of the lite output.
+    exclude : list of str, optional
+        Glob patterns, relative to ``lite_dir``, of files of the shell not to
+        precache on top of ``ALWAYS_EXCLUDED``.
+
+    Returns
+    -------
+    dict
+        The ``version`` of the manifest, a hash of its ``files``, which maps
+        the path of every precached file of the application shell (matching
+        ``SHELL_INCLUDED``), relative to ``lite_dir``, to a hash of its
+        content.
+    """
+    exclude = [*ALWAYS_EXCLUDED, *(exclude or [])]
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(lite_dir):
+        # Do not even walk the contents.
+        dirnames[:] = sorted(
+            name
+            for name in dirnames
+            if (Path(dirpath) / name).relative_to(lite_dir).as_posix()
+            not in ("files", "api/contents")
+        )
+        for filename in sorted(filenames):
+            path = Path(dirpath) / filename
+            relative = path.relative_to(lite_dir).as_posix()
+            if _is_excluded(relative, SHELL_INCLUDED) and not _is_excluded(
+                relative, exclude
+            ):
+                files[relative] = hasher.digest(path)[:16]
+
+    version = hashlib.sha256(json.dumps(files, sort_keys=True).encode()).hexdigest()
+    return {"version": version[:16], "files": files}
+
+
+def _write_if_changed(path: Path, text: str) -> bool:
+    try:
+        if path.read_text(encoding="utf-8") == text:
+            return False
+    except OSError:
+        pass
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(text, encoding="utf-8")
+    os.replace(tmp_path, path)
+    return True
+
+
+def install_service_worker(lite_dir: Path, manifest: dict) -> bool:
+    """Write the precache ``manifest`` to ``lite_dir`` and prepend the
+    precaching code to its JupyterLite service worker, replacing the one of a
+    previous build.
+
+    Returns
+    -------
+    bool
+        Whether the service worker changed.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the lite output has no service worker.
+    """
+    service_worker = lite_dir / SERVICE_WORKER_FILE
+    original = _PRECACHE_BLOCK.sub("", service_worker.read_text(encoding="utf-8"))
+    precache = _TEMPLATE.read_text(encoding="utf-8").replace(
+        _PLACEHOLDER, json.dumps(manifest, sort_keys=True)
+    )
+
+    _write_if_changed(
+        lite_dir / PRECACHE_MANIFEST_FILE, json.dumps(manifest, indent=1) + "\n"
+    )
+    prologue = _PROLOGUE.match(original).end()
+    return _write_if_changed(
+        service_worker,
+        f"{original[:prologue]}{_BEGIN}{precache}{_END}{original[prologue:]}",
+    )
+
+
+def load_precache_record(record_path: Path) -> dict:
+    try:
+        with open(record_path, encoding="utf-8") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return record if isinstance(record, dict) else {}
+
+
+def save_precache_record(record_path: Path, hasher: FileHasher) -> None:
+    record_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = record_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(hasher.seen, f)
+    os.replace(tmp_path, record_path)
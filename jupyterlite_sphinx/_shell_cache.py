@@ -0,0 +1,203 @@
+"""A cache of the JupyterLite application shell, shared between builds.
+
+Most of what ``jupyter lite build`` writes to its output directory is the
+static application (the lab, notebooks, repl, tree and voici apps, their
+federated extensions, settings, icons, ...), which only depends on the
+installed packages and the JupyterLite configuration, not on the contents.
+The shell is built once, without any contents, into a versioned cache
+directory keyed by those inputs. Each docs build then restores the shell into
+its output directory and only runs the ``contents`` addon on top of it, which
+populates ``files/`` and the ``api/contents`` index.
+"""
+
+import os
+import shutil
+from pathlib import Path
+from typing import Callable
+
+from sphinx.util import logging
+
+from ._fingerprint import FileHasher, compute_build_fingerprint
+from ._staging import place_file
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the layout of the cached shell changes.
+SHELL_CACHE_VERSION = 1
+
+# Parts of the lite output which depend on the contents. They are never
+# restored from the cached shell.
+CONTENTS_OUTPUTS = ["files", "api/contents"]
+
+# Number of shells kept in the cache directory, most recently used first.
+MAX_CACHED_SHELLS = 3
+
+
+def _without_option(build_args: list[str], option: str) -> list[str]:
+    """Remove every ``option value`` pair from ``build_args``."""
+    args = []
+    skip = False
+    for arg in build_args:
+        if skip:
+            skip = False
+        elif arg == option:
+            skip = True
+        else:
+            args.append(arg)
+    return args
+
+
+def shell_build_args(build_args: list[str], output_dir: Path) -> list[str]:
+    """The arguments of a ``jupyter lite build`` of the shell only, i.e.
+    without any contents, into ``output_dir``."""
+    args = _without_option(_without_option(build_args, "--contents"), "--output-dir")
+    return [*args, "--output-dir", str(output_dir)]
+
+
+def contents_build_args(build_args: list[str]) -> list[str]:
+    """The arguments of a ``jupyter lite build`` which only runs the
+    ``contents`` addon."""
+    from jupyterlite_core.addons import get_addon_implementations
+
+    disabled = []
+    for name in sorted(get_addon_implementations()):
+        if name != "contents":
+            disabled.extend(["--disable-addons", name])
+    return [*build_args, *disabled]
+
+
+class ShellCache:
+    """A directory of cached JupyterLite application shells.
+
+    Parameters
+    ----------
+    cache_dir : Path
+        Where the shells are cached. Should be outside of the Sphinx output
+        directory so that it survives clean builds, e.g. in a CI cache.
+    """
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = Path(cache_dir)
+
+    def key(self, build_args: list[str], *, cwd: Path, lite_dir: Path, input_files):
+        """Hash of everything the shell depends on."""
+        fingerprint = compute_build_fingerprint(
+            FileHasher(),
+            command=[
+                f"shell-v{SHELL_CACHE_VERSION}",
+                *shell_build_args(build_args, Path("<output-dir>")),
+            ],
+            cwd=cwd,
+            lite_dir=lite_dir,
+            content_dirs=[],
+            content_files=[],
+            input_files=input_files,
+        )
+        return fingerprint[:32]
+
+    def ensure(self, key: str, build: Callable[[Path], None]) -> Path:
+        """Return the cached shell for ``key``, calling ``build`` with a
+        temporary output directory to create it if it is not cached yet."""
+        shell_dir = self.cache_dir / f"shell-v{SHELL_CACHE_VERSION}-{key}"
+        if shell_dir.is_dir():
+            logger.info(
+                f"[jupyterlite-sphinx] Using the cached JupyterLite shell {shell_dir}"
+            )
+            os.utime(shell_dir)
+            return shell_dir
+
+        logger.info(
+            f"[jupyterlite-sphinx] Building the JupyterLite shell into {shell_dir}"
+        )
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_dir = self.cache_dir / f"{shell_dir.name}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        try:
+            build(tmp_dir)
+            for name in CONTENTS_OUTPUTS:
+                shutil.rmtree(tmp_dir / name, ignore_errors=True)
+            try:
+                os.replace(tmp_dir, shell_dir)
+            except OSError:
+                # Another build cached the same shell in the meantime.
+                if not shell_dir.is_dir():
+                    raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self._prune()
+        return shell_dir
+
+    def _prune(self):
+        shells = sorted(
+            self.cache_dir.glob(f"shell-v{SHELL_CACHE_VERSION}-*"),
+            key=lambda path: path.stat().st_mtime,
+            reverse=True,
+        )
+        for path in shells[MAX_CACHED_SHELLS:]:
+            if ".tmp-" not in path.name:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def restore(self, shell_dir: Path, output_dir: Path) -> int:
+        """Make ``output_dir`` a copy of the cached shell.
+
+        Only the files which are missing from ``output_dir``, or differ from
+        the shell in size or modification time, are placed again. The other
+        files of ``output_dir`` are removed, except for ``CONTENTS_OUTPUTS``,
+        which the contents build updates. Files are cloned when the
+        filesystem supports reflinks, but never hard or symbolic linked: the
+        contents build patches some of them in place, and the output
+        directory must be deployable on its own.
+
+        Returns
+        -------
+        int
+            The number of files placed again.
+        """
+        shell_files = set()
+        restored = 0
+        for dirpath, _, filenames in os.walk(shell_dir):
+            relative_dir = Path(dirpath).relative_to(shell_dir)
+            target_dir = output_dir / relative_dir
+            if target_dir.is_symlink() or target_dir.is_file():
+                target_dir.unlink()
+            target_dir.mkdir(parents=True, exist_ok=True)
+            for name in filenames:
+                shell_files.add(relative_dir / name)
+                source = Path(dirpath) / name
+                target = target_dir / name
+                source_stat = source.stat()
+                if not target.is_symlink() and _signature(target) == (
+                    source_stat.st_size,
+                    source_stat.st_mtime_ns,
+                ):
+                    continue
+                if target.is_dir() and not target.is_symlink():
+                    shutil.rmtree(target)
+                elif target.is_symlink() or target.exists():
+                    # It may be a link, which must not be written through.
+                    target.unlink()
+                place_file(source, target, ["reflink"])
+                # Marks the file as restored, until it is patched.
+                os.utime(target, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+                restored += 1
+
+        for dirpath, dirnames, filenames in os.walk(output_dir):
+            relative_dir = Path(dirpath).relative_to(output_dir)
+            dirnames[:] = [
+                name
+                for name in dirnames
+                if (relative_dir / name).as_posix() not in CONTENTS_OUTPUTS
+            ]
+            for name in filenames:
+                if relative_dir / name not in shell_files:
+                    (Path(dirpath) / name).unlink()
+        return restored
+
+
+def _signature(path: Path):
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
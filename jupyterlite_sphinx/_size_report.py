@@ -0,0 +1,149 @@
+"""Accounting of the size of the JupyterLite contents and output.
+
+At the end of the build, every file staged into the contents directory is
+listed with its source, the document and directive which produced it and its
+size, along with the total size of the lite output, in a JSON report, which
+also accounts for the bytes saved by the notebook transforms. Files or
+outputs larger than the configured budgets are reported as warnings, or fail
+the build.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+# Name of the report file, stored in the Sphinx doctree directory.
+REPORT_FILE = "jupyterlite_sphinx_size_report.json"
+
+SIZE_BUDGET_ACTIONS = ["warning", "error"]
+
+# Producer prefix of the files staged from the ``jupyterlite_contents`` globs.
+_CONTENTS_PRODUCER = "jupyterlite_contents:"
+
+
+class SizeBudgetError(RuntimeError):
+    """Raised when the JupyterLite contents or output exceed their size
+    budget and ``jupyterlite_size_budget_action`` is ``"error"``."""
+
+
+def format_size(size: int) -> str:
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def tree_size(root: Path) -> int:
+    """Total size of the files below ``root``."""
+    size = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            try:
+                size += os.stat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def _describe_producer(producer: str) -> dict:
+    """Split a staging producer into the docname and directive it names."""
+    if producer.startswith(_CONTENTS_PRODUCER):
+        return {
+            "docname": None,
+            "directive": "jupyterlite_contents",
+            "pattern": producer[len(_CONTENTS_PRODUCER) :],
+        }
+    docname, _, directive = producer.rpartition(":")
+    return {"docname": docname or None, "directive": directive}
+
+
+def build_size_report(
+    contents_dir: Path, manifest: dict, lite_dir: Path, lite_size: Optional[int] = None
+) -> dict:
+    """Assemble the size report.
+
+    Parameters
+    ----------
+    contents_dir : Path
+        The contents directory.
+    manifest : dict
+        The staging manifest, mapping every staged file to its entry.
+    lite_dir : Path
+        The output directory of the JupyterLite build.
+    lite_size : int, optional
+        The total size of ``lite_dir``, if known, e.g. from the previous
+        report when the JupyterLite build was skipped. It is computed by
+        walking ``lite_dir`` otherwise.
+    """
+    files = []
+    transform_savings = {}
+    for target, entry in manifest.items():
+        try:
+            size = (contents_dir / target).stat().st_size
+        except OSError:
+            continue
+        file = {
+            "path": target,
+            "source": entry.get("source"),
+            **_describe_producer(entry.get("producer", "")),
+            "size": size,
+        }
+        saved = entry.get("details", {}).get("transforms")
+        if saved:
+            file["transform_savings"] = saved
+            for name, saved_size in saved.items():
+                transform_savings[name] = transform_savings.get(name, 0) + saved_size
+        files.append(file)
+    files.sort(key=lambda file: (-file["size"], file["path"]))
+    return {
+        "contents_dir": str(contents_dir),
+        "contents_size": sum(file["size"] for file in files),
+        "lite_dir": str(lite_dir),
+        "lite_size": tree_size(lite_dir) if lite_size is None else lite_size,
+        "transform_savings": transform_savings,
+        "files": files,
+    }
+
+
+def check_size_budgets(
+    report: dict, *, max_file_size: Optional[int], max_total_size: Optional[int]
+) -> list[str]:
+    """Describe every budget exceeded by the files and output in ``report``."""
+    problems = []
+    if max_file_size is not None:
+        for file in report["files"]:
+            if file["size"] > max_file_size:
+                if file["docname"] is not None:
+                    origin = f"{file['directive']} in {file['docname']}"
+                else:
+                    origin = f"jupyterlite_contents {file['pattern']!r}"
+                problems.append(
+                    f"{file['path']} ({origin}) is {format_size(file['size'])}, "
+                    f"more than jupyterlite_max_file_size "
+                    f"({format_size(max_file_size)})"
+                )
+    if max_total_size is not None and report["lite_size"] > max_total_size:
+        problems.append(
+            f"The JupyterLite output is {format_size(report['lite_size'])}, more "
+            f"than jupyterlite_max_total_size ({format_size(max_total_size)})"
+        )
+    return problems
+
+
+def load_size_report(report_path: Path) -> dict:
+    """The report written by the previous build, or an empty dict."""
+    try:
+        with open(report_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_size_report(report_path: Path, report: dict) -> None:
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = report_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    os.replace(tmp_path, report_path)
@@ -0,0 +1,622 @@
+"""Incremental staging of the contents handed to ``jupyter lite build``.
+
+Every file written to the contents directory (``jupyterlite_content_dir``) is
+recorded in a manifest along with the path of its source, a hash of the inputs
+it was produced from and the producer which created it. Files are only
+rewritten when their inputs change, so their modification times can be relied
+upon, and files that are no longer produced by any document are removed at the
+end of the build.
+
+Documents are read concurrently by ``sphinx-build -j N``, so several worker
+processes may stage the same target at once. Every target is written to a
+temporary file which is then renamed over it, so readers never see a partial
+file, and under a lock file which also records the inputs of the last write,
+so that workers do not redo a write another worker just made.
+
+Generated files can also be kept in a cache directory, keyed by the hash of
+their inputs, so that they are restored rather than generated again when the
+contents directory is lost, e.g. in a fresh checkout.
+
+The functions generating files may return a dict of details about the file
+they wrote, such as the bytes saved by notebook transforms, which is recorded
+in its manifest entry under ``details`` and cached along with it.
+"""
+
+import errno
+import functools
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Optional
+
+from ._fingerprint import file_digest
+
+try:
+    import fcntl
+except ImportError:  # Windows, without reflinks nor parallel reads
+    fcntl = None
+
+# Name of the manifest file, stored in the Sphinx doctree directory.
+MANIFEST_FILE = "jupyterlite_sphinx_staging.json"
+
+# Name of the directory of per-target lock files, next to the manifest.
+LOCK_DIR = "jupyterlite_sphinx_locks"
+
+# Name of the default cache directory of generated files, next to the
+# manifest.
+STAGING_CACHE_DIR = "jupyterlite_sphinx_staging_cache"
+
+# Subdirectory of the cache directory holding the cached files. The cache
+# directory can be configured, and shared with other tools, but only the files
+# of this subdirectory are ever removed.
+STAGING_CACHE_SUBDIR = "jupyterlite-sphinx-staging"
+
+# The ways of placing a verbatim copy of a source file in the contents
+# directory, tried in order, for each value of ``jupyterlite_staging_strategy``.
+# Copying is always the last resort. Symbolic links are never used: the
+# contents addon of JupyterLite resolves the staged paths, and fails on the
+# ones which resolve outside of the contents directory.
+STAGING_STRATEGIES = {
+    "copy": [],
+    "reflink": ["reflink"],
+    "link": ["reflink", "hardlink"],
+}
+
+# ioctl request to clone a file on Linux filesystems supporting reflinks
+# (Btrfs, XFS, ...), from linux/fs.h.
+_FICLONE = 0x40049409
+
+
+def _reflink(source: Path, target: Path) -> None:
+    """Create ``target`` as a copy-on-write clone of ``source``."""
+    if fcntl is None or not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "reflinks are only supported on Linux")
+
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.unlink(target)
+            raise
+
+
+_PLACE_FUNCTIONS = {
+    "reflink": _reflink,
+    "hardlink": os.link,
+}
+
+
+def place_file(source: Path, target: Path, methods: list[str]) -> str:
+    """Place a file with the content of ``source`` at ``target``, trying each
+    of ``methods`` in order and falling back to copying the file.
+
+    Returns
+    -------
+    str
+        The method which was used.
+    """
+    for method in methods:
+        try:
+            _PLACE_FUNCTIONS[method](source, target)
+        except (OSError, NotImplementedError):
+            # e.g. no reflink support or cross-device link.
+            continue
+        return method
+
+    shutil.copyfile(source, target)
+    return "copy"
+
+
+def _stat_signature(path: Path):
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _locked(lock_path: Path):
+    """Hold an exclusive lock on ``lock_path`` and yield its open file.
+
+    The lock is shared between processes where ``fcntl`` is available, and
+    only between threads of the current process otherwise.
+    """
+    with _thread_locks_guard:
+        thread_lock = _thread_locks.setdefault(str(lock_path), threading.Lock())
+    with thread_lock:
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(lock_path, "a+", encoding="utf-8") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield f
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def hash_inputs(*parts) -> str:
+    """Hash a sequence of strings or bytes into a single input hash."""
+    sha = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        sha.update(part)
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+class StagingArea:
+    """The contents directory handed to ``jupyter lite build``.
+
+    Parameters
+    ----------
+    root : Path
+        The contents directory.
+    manifest_path : Path
+        Where the manifest of staged files is persisted between builds.
+    strategy : str
+        How verbatim copies of source files are staged, one of the keys of
+        ``STAGING_STRATEGIES``.
+    cache_dir : Path, optional
+        Where generated files are cached, keyed by the hash of their inputs,
+        in its ``STAGING_CACHE_SUBDIR`` subdirectory.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        manifest_path: Path,
+        strategy: str = "copy",
+        cache_dir: Optional[Path] = None,
+    ):
+        self.root = Path(root)
+        self.manifest_path = Path(manifest_path)
+        self.cache_dir = (
+            Path(cache_dir) / STAGING_CACHE_SUBDIR if cache_dir is not None else None
+        )
+        if strategy not in STAGING_STRATEGIES:
+            raise ValueError(
+                f"Unknown staging strategy {strategy!r}, expected one of "
+                f"{', '.join(STAGING_STRATEGIES)}"
+            )
+        self.place_methods = STAGING_STRATEGIES[strategy]
+        self._manifest = None
+
+    @property
+    def manifest(self) -> dict:
+        """Mapping of target path, relative to the contents directory, to its
+        manifest entry. Lazily loaded from disk."""
+        if self._manifest is None:
+            try:
+                with open(self.manifest_path, encoding="utf-8") as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                manifest = {}
+            self._manifest = manifest if isinstance(manifest, dict) else {}
+        return self._manifest
+
+    def _relative(self, target) -> str:
+        return Path(target).as_posix()
+
+    def _tmp_path(self, target_path: Path) -> Path:
+        return target_path.with_name(
+            f".{target_path.name}.{os.getpid()}-{threading.get_ident()}.tmp"
+        )
+
+    def _cache_path(self, target: str, input_hash: str) -> Optional[Path]:
+        if self.cache_dir is None:
+            return None
+        return self.cache_dir / f"{input_hash}{Path(target).suffix}"
+
+    def _details_path(self, cache_path: Path) -> Path:
+        return cache_path.with_name(f"{cache_path.name.split('.', 1)[0]}.details.json")
+
+    def _restore_cached(self, cache_path: Optional[Path], path: Path) -> Optional[dict]:
+        """Place the cached file at ``path``, if it is cached, and return its
+        details."""
+        if cache_path is None or not cache_path.is_file():
+            return None
+        place_file(cache_path, path, ["reflink"])
+        try:
+            with open(self._details_path(cache_path), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _store_cached(
+        self, path: Path, cache_path: Optional[Path], details: Optional[dict] = None
+    ) -> None:
+        if cache_path is None:
+            return
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        if details:
+            with open(self._details_path(cache_path), "w", encoding="utf-8") as f:
+                json.dump(details, f)
+        tmp_path = self._tmp_path(cache_path)
+        try:
+            # Never hard link the cached file to the staged one, which could
+            # then be modified through it.
+            place_file(path, tmp_path, ["reflink"])
+            os.replace(tmp_path, cache_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def _cached(
+        self, target: str, input_hash: str, write: Callable[[Path], Optional[dict]]
+    ) -> Callable[[Path], Optional[dict]]:
+        """Wrap ``write`` to restore its output from the cache, or to store it
+        there."""
+        cache_path = self._cache_path(target, input_hash)
+        if cache_path is None:
+            return write
+
+        def cached_write(path):
+            details = self._restore_cached(cache_path, path)
+            if details is None:
+                details = write(path)
+                self._store_cached(path, cache_path, details)
+            return details
+
+        return cached_write
+
+    def _write(
+        self, target: str, input_hash: str, write: Callable[[Path], Optional[dict]]
+    ) -> Optional[dict]:
+        """Call ``write`` with a temporary path, then atomically rename it to
+        ``target``, unless another process wrote ``target`` from the same
+        inputs while we were waiting for the lock. Returns the details
+        returned by ``write``, if it was called."""
+        target_path = self.root / target
+        lock_name = hashlib.sha1(target.encode()).hexdigest()
+        with _locked(self.manifest_path.parent / LOCK_DIR / lock_name) as lock:
+            lock.seek(0)
+            if not target_path.is_symlink() and lock.read() == json.dumps(
+                [input_hash, _stat_signature(target_path)]
+            ):
+                return None
+
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            # Renaming over the target also never writes through a previous
+            # target which was linked to its source.
+            tmp_path = self._tmp_path(target_path)
+            try:
+                details = write(tmp_path)
+                os.replace(tmp_path, target_path)
+            finally:
+                if tmp_path.is_symlink() or tmp_path.exists():
+                    tmp_path.unlink()
+
+            lock.seek(0)
+            lock.truncate()
+            lock.write(json.dumps([input_hash, _stat_signature(target_path)]))
+        return details
+
+    def _is_current(self, target: str, input_hash: str) -> bool:
+        entry = self.manifest.get(target)
+        return (
+            entry is not None
+            and entry.get("hash") == input_hash
+            and entry.get("target_stat") == _stat_signature(self.root / target)
+            # Staged as a symbolic link by previous versions.
+            and not (self.root / target).is_symlink()
+        )
+
+    def _source_digest(self, target: str, source: Path) -> str:
+        # Avoid re-reading sources whose size and mtime are the ones recorded
+        # when the target was last staged.
+        entry = self.manifest.get(target)
+        signature = _stat_signature(source)
+        if (
+            entry is not None
+            and entry.get("source") == str(source)
+            and entry.get("source_stat") == signature
+            and "source_digest" in entry
+        ):
+            return entry["source_digest"]
+        return file_digest(source)
+
+    def _record(
+        self,
+        target: str,
+        *,
+        source,
+        input_hash: str,
+        producer: str,
+        source_digest: Optional[str] = None,
+        details: Optional[dict] = None,
+    ) -> dict:
+        entry = {
+            "source": str(source) if source is not None else None,
+            "hash": input_hash,
+            "producer": producer,
+            "target_stat": _stat_signature(self.root / target),
+        }
+        if source_digest is not None:
+            entry["source_stat"] = _stat_signature(source)
+            entry["source_digest"] = source_digest
+        if details is None:
+            # The file was not written again, keep the details of the
+            # previous write.
+            previous = self.manifest.get(target)
+            if previous is not None and previous.get("hash") == input_hash:
+                details = previous.get("details")
+        if details:
+            entry["details"] = details
+        self.manifest[target] = entry
+        return entry
+
+    def stage_generated(
+        self,
+        target,
+        *,
+        source: Path,
+        producer: str,
+        write: Callable[[Path], Optional[dict]],
+        options: str = "",
+        cache: bool = True,
+    ) -> dict:
+        """Stage a file generated from ``source`` by ``write``.
+
+        ``write`` is only called, with the absolute target path, when the
+        source content or ``options`` changed since the target was last
+        written, and must write the file to that path, which is a temporary
+        path renamed to the target afterwards. It may return a dict of
+        details about the file, recorded in its manifest entry. ``options``
+        must describe everything besides the source content that affects the
+        output of ``write``. If ``cache`` is True and the staging area has a
+        cache directory, the output of ``write`` is cached.
+
+        Returns
+        -------
+        dict
+            The manifest entry of the staged file.
+        """
+        target = self._relative(target)
+        source = Path(source)
+        source_digest = self._source_digest(target, source)
+        input_hash = hash_inputs(options, source_digest)
+        details = None
+        if not self._is_current(target, input_hash):
+            if cache:
+                write = self._cached(target, input_hash, write)
+            details = self._write(target, input_hash, write)
+        return self._record(
+            target,
+            source=source,
+            input_hash=input_hash,
+            producer=producer,
+            source_digest=source_digest,
+            details=details,
+        )
+
+    def stage_generated_many(self, items: list[dict], *, max_workers=None) -> dict:
+        """Stage many generated files at once.
+
+        Unlike :meth:`stage_generated`, this is not safe to call concurrently
+        from several processes for the same targets.
+
+        Parameters
+        ----------
+        items : list of dict
+            The keyword arguments of :meth:`stage_generated` for each file,
+            with the target path under the ``target`` key. The ``write``
+            functions must be picklable.
+        max_workers : int, optional
+            Size of the process pool running the ``write`` functions of the
+            stale files, defaults to the number of CPUs. The files are written
+            in the current process if only one of them is stale or if
+            ``max_workers`` is 1.
+
+        Returns
+        -------
+        dict
+            The manifest entry of each staged file, or the exception raised
+            while staging it, keyed by target path.
+        """
+        results = {}
+        pending = []
+        for item in items:
+            target = self._relative(item["target"])
+            source = Path(item["source"])
+            try:
+                source_digest = self._source_digest(target, source)
+            except OSError as e:
+                results[target] = e
+                continue
+            input_hash = hash_inputs(item.get("options", ""), source_digest)
+            record = functools.partial(
+                self._record,
+                target,
+                source=source,
+                input_hash=input_hash,
+                producer=item["producer"],
+                source_digest=source_digest,
+            )
+            if self._is_current(target, input_hash):
+                results[target] = record()
+            else:
+                cache_path = self._cache_path(target, input_hash)
+                pending.append((target, item["write"], record, cache_path))
+
+        # Restore the cached files first, to only run the remaining writes on
+        # the process pool.
+        to_write = []
+        for target, write, record, cache_path in pending:
+            target_path = self.root / target
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._tmp_path(target_path)
+            details = self._restore_cached(cache_path, tmp_path)
+            if details is not None:
+                os.replace(tmp_path, target_path)
+                results[target] = record(details=details)
+            else:
+                to_write.append((target, write, record, cache_path, tmp_path))
+
+        executor = None
+        if len(to_write) > 1 and (max_workers is None or max_workers > 1):
+            executor = ProcessPoolExecutor(max_workers=max_workers)
+        try:
+            submitted = []
+            for target, write, record, cache_path, tmp_path in to_write:
+                if executor is not None:
+                    future = executor.submit(write, tmp_path)
+                else:
+                    future = Future()
+                    try:
+                        details = write(tmp_path)
+                    except Exception as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(details)
+                submitted.append((target, tmp_path, record, cache_path, future))
+
+            for target, tmp_path, record, cache_path, future in submitted:
+                try:
+                    details = future.result()
+                    self._store_cached(tmp_path, cache_path, details)
+                    os.replace(tmp_path, self.root / target)
+                except Exception as e:
+                    results[target] = e
+                else:
+                    results[target] = record(details=details)
+                finally:
+                    if tmp_path.exists():
+                        tmp_path.unlink()
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return results
+
+    def stage_file(self, target, *, source: Path, producer: str) -> dict:
+        """Stage a verbatim copy of ``source``, linking it rather than copying
+        it if the staging strategy and the filesystem allow it."""
+        source = Path(source)
+        target = self._relative(target)
+        if Path(os.path.realpath(source)) == Path(os.path.realpath(self.root)) / target:
+            # The source already lives in the contents directory.
+            return self._record(target, source=source, input_hash="", producer=producer)
+
+        def write(path):
+            place_file(source, path, self.place_methods)
+
+        return self.stage_generated(
+            target,
+            source=source,
+            producer=producer,
+            write=write,
+            options="copy",
+            cache=False,
+        )
+
+    def stage_files(self, files, *, producer: str, max_workers=None) -> dict:
+        """Stage verbatim copies of many files concurrently.
+
+        Parameters
+        ----------
+        files : iterable of (target, source) pairs
+            The files to stage.
+        producer : str
+            The producer of all the files.
+        max_workers : int, optional
+            Size of the thread pool, defaults to the one of
+            ``concurrent.futures.ThreadPoolExecutor``.
+
+        Returns
+        -------
+        dict
+            Manifest entries of the staged files, keyed by target path.
+        """
+        files = [(self._relative(target), source) for target, source in files]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            entries = executor.map(
+                lambda item: self.stage_file(
+                    item[0], source=item[1], producer=producer
+                ),
+                files,
+            )
+            return {target: entry for (target, _), entry in zip(files, entries)}
+
+    def stage_content(
+        self,
+        target,
+        content: str,
+        *,
+        producer: str,
+        source: Optional[str] = None,
+        details: Optional[dict] = None,
+    ) -> dict:
+        """Stage a file with the given text ``content``, generated from
+        ``source``, recording ``details`` about it in its manifest entry."""
+        target = self._relative(target)
+        input_hash = hash_inputs(content)
+        if not self._is_current(target, input_hash):
+
+            def write(path):
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(content)
+
+            self._write(target, input_hash, write)
+        return self._record(
+            target,
+            source=source,
+            input_hash=input_hash,
+            producer=producer,
+            details=details,
+        )
+
+    def finalize(self, entries: dict[str, dict]) -> list[str]:
+        """Remove every file of the contents directory which is not in
+        ``entries``, then persist ``entries`` as the new manifest.
+
+        Parameters
+        ----------
+        entries : dict
+            Manifest entries of every file staged by the current build, keyed
+            by target path.
+
+        Returns
+        -------
+        list of str
+            The removed files, relative to the contents directory.
+        """
+        removed = []
+        for dirpath, dirnames, filenames in os.walk(self.root, topdown=False):
+            for filename in filenames:
+                path = Path(dirpath) / filename
+                target = path.relative_to(self.root).as_posix()
+                if target not in entries:
+                    path.unlink()
+                    removed.append(target)
+            if Path(dirpath) != self.root and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+        # Only needed while documents are read.
+        shutil.rmtree(self.manifest_path.parent / LOCK_DIR, ignore_errors=True)
+
+        # Only keep the cached versions of the staged files.
+        if self.cache_dir is not None and self.cache_dir.is_dir():
+            hashes = {entry["hash"] for entry in entries.values()}
+            for path in self.cache_dir.iterdir():
+                if path.name.split(".", 1)[0] not in hashes:
+                    path.unlink()
+
+        self._manifest = dict(entries)
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+        return sorted(removed)
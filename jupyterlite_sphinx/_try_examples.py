@@ -1,3 +1,4 @@
+import functools
 import re
 
 import nbformat as nbf
@@ -143,55 +144,37 @@ def _append_code_cell_and_clear_lines(code_lines, output_lines, notebook):
 
 def _append_markdown_cell_and_clear_lines(markdown_lines, notebook):
     """Append new markdown cell to notebook, clearing lines."""
-    markdown_text = "\n".join(markdown_lines)
-    markdown_text = _process_latex(markdown_text)
-    markdown_text = _process_literal_blocks(markdown_text)
-    markdown_text = _strip_ref_identifiers(markdown_text)
-    markdown_text = _convert_links(markdown_text)
-    notebook.cells.append(new_markdown_cell(markdown_text))
+    notebook.cells.append(new_markdown_cell(_compile_markdown(markdown_lines)))
     markdown_lines.clear()
 
 
+_inline_math_pattern = re.compile(r":math:\s*`(?P<latex>.*?)`", flags=re.DOTALL)
+# Sphinx style links have the form `link text <url>`_, converted to markdown
+# links [link text](url). Each docstring gets a unique identifier in order to
+# have unique internal links for each docstring on a page, references look
+# like [R4c2dbc17006a-1]_ and are converted to [1].
+_inline_pattern = re.compile(
+    r"(?P<ref>\[R[a-f0-9]+-(?P<ref_num>\d+)\]_)"
+    r"|`(?P<link_text>[^`<]+)<(?P<url>[^`>]+)>`_"
+)
 _ref_identifier_pattern = re.compile(r"\[R[a-f0-9]+-(?P<ref_num>\d+)\]_")
-_link_pattern = re.compile(r"`(?P<link_text>[^`<]+)<(?P<url>[^`>]+)>`_")
 
 
-def _convert_sphinx_link(match):
-    link_text = match.group("link_text").rstrip()
-    url = match.group("url")
+def _convert_inline(match):
+    if match.group("ref") is not None:
+        return f"[{match.group('ref_num')}]"
+    # The references within a link are converted as well.
+    link_text = _ref_identifier_pattern.sub(
+        r"[\g<ref_num>]", match.group("link_text")
+    ).rstrip()
+    url = _ref_identifier_pattern.sub(r"[\g<ref_num>]", match.group("url"))
     return f"[{link_text}]({url})"
 
 
-def _convert_links(md_text):
-    """Convert sphinx style links to markdown style links
-
-    Sphinx style links have the form `link text <url>`_. Converts to
-    markdown format [link text](url).
-    """
-    return _link_pattern.sub(_convert_sphinx_link, md_text)
-
-
-def _strip_ref_identifiers(md_text):
-    """Remove identifiers from references in notebook.
-
-    Each docstring gets a unique identifier in order to have unique internal
-    links for each docstring on a page.
-
-    They look like [R4c2dbc17006a-1]_. We strip these out so they don't appear
-    in the notebooks. The above would be replaced with [1]_.
-    """
-    return _ref_identifier_pattern.sub(r"[\g<ref_num>]", md_text)
-
-
-def _process_latex(md_text):
-    # Map rst latex directive to $ so latex renders in notebook.
-    md_text = re.sub(
-        r":math:\s*`(?P<latex>.*?)`", r"$\g<latex>$", md_text, flags=re.DOTALL
-    )
-
-    lines = md_text.split("\n")
+def _math_blocks(lines):
+    """Yield ``lines`` with the ``.. math::`` blocks replaced by ``$$``
+    wrapped equations, one per group of non-blank lines."""
     in_math_block = False
-    wrapped_lines = []
     equation_lines = []
 
     for line in lines:
@@ -199,74 +182,74 @@ def _process_latex(md_text):
             in_math_block = True
             continue  # Skip the '.. math::' line
 
-        if in_math_block:
-            if line.strip() == "":
-                if equation_lines:
-                    # Join and wrap the equations, then reset
-                    wrapped_lines.append(f"$$ {' '.join(equation_lines)} $$")
-                    equation_lines = []
-            elif line.startswith((" ", "\t")):
-                equation_lines.append(line.strip())
+        if not in_math_block:
+            yield line
+        elif not line.strip():
+            if equation_lines:
+                yield f"$$ {' '.join(equation_lines)} $$"
+                equation_lines = []
+        elif line.startswith((" ", "\t")):
+            equation_lines.append(line.strip())
         else:
-            wrapped_lines.append(line)
-
-        # If you leave the indented block, the math block ends
-        if in_math_block and not (line.startswith((" ", "\t")) or line.strip() == ""):
+            # If you leave the indented block, the math block ends
             in_math_block = False
             if equation_lines:
-                wrapped_lines.append(f"$$ {' '.join(equation_lines)} $$")
+                yield f"$$ {' '.join(equation_lines)} $$"
             equation_lines = []
-            wrapped_lines.append(line)
+            yield line
 
     # Handle the case where the text ends with a math block
     if in_math_block and equation_lines:
-        wrapped_lines.append(f"$$ {' '.join(equation_lines)} $$")
+        yield f"$$ {' '.join(equation_lines)} $$"
 
-    return "\n".join(wrapped_lines)
 
+def _compile_markdown(lines):
+    """Convert the reST lines of a markdown cell to markdown.
+
+    Inline and block LaTeX become ``$`` and ``$$`` delimited math, literal
+    blocks become fenced code blocks, and Sphinx links and references become
+    markdown ones. This takes at most three passes: a substitution of the
+    inline math on the text of the cell, only when it contains ``:math:``,
+    since inline math may span several lines, a streaming pass over the lines
+    for the math and literal blocks, and a substitution of the references and
+    links on the resulting text.
+    """
+    if any(":math:" in line or "\n" in line for line in lines):
+        # Inline math may span several lines.
+        lines = _inline_math_pattern.sub(r"$\g<latex>$", "\n".join(lines)).split("\n")
 
-def _process_literal_blocks(md_text):
-    md_lines = md_text.split("\n")
     new_lines = []
     in_literal_block = False
     literal_block_accumulator = []
 
-    for line in md_lines:
-        indent_level = len(line) - len(line.lstrip())
-
-        if in_literal_block and (indent_level > 0 or line.strip() == ""):
+    for line in _math_blocks(lines):
+        if in_literal_block and (not line or line[0].isspace()):
             literal_block_accumulator.append(line.lstrip())
-        elif in_literal_block:
-            new_lines.extend(["```"] + literal_block_accumulator + ["```"])
+            continue
+        if in_literal_block:
+            new_lines.append("```")
+            new_lines.extend(literal_block_accumulator)
+            new_lines.append("```")
             literal_block_accumulator = []
-            if line.endswith("::"):
-                # If the line endswith ::, a new literal block is starting.
-                line = line[:-2]  # Strip off the :: from the end
-                if not line:
-                    # If the line contains only ::, we ignore it.
-                    continue
-            else:
-                # Only set in_literal_block to False if not starting new
-                # literal block.
-                in_literal_block = False
-            # We've appended the entire literal block which just ended, but
-            # still need to append the current line.
-            new_lines.append(line)
-        else:
-            if line.endswith("::"):
-                # A literal block is starting.
-                in_literal_block = True
-                line = line[:-2]
-                if not line:
-                    # As above, if the line contains only ::, ignore it.
-                    continue
-            new_lines.append(line)
+            # Unless a new literal block is starting, the literal block ends.
+            in_literal_block = line.endswith("::")
+        elif line.endswith("::"):
+            # A literal block is starting.
+            in_literal_block = True
+        if in_literal_block:
+            # Strip off the :: from the end, and ignore lines with only ::.
+            line = line[:-2]
+            if not line:
+                continue
+        new_lines.append(line)
 
     if literal_block_accumulator:
         # Handle case where a literal block ends the markdown cell.
-        new_lines.extend(["```"] + literal_block_accumulator + ["```"])
+        new_lines.append("```")
+        new_lines.extend(literal_block_accumulator)
+        new_lines.append("```")
 
-    return "\n".join(new_lines)
+    return _inline_pattern.sub(_convert_inline, "\n".join(new_lines))
 
 
 # try_examples identifies section headers after processing by numpydoc or
@@ -280,8 +263,11 @@ def _process_literal_blocks(md_text):
 # headers and processing it with both numpydoc and sphinx.ext.napoleon.
 
 # Examples section is a rubric for numpydoc and can be configured to be
-# either a rubric or admonition in sphinx.ext.napoleon.
-_examples_start_pattern = re.compile(r".. (rubric|admonition):: Examples")
+# either a rubric or admonition in sphinx.ext.napoleon. The header is found by
+# its ":: Examples" suffix, the rest of it being checked behind.
+_examples_start_pattern = re.compile(
+    r"::\ Examples(?:(?<=..\ rubric::\ Examples)|(?<=..\ admonition::\ Examples))"
+)
 # Newer versions of numpydoc enforce section order and only Attributes
 # and Methods sections can appear after an Examples section. All potential
 # numpydoc section headers are included here to support older or custom
@@ -289,46 +275,66 @@ _examples_start_pattern = re.compile(r".. (rubric|admonition):: Examples")
 # custom version of numpydoc which allows for arbitrary section order.
 # sphinx.ext.napoleon allows for arbitrary section order and all potential
 # headers are included.
-_next_section_headers = [
+#
+# The headers are grouped by the character they are anchored on, ".", ":" or
+# "!", so that the regex engine only tries to match them where one of these
+# characters is.
+
+# Headers made of any character followed by ". " and the rest of the header,
+# anchored on their second character.
+_dot_headers = [
     # Notes and References appear as rubrics in numpydoc and
     # can be configured to appear as either a rubric or
     # admonition in sphinx.ext.napoleon.
-    r".\.\ rubric:: Notes",
-    r".\.\ rubric:: References",
-    r".\.\ admonition:: Notes",
-    r".\.\ admonition:: References",
+    r"rubric::\ Notes",
+    r"rubric::\ References",
+    r"admonition::\ Notes",
+    r"admonition::\ References",
     # numpydoc only headers
-    r":Attributes:",
-    r".\.\ rubric:: Methods",
-    r":Other Parameters:",
-    r":Parameters:",
-    r":Raises:",
-    r":Returns:",
-    # If examples section is last, processed by numpydoc may appear at end.
-    r"\!\! processed by numpydoc \!\!",
-    # sphinx.ext.napoleon only headers
-    r"\.\. attribute::",
-    r"\.\. method::",
-    r":param .+:",
-    r":raises .+:",
-    r":returns:",
+    r"rubric::\ Methods",
     # Headers generated by both extensions
-    r".\.\ seealso::",
-    r":Yields:",
-    r":Warns:",
+    r"seealso::",
     # directives which can start a section with sphinx.ext.napoleon
     # with no equivalent when using numpydoc.
-    r".\.\ attention::",
-    r".\.\ caution::",
-    r".\.\ danger::",
-    r".\.\ error::",
-    r".\.\ hint::",
-    r".\.\ important::",
-    r".\.\ tip::",
-    r".\.\ todo::",
-    r".\.\ warning::",
+    r"attention::",
+    r"caution::",
+    r"danger::",
+    r"error::",
+    r"hint::",
+    r"important::",
+    r"tip::",
+    r"todo::",
+    r"warning::",
+]
+# sphinx.ext.napoleon only headers, starting with "..".
+_dot_dot_headers = [
+    r"attribute::",
+    r"method::",
+]
+# Headers starting with ":".
+_colon_headers = [
+    # numpydoc only headers
+    r"Attributes:",
+    r"Other\ Parameters:",
+    r"Parameters:",
+    r"Raises:",
+    r"Returns:",
+    # sphinx.ext.napoleon only headers
+    r"param\ .+:",
+    r"raises\ .+:",
+    r"returns:",
+    # Headers generated by both extensions
+    r"Yields:",
+    r"Warns:",
 ]
-_next_section_pattern = re.compile("|".join(_next_section_headers))
+_next_section_pattern = re.compile(
+    rf"\.(?:(?<=..)\ (?:{'|'.join(_dot_headers)})"
+    rf"|\.\ (?:{'|'.join(_dot_dot_headers)}))"
+    rf"|:(?:{'|'.join(_colon_headers)})"
+    # If examples section is last, processed by numpydoc may appear at end.
+    r"|!!\ processed\ by\ numpydoc\ !!"
+)
+_processed_by_numpydoc_pattern = re.compile(r"\.\.\s+\!\! processed by numpy doc \!\!")
 
 
 def insert_try_examples_directive(lines, **options):
@@ -352,15 +358,31 @@ def insert_try_examples_directive(lines, **options):
         inserted in the Examples section (if one exists) with all Examples content
         indented beneath it. Does nothing if the comment ".. disable_try_examples"
         is included at the top of the Examples section. Also a no-op if the
-        try_examples directive is already included.
+        try_examples directive is already included. The input docstring itself
+        is returned when it is left unchanged.
     """
     # Search for start of an Examples section
-    for left_index, line in enumerate(lines):
+    for line in lines:
         if _examples_start_pattern.search(line):
             break
     else:
         # No Examples section found
-        return lines[:]
+        return lines
+
+    # The same docstrings are processed many times, for instance the ones of
+    # inherited methods.
+    new_lines = _insert_try_examples_directive(tuple(lines), tuple(options.items()))
+    return lines if new_lines is None else list(new_lines)
+
+
+@functools.lru_cache(maxsize=1024)
+def _insert_try_examples_directive(lines, options):
+    """The lines of ``insert_try_examples_directive``, as a tuple, or None if
+    the docstring is left unchanged."""
+    # Search for start of an Examples section
+    for left_index, line in enumerate(lines):
+        if _examples_start_pattern.search(line):
+            break
 
     # Jump to next line
     left_index += 1
@@ -369,17 +391,17 @@ def insert_try_examples_directive(lines, **options):
         left_index += 1
     if left_index == len(lines):
         # Examples section had no content, no need to insert directive.
-        return lines[:]
+        return None
 
     # Check for the ".. disable_try_examples" comment.
     if lines[left_index].strip() == ".. disable_try_examples":
         # If so, do not insert directive.
-        return lines[:]
+        return None
 
     # Check if the ".. try_examples::" directive already exists
     if ".. try_examples::" == lines[left_index].strip():
         # If so, don't need to insert again.
-        return lines[:]
+        return None
 
     # Find the end of the Examples section
     right_index = left_index
@@ -393,9 +415,7 @@ def insert_try_examples_directive(lines, **options):
         right_index < len(lines)
         and "!! processed by numpydoc !!" in lines[right_index]
         # Sometimes the .. appears on an earlier line than !! processed by numpydoc !!
-        and not re.search(
-            r"\.\.\s+\!\! processed by numpy doc \!\!", lines[right_index]
-        )
+        and not _processed_by_numpydoc_pattern.search(lines[right_index])
     ):
         while right_index > 0 and lines[right_index].strip() != "..":
             right_index -= 1
@@ -403,14 +423,14 @@ def insert_try_examples_directive(lines, **options):
     # Add the ".. try_examples::" directive and indent the content of the Examples section
     new_lines = (
         lines[:left_index]
-        + [".. try_examples::"]
-        + [f"    :{key}: {value}" for key, value in options.items()]
-        + [""]
-        + ["    " + line for line in lines[left_index:right_index]]
+        + (".. try_examples::",)
+        + tuple(f"    :{key}: {value}" for key, value in options)
+        + ("",)
+        + tuple("    " + line for line in lines[left_index:right_index])
     )
 
     # Append the remainder of the docstring, if there is any
     if right_index < len(lines):
-        new_lines += [""] + lines[right_index:]
+        new_lines += ("",) + lines[right_index:]
 
     return new_lines
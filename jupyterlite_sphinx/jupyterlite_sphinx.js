@@ -1,7 +1,33 @@
-window.jupyterliteShowIframe = (tryItButtonId, iframeSrc) => {
-  const tryItButton = document.getElementById(tryItButtonId);
+/* The root of the docs, jupyterlite_sphinx.js being in its _static/
+ * directory. document.currentScript is only set while the script runs. */
+const jupyterliteDocsRoot = document.currentScript
+  ? new URL("../", document.currentScript.src).href
+  : window.location.href;
+
+/* Iframes booted ahead of a click by the warm-up (see jupyterliteWarmup),
+ * keyed by their "Try It Live!" button. */
+const jupyterliteWarmIframes = new WeakMap();
+
+/* An iframe for iframeSrc, or for the src a promise resolves to (see
+ * jupyterliteResolveIframeSrc). */
+const jupyterliteCreateIframe = (iframeSrc) => {
   const iframe = document.createElement("iframe");
-  const buttonRect = tryItButton.getBoundingClientRect();
+  if (typeof iframeSrc === "string") {
+    iframe.src = iframeSrc;
+  } else {
+    iframeSrc.then((src) => {
+      iframe.src = src;
+    });
+  }
+  iframe.width = iframe.height = "100%";
+  iframe.classList.add("jupyterlite_sphinx_iframe");
+  return iframe;
+};
+
+/* Replace the "Try It Live!" button of a directive with the :prompt: option
+ * by its iframe. */
+const jupyterliteShowPromptIframe = (tryItButton, iframeSrc) => {
+  let iframe = jupyterliteWarmIframes.get(tryItButton);
 
   const spinner = document.createElement("div");
   // hardcoded spinner height and width needs to match what is in css.
@@ -13,17 +39,34 @@ window.jupyterliteShowIframe = (tryItButtonId, iframeSrc) => {
   spinner.style.marginTop = `-${spinnerHeight / 2}px`;
   spinner.style.marginLeft = `-${spinnerWidth / 2}px`;
 
-  iframe.src = iframeSrc;
-  iframe.width = iframe.height = "100%";
-  iframe.classList.add("jupyterlite_sphinx_iframe");
-
   tryItButton.style.display = "none";
   spinner.style.display = "block";
 
-  tryItButton.parentNode.appendChild(spinner);
-  tryItButton.parentNode.appendChild(iframe);
+  if (iframe) {
+    jupyterliteWarmIframes.delete(tryItButton);
+    tryItButton.parentNode.insertBefore(spinner, iframe);
+    iframe.style.display = "";
+  } else {
+    iframe = jupyterliteCreateIframe(iframeSrc);
+    tryItButton.parentNode.appendChild(spinner);
+    tryItButton.parentNode.appendChild(iframe);
+  }
 };
 
+window.jupyterliteShowIframe = (tryItButtonId, iframeSrc) =>
+  jupyterliteShowPromptIframe(
+    document.getElementById(tryItButtonId),
+    iframeSrc,
+  );
+
+/* The iframe src of the container of a directive with the :prompt: option,
+ * along with the search parameters of the page it forwards. */
+const jupyterlitePromptIframeSrc = (container) =>
+  window.jupyterliteConcatSearchParams(
+    container.dataset.iframeSrc,
+    JSON.parse(container.dataset.searchParams || "false"),
+  );
+
 window.jupyterliteConcatSearchParams = (iframeSrc, params) => {
   const baseURL = window.location.origin;
   const iframeUrl = new URL(iframeSrc, baseURL);
@@ -52,6 +95,165 @@ window.jupyterliteConcatSearchParams = (iframeSrc, params) => {
   }
 };
 
+/* The iframe src of a replite directive which passes its code in the
+ * data-code-payload or data-code-path attribute of element, rather than in
+ * the query string of iframeSrc (see replite_code_payload). */
+const jupyterliteResolveIframeSrc = async (element, iframeSrc) => {
+  const { codePayload, codePath } = element.dataset;
+  if (!codePayload && !codePath) {
+    return iframeSrc;
+  }
+  let code;
+  try {
+    if (codePayload) {
+      // zlib-compressed and base64url-encoded.
+      const base64 = codePayload.replace(/-/g, "+").replace(/_/g, "/");
+      const bytes = Uint8Array.from(atob(base64), (c) => c.charCodeAt(0));
+      const stream = new Blob([bytes])
+        .stream()
+        .pipeThrough(new DecompressionStream("deflate"));
+      code = await new Response(stream).text();
+    } else {
+      // Staged in the JupyterLite contents.
+      const response = await fetch(codePath);
+      if (!response.ok) {
+        throw new Error(`${response.status} ${response.statusText}`);
+      }
+      code = await response.text();
+    }
+  } catch (error) {
+    console.error("Could not load the code of the REPL", error);
+    return iframeSrc;
+  }
+  const [path, query] = iframeSrc.split("?");
+  const params = new URLSearchParams(query || "");
+  params.append("code", code);
+  return `${path}?${params.toString()}`;
+};
+
+/* Iframes with lazy loading (see jupyterlite_iframe_loading) only get their
+ * src once they come close to the viewport, and at most
+ * window.jupyterliteMaxConcurrentIframes of them boot at the same time, the
+ * others waiting until one of them is loaded. */
+window.jupyterliteLazyIframes = (() => {
+  const queue = [];
+  let booting = 0;
+  // Do not hold a slot forever for an iframe which never loads.
+  const bootTimeout = 30000; // ms
+
+  const maxConcurrent = () => {
+    const max = parseInt(window.jupyterliteMaxConcurrentIframes);
+    return max > 0 ? max : Infinity;
+  };
+
+  const bootNext = () => {
+    while (queue.length && booting < maxConcurrent()) {
+      const iframe = queue.shift();
+      let released = false;
+      const release = () => {
+        if (!released) {
+          released = true;
+          booting -= 1;
+          bootNext();
+        }
+      };
+      booting += 1;
+      iframe.addEventListener("load", release, { once: true });
+      iframe.addEventListener("error", release, { once: true });
+      setTimeout(release, bootTimeout);
+      jupyterliteResolveIframeSrc(iframe, iframe.dataset.src).then((src) => {
+        iframe.src = src;
+      });
+    }
+  };
+
+  const enqueue = (iframe) => {
+    if (iframe.dataset.jupyterliteQueued) {
+      return;
+    }
+    iframe.dataset.jupyterliteQueued = "true";
+    queue.push(iframe);
+    bootNext();
+  };
+
+  const observe = () => {
+    const iframes = document.querySelectorAll(
+      "iframe.jupyterlite_sphinx_lazy_iframe[data-src]",
+    );
+    if (!("IntersectionObserver" in window)) {
+      iframes.forEach(enqueue);
+      return;
+    }
+    const observer = new IntersectionObserver(
+      (entries) => {
+        entries.forEach((entry) => {
+          if (entry.isIntersecting) {
+            observer.unobserve(entry.target);
+            enqueue(entry.target);
+          }
+        });
+      },
+      // Start booting a little before the iframe scrolls into view.
+      { rootMargin: "200px 0px" },
+    );
+    iframes.forEach((iframe) => observer.observe(iframe));
+  };
+
+  if (document.readyState === "loading") {
+    document.addEventListener("DOMContentLoaded", observe);
+  } else {
+    observe();
+  }
+
+  return { enqueue };
+})();
+
+/* The iframes of replite directives which pass their code in data attributes
+ * get their src once the code is resolved. */
+const jupyterliteLoadCodeIframes = () => {
+  document
+    .querySelectorAll("iframe.jupyterlite_sphinx_code_iframe[data-src]")
+    .forEach((iframe) => {
+      jupyterliteResolveIframeSrc(iframe, iframe.dataset.src).then((src) => {
+        iframe.src = src;
+      });
+    });
+};
+
+if (document.readyState === "loading") {
+  document.addEventListener("DOMContentLoaded", jupyterliteLoadCodeIframes);
+} else {
+  jupyterliteLoadCodeIframes();
+}
+
+/* The ids and data of the try_examples directive of an element, which is in
+ * its examples container or in its iframe parent container. The latter
+ * carries the data of the directive. */
+const tryExamplesDirective = (element) => {
+  let examplesContainer = element.closest(".try_examples_outer_container");
+  let iframeParentContainer;
+  if (examplesContainer) {
+    iframeParentContainer = document.querySelector(
+      `.try_examples_outer_iframe[data-examples-id="${examplesContainer.id}"]`,
+    );
+  } else {
+    iframeParentContainer = element.closest(".try_examples_outer_iframe");
+    examplesContainer = document.getElementById(
+      iframeParentContainer.dataset.examplesId,
+    );
+  }
+  const data = iframeParentContainer.dataset;
+  return {
+    examplesContainerId: examplesContainer.id,
+    iframeContainerId: iframeParentContainer.querySelector(
+      ".jupyterlite_sphinx_iframe_container",
+    ).id,
+    iframeParentContainerId: iframeParentContainer.id,
+    iframeSrc: data.iframeSrc,
+    iframeHeight: data.iframeHeight || "None",
+  };
+};
+
 window.tryExamplesShowIframe = (
   examplesContainerId,
   iframeContainerId,
@@ -64,53 +266,267 @@ window.tryExamplesShowIframe = (
     iframeParentContainerId,
   );
   const iframeContainer = document.getElementById(iframeContainerId);
-  var height;
 
-  let iframe = iframeContainer.querySelector(
+  if (window.tryExamplesSharedIframe) {
+    const examples = examplesContainer.querySelector(".try_examples_content");
+    const height = tryExamplesIframeHeight(examples, iframeHeight);
+    examplesContainer.classList.add("hidden");
+    iframeParentContainer.classList.remove("hidden");
+    tryExamplesShared.show(
+      examplesContainerId,
+      iframeContainerId,
+      iframeParentContainerId,
+      iframeSrc,
+      height,
+    );
+    return;
+  }
+
+  const iframe = iframeContainer.querySelector(
     "iframe.jupyterlite_sphinx_iframe",
   );
 
   if (!iframe) {
-    // Add spinner
-    const spinner = document.createElement("div");
-    // hardcoded spinner width needs to match what is in css.
-    const spinnerHeight = 50; // px
-    const spinnerWidth = 50; // px
-    spinner.classList.add("jupyterlite_sphinx_spinner");
-    iframeContainer.appendChild(spinner);
+    tryExamplesCreateIframe(
+      examplesContainerId,
+      iframeContainerId,
+      iframeSrc,
+      iframeHeight,
+    );
+  }
+  examplesContainer.classList.add("hidden");
+  iframeParentContainer.classList.remove("hidden");
+};
 
-    const examples = examplesContainer.querySelector(".try_examples_content");
+/* The height of the iframe of a try_examples directive: its :height: option,
+ * or else the height of its examples, which must be visible. */
+const tryExamplesIframeHeight = (examples, iframeHeight) =>
+  iframeHeight !== "None"
+    ? parseInt(iframeHeight)
+    : Math.max(tryExamplesGlobalMinHeight, examples.offsetHeight);
+
+/* Add a spinner to the iframe container of a try_examples directive. */
+const tryExamplesAddSpinner = (iframeContainer, examples, height) => {
+  const spinner = document.createElement("div");
+  // hardcoded spinner width needs to match what is in css.
+  const spinnerHeight = 50; // px
+  const spinnerWidth = 50; // px
+  spinner.classList.add("jupyterlite_sphinx_spinner");
+  iframeContainer.appendChild(spinner);
+
+  /* Get spinner position. It will be centered in the iframe, unless the
+   * iframe extends beyond the viewport, in which case it will be centered
+   * between the top of the iframe and the bottom of the viewport.
+   */
+  const examplesTop = examples.getBoundingClientRect().top;
+  const viewportBottom = window.innerHeight;
+  const spinnerTop = 0.5 * Math.min(viewportBottom - examplesTop, height);
+  spinner.style.top = `${spinnerTop}px`;
+  // Add negative margins to center the spinner
+  spinner.style.marginTop = `-${spinnerHeight / 2}px`;
+  spinner.style.marginLeft = `-${spinnerWidth / 2}px`;
+};
+
+/* Create the iframe of a try_examples directive, in its container which is
+ * still hidden. */
+const tryExamplesCreateIframe = (
+  examplesContainerId,
+  iframeContainerId,
+  iframeSrc,
+  iframeHeight,
+) => {
+  const examplesContainer = document.getElementById(examplesContainerId);
+  const iframeContainer = document.getElementById(iframeContainerId);
+
+  const examples = examplesContainer.querySelector(".try_examples_content");
+  const height = tryExamplesIframeHeight(examples, iframeHeight);
+  tryExamplesAddSpinner(iframeContainer, examples, height);
+
+  const iframe = document.createElement("iframe");
+  iframe.src = iframeSrc;
+  iframe.style.width = "100%";
+  iframe.style.height = `${height}px`;
+  iframe.classList.add("jupyterlite_sphinx_iframe");
+
+  iframeContainer.appendChild(iframe);
+};
+
+/* With try_examples_shared_iframe, all the try_examples directives of a page
+ * share a single iframe, and so a single NotebookLite app and kernel. Moving
+ * an iframe to another container would reload it, so the shared iframe is
+ * instead laid over the iframe container of the open directive. The notebook
+ * of another directive is loaded into the notebook already open, in the same
+ * kernel session, without its try_examples_preamble cell once it ran. */
+const tryExamplesShared = (() => {
+  const preambleTag = "jupyterlite_sphinx_preamble";
+  // Give up on reusing the app if it is not exposed after this long.
+  const appTimeout = 60000; // ms
+  // The src of the iframe of each directive, for openInNewTab.
+  const iframeSrcs = {};
+  let host = null;
+  let iframe = null;
+  let current = null;
+  // The ids of the directive showing the shared iframe.
+  let opened = null;
+  let openedPath = null;
+  let preambleRan = false;
+  let pending = Promise.resolve();
+  let placeScheduled = false;
+
+  const place = () => {
+    placeScheduled = false;
+    if (!current || current.offsetParent === null) {
+      host.style.display = "none";
+      return;
+    }
+    const rect = current.getBoundingClientRect();
+    host.style.display = "";
+    host.style.top = `${rect.top}px`;
+    host.style.left = `${rect.left}px`;
+    host.style.width = `${rect.width}px`;
+    host.style.height = `${rect.height}px`;
+  };
+
+  const schedulePlace = () => {
+    if (host && !placeScheduled) {
+      placeScheduled = true;
+      window.requestAnimationFrame(place);
+    }
+  };
+
+  const createIframe = (iframeSrc) => {
+    host = document.createElement("div");
+    host.classList.add("try_examples_shared_iframe_host");
+    host.style.display = "none";
     iframe = document.createElement("iframe");
     iframe.src = iframeSrc;
-    iframe.style.width = "100%";
-    if (iframeHeight !== "None") {
-      height = parseInt(iframeHeight);
-    } else {
-      height = Math.max(tryExamplesGlobalMinHeight, examples.offsetHeight);
-    }
-
-    /* Get spinner position. It will be centered in the iframe, unless the
-     * iframe extends beyond the viewport, in which case it will be centered
-     * between the top of the iframe and the bottom of the viewport.
-     */
-    const examplesTop = examples.getBoundingClientRect().top;
-    const viewportBottom = window.innerHeight;
-    const spinnerTop = 0.5 * Math.min(viewportBottom - examplesTop, height);
-    spinner.style.top = `${spinnerTop}px`;
-    // Add negative margins to center the spinner
-    spinner.style.marginTop = `-${spinnerHeight / 2}px`;
-    spinner.style.marginLeft = `-${spinnerWidth / 2}px`;
-
-    iframe.style.height = `${height}px`;
+    iframe.style.width = iframe.style.height = "100%";
     iframe.classList.add("jupyterlite_sphinx_iframe");
-    examplesContainer.classList.add("hidden");
+    host.appendChild(iframe);
+    document.body.appendChild(host);
+    // Scroll events do not bubble, but can be captured.
+    window.addEventListener("scroll", schedulePlace, {
+      capture: true,
+      passive: true,
+    });
+    window.addEventListener("resize", schedulePlace);
+    if ("ResizeObserver" in window) {
+      new ResizeObserver(schedulePlace).observe(document.body);
+    }
+  };
 
-    iframeContainer.appendChild(iframe);
-  } else {
-    examplesContainer.classList.add("hidden");
-  }
-  iframeParentContainer.classList.remove("hidden");
-};
+  const notebookPath = (iframeSrc) =>
+    new URL(iframeSrc, window.location.href).searchParams.get("path");
+
+  const waitForApp = async () => {
+    const start = Date.now();
+    // Throws for a cross-origin iframe.
+    while (!iframe.contentWindow.jupyterapp) {
+      if (Date.now() - start > appTimeout) {
+        throw new Error("The NotebookLite app is not exposed");
+      }
+      await new Promise((resolve) => setTimeout(resolve, 100));
+    }
+    const app = iframe.contentWindow.jupyterapp;
+    await app.restored;
+    return app;
+  };
+
+  const isPreamble = (cell) =>
+    (cell.metadata.tags || []).includes(preambleTag);
+
+  // Open the notebook at path in the running app, with the kernel of the
+  // notebook it replaces. Each notebook is a document of its own, so that
+  // the edits of the reader are saved to the right path.
+  const loadNotebook = async (path, iframeSrc) => {
+    try {
+      const app = await waitForApp();
+      const panel = app.shell.currentWidget;
+      const context = panel && panel.context;
+      const session = context && context.sessionContext.session;
+      const kernel = session && session.kernel;
+      if (!kernel) {
+        throw new Error("No kernel is running");
+      }
+      for (const cell of context.model.cells) {
+        if (isPreamble(cell.toJSON()) && cell.executionCount) {
+          preambleRan = true;
+        }
+      }
+      if (context.model.dirty) {
+        await context.save();
+      }
+      // The notebook app only shows one document at a time. Disposing of the
+      // previous one does not shut down its kernel.
+      panel.dispose();
+      const widget = await app.commands.execute("docmanager:open", {
+        path,
+        factory: "Notebook",
+        kernel: { id: kernel.id },
+        // Open it in this app rather than in a new browser tab.
+        options: { ref: "_noref" },
+      });
+      if (!widget) {
+        throw new Error(`Could not open ${path}`);
+      }
+      await widget.context.ready;
+      if (preambleRan) {
+        const { model } = widget.context;
+        for (let index = model.cells.length - 1; index >= 0; index--) {
+          if (isPreamble(model.cells.get(index).toJSON())) {
+            model.sharedModel.deleteCell(index);
+          }
+        }
+        model.dirty = false;
+      }
+    } catch (error) {
+      // Fall back to a new app, and kernel.
+      console.warn("jupyterlite-sphinx: could not reuse the kernel", error);
+      preambleRan = false;
+      iframe.src = iframeSrc;
+    }
+  };
+
+  const show = (
+    examplesContainerId,
+    iframeContainerId,
+    iframeParentContainerId,
+    iframeSrc,
+    height,
+  ) => {
+    // Only one directive can show the shared iframe at a time.
+    if (opened && opened.iframeParentContainerId !== iframeParentContainerId) {
+      tryExamplesHideIframe(
+        opened.examplesContainerId,
+        opened.iframeParentContainerId,
+      );
+    }
+    opened = { examplesContainerId, iframeParentContainerId };
+    iframeSrcs[iframeParentContainerId] = iframeSrc;
+
+    const iframeContainer = document.getElementById(iframeContainerId);
+    if (!iframeContainer.style.height) {
+      const examples = document
+        .getElementById(examplesContainerId)
+        .querySelector(".try_examples_content");
+      iframeContainer.style.height = `${height}px`;
+      tryExamplesAddSpinner(iframeContainer, examples, height);
+    }
+    current = iframeContainer;
+
+    const path = notebookPath(iframeSrc);
+    if (!iframe) {
+      createIframe(iframeSrc);
+      openedPath = path;
+    } else if (path !== openedPath) {
+      openedPath = path;
+      pending = pending.then(() => loadNotebook(path, iframeSrc));
+    }
+    schedulePlace();
+  };
+
+  return { show, schedulePlace, iframeSrc: (id) => iframeSrcs[id] };
+})();
 
 window.tryExamplesHideIframe = (
   examplesContainerId,
@@ -123,6 +539,9 @@ window.tryExamplesHideIframe = (
 
   iframeParentContainer.classList.add("hidden");
   examplesContainer.classList.remove("hidden");
+  if (window.tryExamplesSharedIframe) {
+    tryExamplesShared.schedulePlace();
+  }
 };
 
 // this will be used by the "Open in tab" button that is present next
@@ -133,10 +552,14 @@ window.openInNewTab = (examplesContainerId, iframeParentContainerId) => {
     iframeParentContainerId,
   );
 
+  // The shared iframe is not in the container of the directive.
+  const iframe = iframeParentContainer.getElementsByTagName("iframe")[0];
   window.open(
     // we make some assumption that there is a single iframe and the the src is what we want to open.
     // Maybe we should have tabs open JupyterLab by default.
-    iframeParentContainer.getElementsByTagName("iframe")[0].getAttribute("src"),
+    iframe
+      ? iframe.getAttribute("src")
+      : tryExamplesShared.iframeSrc(iframeParentContainerId),
   );
   tryExamplesHideIframe(examplesContainerId, iframeParentContainerId);
 };
@@ -204,6 +627,50 @@ window.isMobileDevice = (() => {
 const ConfigLoader = (() => {
   let configLoadPromise = null;
 
+  /* Fetch try_examples.json, whose URL carries a hash of its content at
+   * build time. The browser revalidates it on every page unless
+   * try_examples_config_max_age is set, in which case the config is kept in
+   * the local storage for that many seconds. */
+  const fetchConfig = async (configFilePath) => {
+    const maxAge = parseInt(window.tryExamplesConfigMaxAge) || 0; // s
+    const url = new URL(configFilePath, window.location.href);
+    const key = `jupyterlite-sphinx:${url.href}`;
+    if (maxAge > 0) {
+      try {
+        const cached = JSON.parse(window.localStorage.getItem(key));
+        if (cached && Date.now() - cached.time < maxAge * 1000) {
+          return cached.data;
+        }
+      } catch (error) {
+        // No local storage, or an invalid entry.
+      }
+    }
+
+    const response = await fetch(configFilePath, {
+      cache: maxAge > 0 ? "default" : "no-cache",
+    });
+    let data = null;
+    if (response.ok) {
+      data = await response.json();
+    } else if (response.status === 404) {
+      console.log("Optional try_examples config file not found.");
+    } else {
+      throw new Error(`Error fetching ${configFilePath}`);
+    }
+
+    if (maxAge > 0) {
+      try {
+        window.localStorage.setItem(
+          key,
+          JSON.stringify({ time: Date.now(), data }),
+        );
+      } catch (error) {
+        // No local storage, or it is full.
+      }
+    }
+    return data;
+  };
+
   const loadConfig = async (configFilePath) => {
     if (window.isMobileDevice()) {
       const buttons = document.getElementsByClassName("try_examples_button");
@@ -229,22 +696,13 @@ const ConfigLoader = (() => {
     // Create and cache the promise for the config request
     configLoadPromise = (async () => {
       try {
-        // Add a timestamp as query parameter to ensure a cached version of the
-        // file is not used.
-        const timestamp = new Date().getTime();
-        const configFileUrl = `${configFilePath}?cb=${timestamp}`;
         const currentPageUrl = window.location.pathname;
 
-        const response = await fetch(configFileUrl);
-        if (!response.ok) {
-          if (response.status === 404) {
-            console.log("Optional try_examples config file not found.");
-            return;
-          }
-          throw new Error(`Error fetching ${configFilePath}`);
-        }
-
-        const data = await response.json();
+        // Inlined in the page with try_examples_config_inline.
+        const data =
+          window.tryExamplesConfig !== undefined
+            ? window.tryExamplesConfig
+            : await fetchConfig(configFilePath);
         if (!data) {
           return;
         }
@@ -321,3 +779,307 @@ window.toggleTryExamplesButtons = () => {
     buttons[i].classList.toggle("hidden");
   }
 };
+
+/* A single click listener handles the buttons of every directive, which
+ * carry a data-jupyterlite-action attribute. */
+document.addEventListener("click", (event) => {
+  const element =
+    event.target instanceof Element &&
+    event.target.closest("[data-jupyterlite-action]");
+  if (!element) {
+    return;
+  }
+  const action = element.dataset.jupyterliteAction;
+  if (action === "prompt") {
+    // The container of the "Try It Live!" button, which is only clicked once.
+    delete element.dataset.jupyterliteAction;
+    jupyterliteShowPromptIframe(
+      element.querySelector(".jupyterlite_sphinx_try_it_button"),
+      jupyterliteResolveIframeSrc(element, jupyterlitePromptIframeSrc(element)),
+    );
+  } else if (action === "open-tab") {
+    if (element.dataset.codePayload || element.dataset.codePath) {
+      // Open the tab right away, popup blockers would block a tab opened
+      // once the code is resolved.
+      const tab = window.open("", "_blank");
+      jupyterliteResolveIframeSrc(element, element.dataset.iframeSrc).then(
+        (src) => {
+          const url = new URL(src, window.location.href).href;
+          if (tab) {
+            tab.location.href = url;
+          } else {
+            window.open(url);
+          }
+        },
+      );
+    } else {
+      window.open(element.dataset.iframeSrc);
+    }
+  } else if (action === "try-examples") {
+    const directive = tryExamplesDirective(element);
+    window.tryExamplesShowIframe(
+      directive.examplesContainerId,
+      directive.iframeContainerId,
+      directive.iframeParentContainerId,
+      directive.iframeSrc,
+      directive.iframeHeight,
+    );
+  } else if (action === "try-examples-hide") {
+    const directive = tryExamplesDirective(element);
+    window.tryExamplesHideIframe(
+      directive.examplesContainerId,
+      directive.iframeParentContainerId,
+    );
+  } else if (action === "try-examples-tab") {
+    const directive = tryExamplesDirective(element);
+    window.openInNewTab(
+      directive.examplesContainerId,
+      directive.iframeParentContainerId,
+    );
+  }
+});
+
+/* Load try_examples.json in the pages with try_examples directives. */
+const tryExamplesLoadPageConfig = () => {
+  if (
+    window.tryExamplesConfigUrl !== undefined &&
+    document.querySelector('[data-jupyterlite-action="try-examples"]')
+  ) {
+    window.loadTryExamplesConfig(
+      new URL(window.tryExamplesConfigUrl, jupyterliteDocsRoot).href,
+    );
+  }
+};
+
+if (document.readyState === "loading") {
+  document.addEventListener("DOMContentLoaded", tryExamplesLoadPageConfig);
+} else {
+  tryExamplesLoadPageConfig();
+}
+
+/* Speculative warm-up of JupyterLite, configured by jupyterlite_warmup and
+ * jupyterlite_warmup_triggers, whose values are in
+ * window.jupyterliteWarmupConfig. The buttons which open an iframe carry a
+ * data-jupyterlite-warmup attribute when the warm-up is enabled. Warming up
+ * either prefetches the entry assets of the JupyterLite app of the button, or
+ * boots its iframe hidden, so that the click reveals an app which is already
+ * loading or loaded. */
+window.jupyterliteWarmup = (() => {
+  const prefetched = new Set();
+  const warmedUp = new WeakSet();
+
+  const addPrefetchHint = (url) => {
+    if (prefetched.has(url)) {
+      return;
+    }
+    prefetched.add(url);
+    const link = document.createElement("link");
+    link.rel = "prefetch";
+    link.href = url;
+    document.head.appendChild(link);
+  };
+
+  // Prefetch the page of the app and the scripts it preloads and imports.
+  const prefetchApp = async (iframeSrc) => {
+    const appUrl = new URL(iframeSrc, window.location.href);
+    appUrl.search = appUrl.hash = "";
+    if (prefetched.has(appUrl.href)) {
+      return;
+    }
+    prefetched.add(appUrl.href);
+    try {
+      const response = await fetch(appUrl.href);
+      if (!response.ok) {
+        return;
+      }
+      const html = await response.text();
+      const page = new DOMParser().parseFromString(html, "text/html");
+      const urls = [
+        ...Array.from(
+          page.querySelectorAll(
+            'link[rel="preload"], link[rel="modulepreload"], script[src]',
+          ),
+          (element) => element.getAttribute("href") || element.getAttribute("src"),
+        ),
+        ...Array.from(
+          html.matchAll(/import\(\s*['"]([^'"]+)['"]\s*\)/g),
+          (match) => match[1],
+        ),
+        "jupyter-lite.json",
+      ];
+      urls.forEach((url) => addPrefetchHint(new URL(url, appUrl).href));
+    } catch (error) {
+      console.debug("JupyterLite warm-up failed", error);
+    }
+  };
+
+  const bootIframe = (element) => {
+    if (element.dataset.jupyterliteWarmup === "prompt") {
+      const button = element.querySelector(".jupyterlite_sphinx_try_it_button");
+      if (
+        !button ||
+        !element.dataset.jupyterliteAction ||
+        jupyterliteWarmIframes.has(button)
+      ) {
+        return;
+      }
+      const iframe = jupyterliteCreateIframe(
+        jupyterliteResolveIframeSrc(
+          element,
+          jupyterlitePromptIframeSrc(element),
+        ),
+      );
+      iframe.style.display = "none";
+      element.appendChild(iframe);
+      jupyterliteWarmIframes.set(button, iframe);
+    } else if (element.dataset.jupyterliteWarmup === "try_examples") {
+      const directive = tryExamplesDirective(element);
+      const iframeContainer = document.getElementById(
+        directive.iframeContainerId,
+      );
+      if (iframeContainer.querySelector("iframe.jupyterlite_sphinx_iframe")) {
+        return;
+      }
+      tryExamplesCreateIframe(
+        directive.examplesContainerId,
+        directive.iframeContainerId,
+        directive.iframeSrc,
+        directive.iframeHeight,
+      );
+    }
+  };
+
+  // The src of the iframe of a button.
+  const iframeSrc = (element) =>
+    element.dataset.jupyterliteWarmup === "prompt"
+      ? element.dataset.iframeSrc
+      : tryExamplesDirective(element).iframeSrc;
+
+  const warmUp = (element) => {
+    const config = window.jupyterliteWarmupConfig;
+    // Buttons hidden on mobile devices, or by try_examples.json, are not
+    // warmed up, and neither are the iframes of buttons already clicked.
+    if (
+      !config ||
+      warmedUp.has(element) ||
+      element.offsetParent === null ||
+      window.isMobileDevice()
+    ) {
+      return;
+    }
+    warmedUp.add(element);
+    // The shared iframe of the try_examples directives is only booted by a
+    // click, which picks the notebook it opens first.
+    const shared =
+      element.dataset.jupyterliteWarmup === "try_examples" &&
+      window.tryExamplesSharedIframe;
+    if (config.mode === "boot" && !shared) {
+      bootIframe(element);
+    } else {
+      prefetchApp(iframeSrc(element));
+    }
+  };
+
+  const onInteraction = (event) => {
+    const element =
+      event.target instanceof Element &&
+      event.target.closest("[data-jupyterlite-warmup]");
+    if (element) {
+      warmUp(element);
+    }
+  };
+
+  const onIdle = () => {
+    const elements = Array.from(
+      document.querySelectorAll("[data-jupyterlite-warmup]"),
+    );
+    if (window.jupyterliteWarmupConfig.mode === "boot") {
+      // Only boot the first button in the viewport, booting every iframe of
+      // the page would be worse than booting none.
+      const visible = elements.find((element) => {
+        const rect = element.getBoundingClientRect();
+        return rect.bottom > 0 && rect.top < window.innerHeight;
+      });
+      if (visible) {
+        warmUp(visible);
+      }
+    } else {
+      elements.forEach(warmUp);
+    }
+  };
+
+  const setUp = () => {
+    const config = window.jupyterliteWarmupConfig;
+    if (!config) {
+      return;
+    }
+    if (config.triggers.includes("interaction")) {
+      // pointerenter and focus do not bubble.
+      document.addEventListener("pointerover", onInteraction, {
+        passive: true,
+      });
+      document.addEventListener("focusin", onInteraction);
+    }
+    if (config.triggers.includes("idle")) {
+      const scheduleIdle = () =>
+        "requestIdleCallback" in window
+          ? window.requestIdleCallback(onIdle, { timeout: 5000 })
+          : setTimeout(onIdle, 2000);
+      if (document.readyState === "complete") {
+        scheduleIdle();
+      } else {
+        window.addEventListener("load", scheduleIdle, { once: true });
+      }
+    }
+  };
+
+  if (document.readyState === "loading") {
+    document.addEventListener("DOMContentLoaded", setUp);
+  } else {
+    setUp();
+  }
+
+  return { warmUp };
+})();
+
+// Registration of the JupyterLite service worker, which precaches the lite
+// app when jupyterlite_service_worker is enabled, so that it is installed
+// before the first JupyterLite iframe is opened.
+window.jupyterliteServiceWorker = (() => {
+  const register = async () => {
+    const config = window.jupyterliteServiceWorkerConfig;
+    if (!config || !("serviceWorker" in navigator)) {
+      return;
+    }
+    const scope = new URL(config.scope, jupyterliteDocsRoot).href;
+    try {
+      const registration =
+        await navigator.serviceWorker.getRegistration(scope);
+      if (registration && registration.scope === scope) {
+        // Registered by a previous visit or by JupyterLite itself, only check
+        // whether the lite output changed since.
+        await registration.update();
+        return;
+      }
+      // JupyterLite registers the same URL, registering another one would
+      // replace the service worker at every change of page.
+      const url = new URL("service-worker.js", scope);
+      url.searchParams.set("enableCache", config.enableCache);
+      await navigator.serviceWorker.register(url.href, { scope });
+    } catch (error) {
+      console.warn(
+        "jupyterlite-sphinx: could not register the service worker",
+        error,
+      );
+    }
+  };
+
+  // Do not compete with the resources of the page.
+  if (document.readyState === "complete") {
+    register();
+  } else {
+    window.addEventListener("load", register, { once: true });
+  }
+
+  return { register };
+})();
@@ -1,12 +1,12 @@
+import hashlib
 import json
 import os
 import re
-import shutil
 import subprocess
 import sys
+import threading
 from pathlib import Path
-from subprocess import CompletedProcess
-from typing import Any, ClassVar
+from typing import Any, ClassVar, Optional
 from urllib.parse import quote
 from uuid import uuid4
 
@@ -16,9 +16,56 @@ from docutils.nodes import Element, SkipNode
 from docutils.parsers.rst import directives
 from sphinx.application import Sphinx
 from sphinx.parsers import RSTParser
+from sphinx.util import logging
 from sphinx.util.docutils import SphinxDirective
 from sphinx.util.fileutil import copy_asset
 
+from ._build_log import LOG_FILE, BuildLog, TaskTimings
+from ._fingerprint import (
+    FINGERPRINT_FILE,
+    FileHasher,
+    build_is_up_to_date,
+    compute_build_fingerprint,
+    load_build_record,
+    save_build_record,
+)
+from ._lite_build import (
+    JupyterLiteBuildError,
+    LiteBuildProcess,
+    in_process_build_unsupported,
+    run_lite_build,
+)
+from ._notebook_staging import (
+    job_identity,
+    run_staging_jobs,
+    strip_notebook_cells,
+)
+from ._notebook_transforms import (
+    DEFAULT_MAX_OUTPUT_SIZE,
+    apply_transforms,
+    check_transforms_available,
+    parse_transforms,
+)
+from ._replite_code import CODE_PAYLOAD_MODES, REPLITE_CODE_DIR, choose_code_payload
+from ._service_worker import (
+    PRECACHE_RECORD_FILE,
+    build_precache_manifest,
+    install_service_worker,
+    load_precache_record,
+    save_precache_record,
+)
+from ._shell_cache import ShellCache, contents_build_args, shell_build_args
+from ._size_report import (
+    REPORT_FILE,
+    SIZE_BUDGET_ACTIONS,
+    SizeBudgetError,
+    build_size_report,
+    check_size_budgets,
+    format_size,
+    load_size_report,
+    write_size_report,
+)
+from ._staging import MANIFEST_FILE, STAGING_CACHE_DIR, StagingArea
 from ._try_examples import (
     examples_to_notebook,
     insert_try_examples_directive,
@@ -35,11 +82,38 @@ try:
 except ImportError:
     voici = None
 
+logger = logging.getLogger(__name__)
+
 HERE = Path(__file__).parent
 
 CONTENT_DIR = "_contents"
 JUPYTERLITE_DIR = "lite"
 
+# Version of the data stored in the Sphinx environment, bumped whenever its
+# shape changes so that Sphinx discards the environments of older versions.
+ENV_VERSION = 1
+
+# The values of jupyterlite_iframe_loading and of the :loading: option.
+IFRAME_LOADING_MODES = ["eager", "lazy"]
+
+# The values of jupyterlite_warmup and jupyterlite_warmup_triggers.
+WARMUP_MODES = ["none", "prefetch", "boot"]
+WARMUP_TRIGGERS = ["interaction", "idle"]
+
+# The runtime configuration of the try_examples directives, copied from the
+# source root to the output root.
+TRY_EXAMPLES_CONFIG_FILE = "try_examples.json"
+
+# Tag of the try_examples_preamble cell, which is skipped by the notebooks
+# loaded into the shared iframe of a page once it ran, see
+# try_examples_shared_iframe.
+PREAMBLE_TAG = "jupyterlite_sphinx_preamble"
+
+# Key set in the jupyter-config-data of the NotebookLite app along with
+# exposeAppInBrowser, to tell it apart from an exposeAppInBrowser set by the
+# JupyterLite configuration.
+SHARED_IFRAME_CONFIG_KEY = "jupyterliteSphinxSharedIframe"
+
 
 # Used for nodes that do not need to be rendered
 def skip(self, node):
@@ -52,6 +126,65 @@ def visit_element_html(self, node):
     raise SkipNode
 
 
+def _get_staging_area(app: Sphinx) -> StagingArea:
+    """The staging area for the JupyterLite contents of this Sphinx app."""
+    if not hasattr(app, "jupyterlite_staging_area"):
+        cache_dir = app.config.jupyterlite_staging_cache_dir
+        app.jupyterlite_staging_area = StagingArea(
+            Path(app.srcdir) / app.config.jupyterlite_content_dir,
+            Path(app.doctreedir) / MANIFEST_FILE,
+            strategy=app.config.jupyterlite_staging_strategy,
+            cache_dir=(
+                Path(app.confdir) / cache_dir
+                if cache_dir
+                else Path(app.doctreedir) / STAGING_CACHE_DIR
+            ),
+        )
+    return app.jupyterlite_staging_area
+
+
+def _note_staged_file(env, docname: str, target, entry: dict) -> None:
+    """Record that ``docname`` needs ``target`` in the contents directory."""
+    if not hasattr(env, "jupyterlite_staged_files"):
+        env.jupyterlite_staged_files = {}
+    env.jupyterlite_staged_files.setdefault(docname, {})[
+        Path(target).as_posix()
+    ] = entry
+
+
+def _notebook_transforms(directive: SphinxDirective) -> list[str]:
+    """The notebook transforms of ``directive``: its ``:transforms:`` option
+    if given, ``jupyterlite_notebook_transforms`` otherwise."""
+    value = directive.options.pop("transforms", None)
+    if value is None:
+        value = directive.env.config.jupyterlite_notebook_transforms
+    try:
+        transforms = parse_transforms(value)
+    except ValueError as e:
+        raise directive.error(str(e)) from e
+    check_transforms_available(transforms)
+    return transforms
+
+
+def _iframe_loading(directive: SphinxDirective) -> str:
+    """The loading mode of the iframe of ``directive``: its ``:loading:``
+    option if given, ``jupyterlite_iframe_loading`` otherwise."""
+    loading = directive.options.pop(
+        "loading", directive.env.config.jupyterlite_iframe_loading
+    )
+    if loading not in IFRAME_LOADING_MODES:
+        raise ValueError(
+            f"The loading option must be one of {', '.join(IFRAME_LOADING_MODES)}, "
+            f"not {loading}"
+        )
+    return loading
+
+
+def _max_output_size(config) -> int:
+    # Sizes given on the command line with -D are strings.
+    return int(config.jupyterlite_max_output_size)
+
+
 def _build_options(lite_options: dict[str, str]) -> str:
     """Concatenates options into query parameters, fixing the capitalization
     for parameters where the necessarily lowercase docutils directive value
@@ -68,6 +201,25 @@ def _build_options(lite_options: dict[str, str]) -> str:
     return "&".join([f"{key}={quote(value)}" for key, value in lite_options])
 
 
+def _code_attributes(code_payload=None, code_path=None) -> str:
+    """The attributes passing the code of a replite directive which is not in
+    the query string of its URL to jupyterlite_sphinx.js."""
+    if code_payload:
+        return f' data-code-payload="{code_payload}"'
+    if code_path:
+        return f' data-code-path="{code_path}"'
+    return ""
+
+
+def _new_tab_button_html(url: str, button_text: str, code_attributes="") -> str:
+    """A button opening ``url`` in a new tab, handled by the delegated click
+    listener of jupyterlite_sphinx.js."""
+    return (
+        '<button class="try_examples_button" data-jupyterlite-action="open-tab" '
+        f'data-iframe-src="{url}"{code_attributes}>{button_text}</button>'
+    )
+
+
 class _PromptedIframe(Element):
     def __init__(
         self,
@@ -79,6 +231,10 @@ class _PromptedIframe(Element):
         prompt=False,
         prompt_color=None,
         search_params="false",
+        loading="eager",
+        warmup=False,
+        code_payload=None,
+        code_path=None,
         **attributes,
     ):
         super().__init__(
@@ -89,11 +245,18 @@ class _PromptedIframe(Element):
             prompt=prompt,
             prompt_color=prompt_color,
             search_params=search_params,
+            loading=loading,
+            warmup=warmup,
+            code_payload=code_payload,
+            code_path=code_path,
         )
 
     def html(self):
         iframe_src = self["iframe_src"]
         search_params = self["search_params"]
+        code_attributes = _code_attributes(
+            self.get("code_payload"), self.get("code_path")
+        )
 
         if self["prompt"]:
             prompt = (
@@ -103,31 +266,51 @@ class _PromptedIframe(Element):
                 self["prompt_color"] if self["prompt_color"] is not None else "#f7dc1e"
             )
 
-            placeholder_id = uuid4()
-            container_style = f"width: {self['width']}; height: {self['height']};"
-
-            return f"""
-                <div
-                    class=\"jupyterlite_sphinx_iframe_container\"
-                    style=\"{container_style}\"
-                    onclick=\"window.jupyterliteShowIframe(
-                        '{placeholder_id}',
-                        window.jupyterliteConcatSearchParams('{iframe_src}', {search_params})
-                    )\"
-                >
-                    <div
-                        id={placeholder_id}
-                        class=\"jupyterlite_sphinx_try_it_button jupyterlite_sphinx_try_it_button_unclicked\"
-                        style=\"background-color: {prompt_color};\"
-                    >
-                    {prompt}
-                    </div>
-                </div>
-            """
+            # Handled by the delegated click listener of jupyterlite_sphinx.js.
+            attributes = (
+                f'data-jupyterlite-action="prompt" data-iframe-src="{iframe_src}"'
+            )
+            if search_params != "false":
+                search_params_json = search_params.replace("'", '"')
+                attributes += f" data-search-params='{search_params_json}'"
+            if self.get("warmup"):
+                # Read by the warm-up of jupyterlite_sphinx.js.
+                attributes += ' data-jupyterlite-warmup="prompt"'
+            attributes += code_attributes
+
+            return (
+                '<div class="jupyterlite_sphinx_iframe_container" '
+                f'style="width: {self["width"]}; height: {self["height"]};" '
+                f"{attributes}>"
+                '<div class="jupyterlite_sphinx_try_it_button '
+                'jupyterlite_sphinx_try_it_button_unclicked" '
+                f'style="background-color: {prompt_color};">{prompt}</div>'
+                "</div>"
+            )
+
+        if self.get("loading") == "lazy":
+            # The src is set by jupyterlite_sphinx.js once the iframe gets
+            # close to the viewport.
+            return (
+                f'<iframe data-src="{iframe_src}"{code_attributes} loading="lazy" '
+                f'width="{self["width"]}" height="{self["height"]}" '
+                'class="jupyterlite_sphinx_raw_iframe jupyterlite_sphinx_lazy_iframe">'
+                "</iframe>"
+            )
+
+        if code_attributes:
+            # The src, with the code, is set by jupyterlite_sphinx.js.
+            return (
+                f'<iframe data-src="{iframe_src}"{code_attributes} '
+                f'width="{self["width"]}" height="{self["height"]}" '
+                'class="jupyterlite_sphinx_raw_iframe jupyterlite_sphinx_code_iframe">'
+                "</iframe>"
+            )
 
         return (
-            f'<iframe src="{iframe_src}"'
-            f'width="{self["width"]}" height="{self["height"]}" class="jupyterlite_sphinx_raw_iframe"></iframe>'
+            f'<iframe src="{iframe_src}" '
+            f'width="{self["width"]}" height="{self["height"]}" '
+            'class="jupyterlite_sphinx_raw_iframe"></iframe>'
         )
 
 
@@ -161,11 +344,7 @@ class _InTab(Element):
         )
 
     def html(self):
-        return (
-            '<button class="try_examples_button" '
-            f"onclick=\"window.open('{self.lab_src}')\">"
-            f"{self.button_text}</button>"
-        )
+        return _new_tab_button_html(self.lab_src, self.button_text)
 
 
 class _LiteIframe(_PromptedIframe):
@@ -275,6 +454,8 @@ class RepliteTab(Element):
         notebook=None,
         lite_options=None,
         button_text=None,
+        code_payload=None,
+        code_path=None,
         **attributes,
     ):
         lite_options = lite_options if lite_options is not None else {}
@@ -321,6 +502,7 @@ class RepliteTab(Element):
         )
 
         self.button_text = button_text
+        self.code_attributes = _code_attributes(code_payload, code_path)
 
         super().__init__(
             rawsource,
@@ -328,10 +510,8 @@ class RepliteTab(Element):
         )
 
     def html(self):
-        return (
-            '<button class="try_examples_button" '
-            f"onclick=\"window.open('{self.lab_src}')\">"
-            f"{self.button_text}</button>"
+        return _new_tab_button_html(
+            self.lab_src, self.button_text, self.code_attributes
         )
 
 
@@ -418,11 +598,7 @@ class VoiciTab(Element):
         )
 
     def html(self):
-        return (
-            '<button class="try_examples_button" '
-            f"onclick=\"window.open('{self.lab_src}')\">"
-            f"{self.button_text}</button>"
-        )
+        return _new_tab_button_html(self.lab_src, self.button_text)
 
 
 class RepliteDirective(SphinxDirective):
@@ -451,6 +627,8 @@ class RepliteDirective(SphinxDirective):
         "new_tab": directives.unchanged,
         "new_tab_button_text": directives.unchanged,
         "showbanner": directives.unchanged,
+        "loading": directives.unchanged,
+        "code_payload": directives.unchanged,
     }
 
     def run(self):
@@ -462,6 +640,8 @@ class RepliteDirective(SphinxDirective):
 
         search_params = search_params_parser(self.options.pop("search_params", False))
 
+        loading = _iframe_loading(self)
+
         # We first check the global config, and then the per-directive
         # options, with reasonable defaults for backwards compatibility.
         repl_config_mappings = {
@@ -535,6 +715,29 @@ class RepliteDirective(SphinxDirective):
             os.path.dirname(self.get_source_info()[0]),
         )
 
+        code_payload = code_path = None
+        code_mode = self.options.pop(
+            "code_payload", self.env.config.replite_code_payload
+        )
+        if content:
+            code = "\n".join("" if not line.strip() else line for line in content)
+            code_mode, payload = choose_code_payload(
+                code, code_mode, int(self.env.config.replite_code_payload_threshold)
+            )
+            if code_mode == "compressed":
+                code_payload = payload
+                content = None
+            elif code_mode == "staged":
+                entry = _get_staging_area(self.env.app).stage_content(
+                    payload,
+                    code,
+                    producer=f"{self.env.docname}:{self.name}",
+                    source=self.get_source_info()[0],
+                )
+                _note_staged_file(self.env, self.env.docname, payload, entry)
+                code_path = f"{prefix}/files/{payload}"
+                content = None
+
         new_tab = self.options.pop("new_tab", False)
 
         if new_tab:
@@ -554,6 +757,8 @@ class RepliteDirective(SphinxDirective):
                     search_params=search_params,
                     lite_options=self.options,
                     button_text=button_text,
+                    code_payload=code_payload,
+                    code_path=code_path,
                 )
             ]
 
@@ -566,7 +771,11 @@ class RepliteDirective(SphinxDirective):
                 prompt_color=prompt_color,
                 content=content,
                 search_params=search_params,
+                loading=loading,
+                warmup=self.env.config.jupyterlite_warmup != "none",
                 lite_options=self.options,
+                code_payload=code_payload,
+                code_path=code_path,
             )
         ]
 
@@ -584,16 +793,10 @@ class _LiteDirective(SphinxDirective):
         "search_params": directives.unchanged,
         "new_tab": directives.unchanged,
         "new_tab_button_text": directives.unchanged,
+        "transforms": directives.unchanged,
+        "loading": directives.unchanged,
     }
 
-    def _target_is_stale(self, source_path: Path, target_path: Path) -> bool:
-        # Used as a heuristic to determine if a markdown notebook needs to be
-        # converted or reconverted to ipynb.
-        if not target_path.exists():
-            return True
-
-        return source_path.stat().st_mtime > target_path.stat().st_mtime
-
     def _strip_notebook_cells(
         self, nb: nbformat.NotebookNode
     ) -> list[nbformat.NotebookNode]:
@@ -613,11 +816,7 @@ class _LiteDirective(SphinxDirective):
         List[nbformat.NotebookNode]
             A list of cells that are not meant to be stripped.
         """
-        return [
-            cell
-            for cell in nb.cells
-            if "jupyterlite_sphinx_strip" not in cell.metadata.get("tags", [])
-        ]
+        return strip_notebook_cells(nb)
 
     def run(self):
         width = self.options.pop("width", "100%")
@@ -628,8 +827,12 @@ class _LiteDirective(SphinxDirective):
 
         search_params = search_params_parser(self.options.pop("search_params", False))
 
+        loading = _iframe_loading(self)
+
         new_tab = self.options.pop("new_tab", False)
 
+        transforms = _notebook_transforms(self)
+
         button_text = None
 
         source_location = os.path.dirname(self.get_source_info()[0])
@@ -642,9 +845,10 @@ class _LiteDirective(SphinxDirective):
             # Keep track of the notebooks we are going through, so that we don't
             # operate on notebooks that are not meant to be included in the built
             # docs, i.e., those that have not been referenced in the docs via our
-            # directives anywhere.
+            # directives anywhere. They are recorded per document so that they
+            # can be purged and merged back from parallel readers.
             if not hasattr(self.env, "jupyterlite_notebooks"):
-                self.env.jupyterlite_notebooks = set()
+                self.env.jupyterlite_notebooks = {}
 
             # As with other directives like literalinclude, an absolute path is
             # assumed to be relative to the document root, and a relative path
@@ -654,52 +858,42 @@ class _LiteDirective(SphinxDirective):
 
             notebook_path = Path(notebook)
 
-            self.env.jupyterlite_notebooks.add(str(notebook_path))
-
-            notebooks_dir = (
-                Path(self.env.app.srcdir) / self.env.config.jupyterlite_content_dir
+            self.env.jupyterlite_notebooks.setdefault(self.env.docname, set()).add(
+                str(notebook_path)
             )
 
-            os.makedirs(notebooks_dir, exist_ok=True)
-
             notebook_is_stripped: bool = self.env.config.strip_tagged_cells
 
+            # The notebook is staged at the end of the read phase, by
+            # _stage_notebooks.
             if notebook_path.suffix.lower() == ".md":
-                target_name = str(Path(rel_filename).with_suffix(".ipynb"))
-                target_path = notebooks_dir / target_name
                 if jupytext is None:
                     raise ImportError(
                         "jupyterlite-sphinx requires the jupytext package to process Markdown notebooks. "
                         'Install "jupyterlite-sphinx[markdown]" with your package manager of choice.'
                     )
-                if self._target_is_stale(notebook_path, target_path):
-                    nb = jupytext.read(str(notebook_path))
-                    if notebook_is_stripped:
-                        nb.cells = self._strip_notebook_cells(nb)
-                    os.makedirs(target_path.parent, exist_ok=True)
-                    with open(target_path, "w", encoding="utf-8") as f:
-                        nbformat.write(nb, f, version=4)
-
-                notebook = str(target_path)
-                notebook_name = target_name
+                notebook_name = str(Path(rel_filename).with_suffix(".ipynb"))
+                kind = "convert"
             else:
                 notebook_name = rel_filename
-                target_path = notebooks_dir / notebook_name
-
-                if notebook_is_stripped:
-                    nb = nbformat.read(notebook, as_version=4)
-                    nb.cells = self._strip_notebook_cells(nb)
-                    os.makedirs(target_path.parent, exist_ok=True)
-                    nbformat.write(nb, target_path, version=4)
-                # If notebook_is_stripped is False, then copy the notebook(s) to notebooks_dir.
-                # If it is True, then they have already been copied to notebooks_dir by the
-                # nbformat.write() function above.
-                else:
-                    try:
-                        os.makedirs(target_path.parent, exist_ok=True)
-                        shutil.copy(notebook, target_path)
-                    except shutil.SameFileError:
-                        pass
+                # If notebook_is_stripped is False and there are no transforms,
+                # then copy the notebook(s) to the contents directory as they are.
+                kind = "rewrite" if notebook_is_stripped or transforms else "copy"
+
+            if not hasattr(self.env, "jupyterlite_staging_jobs"):
+                self.env.jupyterlite_staging_jobs = {}
+            self.env.jupyterlite_staging_jobs.setdefault(self.env.docname, []).append(
+                {
+                    "kind": kind,
+                    "source": str(notebook_path),
+                    "target": Path(notebook_name).as_posix(),
+                    "strip": notebook_is_stripped,
+                    "transforms": transforms,
+                    "max_output_size": _max_output_size(self.env.config),
+                    "producer": f"{self.env.docname}:{self.name}",
+                    "lineno": self.lineno,
+                }
+            )
 
         else:
             notebook_name = None
@@ -741,6 +935,8 @@ class _LiteDirective(SphinxDirective):
                 prompt=prompt,
                 prompt_color=prompt_color,
                 search_params=search_params,
+                loading=loading,
+                warmup=self.env.config.jupyterlite_warmup != "none",
                 lite_options=self.options,
             )
         ]
@@ -763,6 +959,8 @@ class BaseJupyterViewDirective(_LiteDirective):
         # "new_tab_button_text" below is useful only if "new_tab" is True, otherwise
         # we have "prompt" and "prompt_color" as options already.
         "new_tab_button_text": directives.unchanged,
+        "transforms": directives.unchanged,
+        "loading": directives.unchanged,
     }
 
 
@@ -832,17 +1030,10 @@ class TryExamplesDirective(SphinxDirective):
         "button_text": directives.unchanged,
         "example_class": directives.unchanged,
         "warning_text": directives.unchanged,
+        "transforms": directives.unchanged,
     }
 
     def run(self):
-        if "generated_notebooks" not in self.env.temp_data:
-            self.env.temp_data["generated_notebooks"] = {}
-
-        directive_key = f"{self.env.docname}-{self.lineno}"
-        notebook_unique_name = self.env.temp_data["generated_notebooks"].get(
-            directive_key
-        )
-
         # Use global configuration values from conf.py in manually inserted directives
         # if they are provided and the user has not specified a config value in the
         # directive itself.
@@ -863,6 +1054,8 @@ class TryExamplesDirective(SphinxDirective):
         # A global height cannot be set in conf.py
         height = self.options.pop("height", None)
 
+        transforms = _notebook_transforms(self)
+
         # We need to get the relative path back to the documentation root from
         # whichever file the docstring content is in.
         docname = self.env.docname
@@ -883,29 +1076,56 @@ class TryExamplesDirective(SphinxDirective):
         content_node["classes"].append("try_examples_content")
         self.state.nested_parse(self.content, self.content_offset, content_node)
 
-        if notebook_unique_name is None:
-            nb = examples_to_notebook(self.content, warning_text=warning_text)
+        nb = examples_to_notebook(self.content, warning_text=warning_text)
 
-            preamble = self.env.config.try_examples_preamble
-            if preamble:
-                # insert after the "experimental" warning
-                nb.cells.insert(1, new_code_cell(preamble))
+        preamble = self.env.config.try_examples_preamble
+        if preamble:
+            # insert after the "experimental" warning
+            nb.cells.insert(
+                1, new_code_cell(preamble, metadata={"tags": [PREAMBLE_TAG]})
+            )
 
-            self.content = None
-            notebooks_dir = (
-                Path(self.env.app.srcdir) / self.env.config.jupyterlite_content_dir
+        self.content = None
+
+        # New cells get random ids, use deterministic ones instead so
+        # that the notebook content only depends on the examples.
+        for index, cell in enumerate(nb.cells):
+            cell["id"] = f"cell-{index}"
+        details = None
+        if transforms:
+            notebook_content, saved = apply_transforms(
+                nb,
+                transforms,
+                max_output_size=_max_output_size(self.env.config),
+                indent=4,
             )
-            notebook_unique_name = f"{uuid4()}.ipynb".replace("-", "_")
-            self.env.temp_data["generated_notebooks"][
-                directive_key
-            ] = notebook_unique_name
-            # Copy the Notebook for NotebookLite to find
-            os.makedirs(notebooks_dir, exist_ok=True)
-            with open(
-                notebooks_dir / Path(notebook_unique_name), "w", encoding="utf-8"
-            ) as f:
-                # nbf.write incorrectly formats multiline arrays in output.
-                json.dump(nb, f, indent=4, ensure_ascii=False)
+            details = {"transforms": saved}
+        else:
+            # nbf.write incorrectly formats multiline arrays in output.
+            notebook_content = json.dumps(nb, indent=4, ensure_ascii=False)
+
+        # Name the notebook after its content (which includes the warning
+        # text and the preamble), so that identical examples share a single
+        # notebook, and notebooks keep the same URL from build to build as
+        # long as their examples do not change.
+        content_hash = hashlib.sha256(notebook_content.encode()).hexdigest()
+        notebook_unique_name = f"{content_hash[:32]}.ipynb"
+        notebooks_dir = self.env.config.try_examples_notebooks_dir
+        if notebooks_dir:
+            # One directory per document, so that JupyterLite indexes the
+            # notebooks of every document separately.
+            notebook_unique_name = (
+                f"{notebooks_dir}/{self.env.docname}/{notebook_unique_name}"
+            )
+        # Stage the Notebook for NotebookLite to find.
+        entry = _get_staging_area(self.env.app).stage_content(
+            notebook_unique_name,
+            notebook_content,
+            producer=f"{self.env.docname}:{self.name}",
+            source=self.get_source_info()[0],
+            details=details,
+        )
+        _note_staged_file(self.env, self.env.docname, notebook_unique_name, entry)
 
         self.options["path"] = notebook_unique_name
         app_path = f"{lite_app}{notebooks_path}"
@@ -915,73 +1135,58 @@ class TryExamplesDirective(SphinxDirective):
         iframe_div_id = uuid4()
         iframe_src = f"{prefix}/{app_path}{f'index.html?{options}' if options else ''}"
 
-        # Parent container (initially hidden)
-        iframe_parent_container_div_start = (
-            f'<div id="{iframe_parent_div_id}" '
-            f'class="try_examples_outer_iframe {example_class} hidden">'
-        )
-
-        iframe_parent_container_div_end = "</div>"
-        iframe_container_div = (
-            f'<div id="{iframe_div_id}" '
-            f'class="jupyterlite_sphinx_iframe_container">'
-            f"</div>"
+        # The buttons are handled by the delegated click listener of
+        # jupyterlite_sphinx.js, which finds the iframe parent container of
+        # the examples through its data-examples-id.
+        iframe_data = (
+            f'data-examples-id="{examples_div_id}" data-iframe-src="{iframe_src}"'
         )
-
-        # Button with the onclick event to swap embedded notebook back to examples.
-        go_back_button_html = (
+        if height is not None:
+            iframe_data += f' data-iframe-height="{height}"'
+        notebook_container_html = (
+            f'<div id="{iframe_parent_div_id}" '
+            f'class="try_examples_outer_iframe {example_class} hidden" {iframe_data}>'
+            '<div class="try_examples_button_container">'
             '<button class="try_examples_button" '
-            f"onclick=\"window.tryExamplesHideIframe('{examples_div_id}',"
-            f"'{iframe_parent_div_id}')\">"
-            "Go Back</button>"
-        )
-
-        full_screen_button_html = (
+            'data-jupyterlite-action="try-examples-hide">Go Back</button>'
             '<button class="try_examples_button" '
-            f"onclick=\"window.openInNewTab('{examples_div_id}',"
-            f"'{iframe_parent_div_id}')\">"
-            "Open In Tab</button>"
+            'data-jupyterlite-action="try-examples-tab">Open In Tab</button>'
+            "</div>"
+            f'<div id="{iframe_div_id}" class="jupyterlite_sphinx_iframe_container">'
+            "</div>"
+            "</div>"
         )
 
-        # Button with the onclick event to swap examples with embedded notebook.
+        # Read by the warm-up of jupyterlite_sphinx.js.
+        warmup_attribute = (
+            ' data-jupyterlite-warmup="try_examples"'
+            if self.env.config.jupyterlite_warmup != "none"
+            else ""
+        )
         try_it_button_html = (
             '<div class="try_examples_button_container">'
             '<button class="try_examples_button" '
-            f"onclick=\"window.tryExamplesShowIframe('{examples_div_id}',"
-            f"'{iframe_div_id}','{iframe_parent_div_id}','{iframe_src}',"
-            f"'{height}')\">"
+            f'data-jupyterlite-action="try-examples"{warmup_attribute}>'
             f"{button_text}</button>"
             "</div>"
         )
         try_it_button_node = nodes.raw("", try_it_button_html, format="html")
 
-        # Combine everything
-        notebook_container_html = (
-            iframe_parent_container_div_start
-            + '<div class="try_examples_button_container">'
-            + go_back_button_html
-            + full_screen_button_html
-            + "</div>"
-            + iframe_container_div
-            + iframe_parent_container_div_end
-        )
         content_container_node += try_it_button_node
         content_container_node += content_node
 
         notebook_container = nodes.raw("", notebook_container_html, format="html")
 
-        # Search config file allowing for config changes without rebuilding docs.
-        config_path = os.path.join(relative_path_to_root, "try_examples.json")
-        script_html = (
-            "<script>"
-            'document.addEventListener("DOMContentLoaded", function() {'
-            f'window.loadTryExamplesConfig("{config_path}");'
-            "});"
-            "</script>"
+        # The pages with try_examples directives load try_examples.json, whose
+        # URL is in the bootstrap script of jupyterlite_sphinx, and are read
+        # again when it changes, see _docs_with_stale_try_examples_config.
+        if not hasattr(self.env, "jupyterlite_try_examples_config"):
+            self.env.jupyterlite_try_examples_config = {}
+        self.env.jupyterlite_try_examples_config[self.env.docname] = getattr(
+            self.env.app, "jupyterlite_try_examples_config_hash", None
         )
-        script_node = nodes.raw("", script_html, format="html")
 
-        return [content_container_node, notebook_container, script_node]
+        return [content_container_node, notebook_container]
 
 
 def _process_docstring_examples(app: Sphinx, docname: str, source: list[str]) -> None:
@@ -1000,8 +1205,8 @@ def _process_autodoc_docstrings(app, what, name, obj, options, lines):
         key: value for key, value in try_examples_options.items() if value is not None
     }
     modified_lines = insert_try_examples_directive(lines, **try_examples_options)
-    lines.clear()
-    lines.extend(modified_lines)
+    if modified_lines is not lines:
+        lines[:] = modified_lines
 
 
 def conditional_process_examples(app, config):
@@ -1010,14 +1215,162 @@ def conditional_process_examples(app, config):
         app.connect("autodoc-process-docstring", _process_autodoc_docstrings)
 
 
+def _copy_try_examples_config(app: Sphinx) -> None:
+    """Copy the try_examples.json of the source root to the output root, and
+    record a hash of its content as ``app.jupyterlite_try_examples_config_hash``,
+    which versions its URL."""
+    source = Path(app.srcdir) / TRY_EXAMPLES_CONFIG_FILE
+    try:
+        content = source.read_bytes()
+    except FileNotFoundError:
+        app.jupyterlite_try_examples_config_hash = None
+        return
+    target = Path(app.outdir) / TRY_EXAMPLES_CONFIG_FILE
+    # The copy in the output root may have been edited since the last build,
+    # the one of the source root wins.
+    if not target.is_file() or target.read_bytes() != content:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(content)
+    app.jupyterlite_try_examples_config_hash = hashlib.sha256(content).hexdigest()[:16]
+
+
+def _read_try_examples_config(app: Sphinx):
+    """The content of the try_examples.json of the source root, inlined into
+    the pages with try_examples_config_inline, or None if there is none."""
+    try:
+        with open(Path(app.srcdir) / TRY_EXAMPLES_CONFIG_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        raise ValueError(
+            f"Invalid {TRY_EXAMPLES_CONFIG_FILE}, which can not be inlined: {e}"
+        ) from e
+
+
+def _service_worker_cache_enabled(config) -> str:
+    """The ``enableServiceWorkerCache`` option of the ``jupyter-lite.json``
+    of the ``jupyterlite_dir``, which JupyterLite passes to its service
+    worker."""
+    try:
+        with open(
+            Path(config.jupyterlite_dir) / "jupyter-lite.json", encoding="utf-8"
+        ) as f:
+            lite_config = json.load(f)
+        enabled = lite_config["jupyter-config-data"]["enableServiceWorkerCache"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return "false"
+    return str(enabled).lower()
+
+
+def _bootstrap_script(app: Sphinx, config, warmup_triggers: list[str]) -> str:
+    """The script setting the configuration read by jupyterlite_sphinx.js."""
+    values = {}
+    if config.jupyterlite_warmup != "none":
+        values["jupyterliteWarmupConfig"] = {
+            "mode": config.jupyterlite_warmup,
+            "triggers": list(warmup_triggers),
+        }
+    # Numbers may be strings when given on the command line with -D.
+    if config.jupyterlite_max_concurrent_iframes is not None:
+        values["jupyterliteMaxConcurrentIframes"] = int(
+            config.jupyterlite_max_concurrent_iframes
+        )
+
+    # Relative to the root of the docs, with the hash of the file as
+    # version, see _copy_try_examples_config.
+    config_url = TRY_EXAMPLES_CONFIG_FILE
+    config_hash = getattr(app, "jupyterlite_try_examples_config_hash", None)
+    if config_hash is not None:
+        config_url += f"?v={config_hash}"
+    values["tryExamplesConfigUrl"] = config_url
+    if config.try_examples_config_inline:
+        values["tryExamplesConfig"] = _read_try_examples_config(app)
+    elif config.try_examples_config_max_age:
+        values["tryExamplesConfigMaxAge"] = int(config.try_examples_config_max_age)
+    if config.try_examples_shared_iframe:
+        values["tryExamplesSharedIframe"] = True
+
+    if config.jupyterlite_service_worker:
+        # Registered with the same URL as JupyterLite does, see
+        # _install_service_worker.
+        values["jupyterliteServiceWorkerConfig"] = {
+            "scope": f"{JUPYTERLITE_DIR}/",
+            "enableCache": _service_worker_cache_enabled(config),
+        }
+
+    return "".join(
+        f"window.{name} = {json.dumps(value)};" for name, value in values.items()
+    )
+
+
 def inited(app: Sphinx, config):
     if not app.config.jupyterlite_content_dir:
         raise ValueError("jupyterlite_content_dir must be a non-zero string")
-    content_dir = Path(app.srcdir) / app.config.jupyterlite_content_dir
-    shutil.rmtree(content_dir, ignore_errors=True)
+    # Create the content dir. Its files are staged incrementally, and the ones
+    # which are no longer needed are removed by _finalize_staging.
+    staging_root = _get_staging_area(app).root
+    staging_root.mkdir(exist_ok=True, parents=True)
+    # The staged files stay in the content dir between builds, they must not
+    # be read as source documents, e.g. the notebooks with
+    # jupyterlite_bind_ipynb_suffix.
+    try:
+        content_dir = staging_root.resolve().relative_to(Path(app.srcdir).resolve())
+    except ValueError:
+        # Outside of the source directory.
+        pass
+    else:
+        if content_dir.as_posix() not in config.exclude_patterns:
+            config.exclude_patterns = [
+                *config.exclude_patterns,
+                content_dir.as_posix(),
+            ]
+
+    if config.jupyterlite_build_in_background and config.jupyterlite_build_in_process:
+        raise ValueError(
+            "jupyterlite_build_in_background runs jupyter lite build in a"
+            " subprocess, it can not be combined with jupyterlite_build_in_process"
+        )
+
+    # Raises a ValueError or an ImportError for invalid or unavailable
+    # transforms, before any document is read.
+    check_transforms_available(parse_transforms(config.jupyterlite_notebook_transforms))
+
+    if config.jupyterlite_iframe_loading not in IFRAME_LOADING_MODES:
+        raise ValueError(
+            "jupyterlite_iframe_loading must be one of "
+            f"{', '.join(IFRAME_LOADING_MODES)}, got "
+            f"{config.jupyterlite_iframe_loading!r}"
+        )
+    if config.replite_code_payload not in CODE_PAYLOAD_MODES:
+        raise ValueError(
+            "replite_code_payload must be one of "
+            f"{', '.join(CODE_PAYLOAD_MODES)}, got {config.replite_code_payload!r}"
+        )
+    if config.jupyterlite_warmup not in WARMUP_MODES:
+        raise ValueError(
+            f"jupyterlite_warmup must be one of {', '.join(WARMUP_MODES)}, got "
+            f"{config.jupyterlite_warmup!r}"
+        )
+    triggers = config.jupyterlite_warmup_triggers
+    if isinstance(triggers, str):
+        triggers = [triggers]
+    unknown_triggers = set(triggers) - set(WARMUP_TRIGGERS)
+    if unknown_triggers:
+        raise ValueError(
+            "jupyterlite_warmup_triggers must be some of "
+            f"{', '.join(WARMUP_TRIGGERS)}, got {', '.join(sorted(unknown_triggers))}"
+        )
+    # A single script with the configuration of jupyterlite_sphinx.js, in
+    # every page.
+    app.add_js_file(None, body=_bootstrap_script(app, config, triggers))
 
-    # Create the content dir
-    content_dir.mkdir(exist_ok=True, parents=True)
+    if config.jupyterlite_size_budget_action not in SIZE_BUDGET_ACTIONS:
+        raise ValueError(
+            "jupyterlite_size_budget_action must be one of "
+            f"{', '.join(SIZE_BUDGET_ACTIONS)}, got "
+            f"{config.jupyterlite_size_budget_action!r}"
+        )
 
     if (
         config.jupyterlite_bind_ipynb_suffix
@@ -1027,6 +1380,148 @@ def inited(app: Sphinx, config):
         app.add_source_suffix(".ipynb", "jupyterlite_notebook")
 
 
+# The jupyterlite-sphinx state of the build environment, as dicts keyed by
+# docname, which must be purged and merged back from parallel readers.
+_ENV_STATE = [
+    "jupyterlite_notebooks",
+    "jupyterlite_staging_jobs",
+    "jupyterlite_staged_files",
+    "jupyterlite_try_examples_config",
+]
+
+
+def _purge_env_state(app: Sphinx, env, docname: str) -> None:
+    for name in _ENV_STATE:
+        if hasattr(env, name):
+            getattr(env, name).pop(docname, None)
+
+
+def _merge_env_state(app: Sphinx, env, docnames, other) -> None:
+    for name in _ENV_STATE:
+        if not hasattr(other, name):
+            continue
+        if not hasattr(env, name):
+            setattr(env, name, {})
+        state, other_state = getattr(env, name), getattr(other, name)
+        for docname in docnames:
+            if docname in other_state:
+                state[docname] = other_state[docname]
+
+
+def _docs_with_missing_staged_files(app: Sphinx, env, added, changed, removed):
+    """The documents which staged files during the read phase, e.g. from
+    try_examples directives, which are missing from the contents directory,
+    so that they are read again. The notebooks of the staging jobs are staged
+    again at every build anyway."""
+    root = _get_staging_area(app).root
+    staging_jobs = getattr(env, "jupyterlite_staging_jobs", {})
+    docnames = []
+    for docname, staged in getattr(env, "jupyterlite_staged_files", {}).items():
+        if docname in removed or docname in changed:
+            continue
+        job_targets = {job["target"] for job in staging_jobs.get(docname, [])}
+        if any(
+            not (root / target).exists()
+            for target in staged
+            if target not in job_targets
+        ):
+            docnames.append(docname)
+    return docnames
+
+
+def _docs_with_stale_try_examples_config(app: Sphinx, env, added, changed, removed):
+    """The documents with try_examples directives which were read with another
+    version of try_examples.json, whose URL, or inlined content, changed."""
+    config_hash = getattr(app, "jupyterlite_try_examples_config_hash", None)
+    return [
+        docname
+        for docname, doc_hash in getattr(
+            env, "jupyterlite_try_examples_config", {}
+        ).items()
+        if doc_hash != config_hash and docname not in removed and docname not in changed
+    ]
+
+
+def _stage_notebooks(app: Sphinx, env) -> None:
+    """Run the staging jobs recorded by the directives of every document,
+    once per target."""
+    jobs = getattr(env, "jupyterlite_staging_jobs", {})
+    unique_jobs = {}
+    for docname in sorted(jobs):
+        for job in jobs[docname]:
+            previous = unique_jobs.setdefault(job["target"], job)
+            if job_identity(previous) != job_identity(job):
+                logger.warning(
+                    f"[jupyterlite-sphinx] {job['target']} is already staged from "
+                    f"{previous['source']} by {previous['producer']}",
+                    location=(docname, job["lineno"]),
+                )
+    if not unique_jobs:
+        return
+
+    results = run_staging_jobs(
+        _get_staging_area(app),
+        list(unique_jobs.values()),
+        max_workers=(
+            int(app.config.jupyterlite_staging_workers)
+            if app.config.jupyterlite_staging_workers is not None
+            else None
+        ),
+    )
+    for docname in sorted(jobs):
+        for job in jobs[docname]:
+            result = results[job["target"]]
+            if isinstance(result, Exception):
+                logger.error(
+                    f"[jupyterlite-sphinx] Could not stage {job['source']} as "
+                    f"{job['target']}: {result}",
+                    location=(docname, job["lineno"]),
+                )
+            else:
+                _note_staged_file(env, docname, job["target"], result)
+
+
+def _finalize_staging(app: Sphinx, contents_entries: dict[str, dict]) -> None:
+    """Remove the staged files which no document produces anymore and persist
+    the staging manifest."""
+    entries = {}
+    staged_files = getattr(app.env, "jupyterlite_staged_files", {})
+    for docname in sorted(staged_files):
+        for target, entry in staged_files[docname].items():
+            previous = entries.get(target)
+            if previous is not None and previous["hash"] != entry["hash"]:
+                # Which of the two ends up in the contents directory depends on
+                # the order in which the documents were read.
+                logger.warning(
+                    f"[jupyterlite-sphinx] {target} is staged from different "
+                    f"inputs by {previous['producer']} and {entry['producer']}",
+                    location=docname,
+                )
+            entries[target] = entry
+    entries.update(contents_entries)
+
+    removed = _get_staging_area(app).finalize(entries)
+    if removed:
+        # jupyter lite build does not remove the files it copied from the
+        # contents in previous builds, which would stay in its listings.
+        output_files_dir = Path(app.outdir) / JUPYTERLITE_DIR / "files"
+        for target in removed:
+            path = output_files_dir / target
+            try:
+                path.unlink()
+                # Along with the directories left empty.
+                for parent in path.parents:
+                    if parent == output_files_dir or any(parent.iterdir()):
+                        break
+                    parent.rmdir()
+            except FileNotFoundError:
+                pass
+        logger.info(
+            f"[jupyterlite-sphinx] Removed {len(removed)} stale file(s) from the"
+            " JupyterLite contents"
+        )
+
+
 def jupyterlite_ignore_contents_args(ignore_contents):
     """Generate `--ignore-contents` argument for each pattern.
 
@@ -1043,165 +1538,414 @@ def jupyterlite_ignore_contents_args(ignore_contents):
     ]
 
 
-def jupyterlite_build(app: Sphinx, error):
-    if error is not None:
-        # Do not build JupyterLite
-        return
+def jupyterlite_hidden_contents_args(hidden_dirs: list[str]) -> list[str]:
+    """Generate the arguments hiding the given directories of the contents
+    from the directory listings of JupyterLite, starting with the one of its
+    root, which the file browser fetches first. Their own listings are still
+    generated, so that the files they contain can be opened by path.
+    """
+    if not hidden_dirs:
+        return []
 
-    if app.builder.format == "html":
-        print("[jupyterlite-sphinx] Running JupyterLite build")
-        jupyterlite_config = app.env.config.jupyterlite_config
-        jupyterlite_overrides = app.env.config.jupyterlite_overrides
-        jupyterlite_contents = app.env.config.jupyterlite_contents
+    from jupyter_server.services.contents.manager import ContentsManager
 
-        jupyterlite_dir = str(app.env.config.jupyterlite_dir)
+    # Keep the files hidden by default, such as __pycache__ directories.
+    hide_globs = [*ContentsManager().hide_globs, *hidden_dirs]
+    return [
+        arg
+        for pattern in hide_globs
+        for arg in ["--FileContentsManager.hide_globs", pattern]
+    ]
 
-        jupyterlite_build_command_options: dict[str, Any] = (
-            app.env.config.jupyterlite_build_command_options
+
+def _lite_build_command(build_args: list[str]) -> list[str]:
+    return [sys.executable, "-m", "jupyter", "lite", "build", *build_args]
+
+
+class _LiteBuildJob:
+    """A pending run of ``jupyter lite build``, as prepared by
+    _prepare_lite_build."""
+
+    def __init__(self, app: Sphinx, build_args):
+        self.app = app
+        self.build_args = build_args
+        # Set by _prepare_lite_build when skipping unchanged builds.
+        self.fingerprint = None
+        self.hasher = None
+        # Set by _prepare_lite_build when caching the application shell.
+        self.shell_cache = None
+        self.shell_key = None
+        # The build subprocess, once started.
+        self.process = None
+        # The thread running the build in the background, see start.
+        self._thread = None
+        self._error = None
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    def _run(self, build_args: list[str]) -> None:
+        config = self.app.env.config
+        unsupported = (
+            in_process_build_unsupported()
+            if config.jupyterlite_build_in_process
+            else None
+        )
+        if unsupported is not None:
+            logger.warning(
+                f"[jupyterlite-sphinx] {unsupported}, running the JupyterLite build"
+                " in a subprocess instead of in process"
+            )
+        if config.jupyterlite_build_in_process and unsupported is None:
+            logger.info(
+                "[jupyterlite-sphinx] Running in process: jupyter lite build"
+                f" {build_args}"
+            )
+            timings = TaskTimings()
+            run_lite_build(
+                build_args,
+                self.app.srcdir,
+                quiet=config.jupyterlite_silence,
+                timings=timings,
+            )
+            _report_task_timings(timings)
+        else:
+            self._spawn(build_args)
+            self._wait_process()
+
+    def _build_args(self) -> list[str]:
+        """The arguments of the build to run. If the application shell is
+        cached, restore it into the output dir (building it first if needed),
+        so that only the contents remain to be built."""
+        if self.shell_cache is None:
+            return self.build_args
+
+        shell_dir = self.shell_cache.ensure(
+            self.shell_key,
+            lambda output_dir: self._run(shell_build_args(self.build_args, output_dir)),
         )
+        restored = self.shell_cache.restore(
+            shell_dir, Path(self.app.outdir) / JUPYTERLITE_DIR
+        )
+        logger.info(
+            f"[jupyterlite-sphinx] Restored {restored} file(s) of the JupyterLite shell"
+        )
+        return contents_build_args(self.build_args)
 
-        config = []
-        overrides = []
-        if jupyterlite_config:
-            config = ["--config", jupyterlite_config]
-
-        if jupyterlite_overrides:
-            # JupyterLite's build command does not validate the existence
-            # of the JSON file, so we do it ourselves.
-            # We will raise a FileNotFoundError if the file does not exist
-            # in the Sphinx project directory.
-            overrides_path = Path(app.srcdir) / jupyterlite_overrides
-            if not Path(overrides_path).exists():
-                raise FileNotFoundError(
-                    f"Overrides file {overrides_path} does not exist. "
-                    "Please check your configuration."
-                )
+    def run(self) -> None:
+        self._run(self._build_args())
 
-            overrides = ["--settings-overrides", jupyterlite_overrides]
+    def _spawn(self, build_args: list[str]) -> None:
+        command = _lite_build_command(build_args)
+        print(f"[jupyterlite-sphinx] Command: {command}")
+        with self._lock:
+            if self._cancelled:
+                raise JupyterLiteBuildError("The JupyterLite build was cancelled")
+            self.process = LiteBuildProcess(
+                command,
+                cwd=self.app.srcdir,
+                log=BuildLog(
+                    Path(self.app.doctreedir) / LOG_FILE,
+                    echo=not self.app.env.config.jupyterlite_silence,
+                ),
+            )
 
-        if jupyterlite_contents is None:
-            jupyterlite_contents = []
-        elif isinstance(jupyterlite_contents, str):
-            jupyterlite_contents = [jupyterlite_contents]
+    def _wait_process(self) -> None:
+        log = self.process.log
+        try:
+            self.process.wait()
+        except subprocess.CalledProcessError:
+            if self.app.env.config.jupyterlite_silence:
+                _report_silenced_output(log)
+            raise
+        _report_task_timings(log.timings, log.path)
 
-        # Expand globs in the contents strings
-        contents = []
-        notebooks_dir = Path(app.srcdir) / CONTENT_DIR
-        for pattern in jupyterlite_contents:
-            pattern_path = Path(pattern)
+    def _run_in_background(self) -> None:
+        try:
+            self.run()
+        except Exception as error:
+            self._error = error
+
+    def start(self) -> None:
+        """Run the build in a worker thread until :meth:`wait` is called.
 
-            base_path = (
-                pattern_path.parent
-                if pattern_path.is_absolute()
-                else Path(app.srcdir) / pattern_path.parent
+        The whole build runs in the background, including the restoration of
+        the cached application shell, and its build if needed.
+        """
+        self._thread = threading.Thread(target=self._run_in_background, daemon=True)
+        self._thread.start()
+
+    def wait(self) -> None:
+        """Wait for the build started by :meth:`start`, and raise its
+        errors."""
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def cancel(self) -> None:
+        """Stop the build started by :meth:`start`, e.g. because the Sphinx
+        build failed."""
+        with self._lock:
+            self._cancelled = True
+            if self.process is not None:
+                self.process.terminate()
+        self._thread.join()
+
+    def finish(self) -> None:
+        if self.fingerprint is not None:
+            save_build_record(
+                Path(self.app.doctreedir) / FINGERPRINT_FILE,
+                self.fingerprint,
+                Path(self.app.outdir) / JUPYTERLITE_DIR,
+                self.hasher,
             )
-            glob_pattern = pattern_path.name
-
-            matched_paths = base_path.glob(glob_pattern)
-
-            for matched_path in matched_paths:
-                if matched_path.is_dir():
-                    # Copy directories into the _contents/ staging area so that
-                    # the directory name is preserved in the JupyterLite file
-                    # system. Passing --contents <dir> directly would cause
-                    # JupyterLite to treat it as a content root, placing its
-                    # files at the filesystem root rather than under <dir>/.
-                    target = notebooks_dir / matched_path.name
-                    if target.exists():
-                        shutil.rmtree(target)
-                    shutil.copytree(matched_path, target)
-                else:
-                    # For individual files, pass them directly as --contents args.
-                    contents_path = (
-                        str(matched_path)
-                        if matched_path.is_absolute()
-                        else str(matched_path.relative_to(app.srcdir))
-                    )
 
-                    contents.extend(["--contents", contents_path])
+        print("[jupyterlite-sphinx] JupyterLite build done")
 
-        ignore_contents = jupyterlite_ignore_contents_args(
-            app.env.config.jupyterlite_ignore_contents,
-        )
 
-        apps_option = []
-        for liteapp in ["notebooks", "edit", "lab", "repl", "tree", "consoles"]:
-            apps_option.extend(["--apps", liteapp])
-        if voici is not None:
-            apps_option.extend(["--apps", "voici"])
-
-        command = [
-            sys.executable,
-            "-m",
-            "jupyter",
-            "lite",
-            "build",
-            "--debug",
-            *config,
-            *overrides,
-            *contents,
-            "--contents",
-            os.path.join(app.srcdir, app.env.config.jupyterlite_content_dir),
-            *ignore_contents,
-            "--output-dir",
-            os.path.join(app.outdir, JUPYTERLITE_DIR),
-            *apps_option,
-            "--lite-dir",
-            jupyterlite_dir,
-        ]
+def _prepare_lite_build(app: Sphinx) -> Optional[_LiteBuildJob]:
+    """Stage the JupyterLite contents and assemble the ``jupyter lite build``
+    command. Returns None if the JupyterLite build is up to date."""
+    jupyterlite_config = app.env.config.jupyterlite_config
+    jupyterlite_overrides = app.env.config.jupyterlite_overrides
+    jupyterlite_contents = app.env.config.jupyterlite_contents
 
-        if jupyterlite_build_command_options is not None:
-            for key, value in jupyterlite_build_command_options.items():
-                # Check for conflicting options from the default command we use
-                # while building. We don't want to allow these to be overridden
-                # unless they are explicitly set through Sphinx config.
-                if key in ["contents", "output-dir", "lite-dir"]:
-                    jupyterlite_command_error_message = f"""
-                    Additional option, {key}, passed to `jupyter lite build` through
-                    `jupyterlite_build_command_options` in conf.py is already an existing
-                    option. "contents", "output_dir", and "lite_dir" can be configured in
-                    conf.py as described in the jupyterlite-sphinx documentation:
-                    https://jupyterlite-sphinx.readthedocs.io/en/stable/configuration.html
-                    """
-                    raise RuntimeError(jupyterlite_command_error_message)
-                command.extend([f"--{key}", str(value)])
-
-        assert all(
-            isinstance(s, str) for s in command
-        ), f"Expected all commands arguments to be a str, got {command}"
-
-        kwargs: dict[str, Any] = {}
-        if app.env.config.jupyterlite_silence:
-            kwargs["stdout"] = subprocess.PIPE
-            kwargs["stderr"] = subprocess.PIPE
+    jupyterlite_dir = str(app.env.config.jupyterlite_dir)
 
-        print(f"[jupyterlite-sphinx] Command: {command}")
-        try:
-            completed_process: CompletedProcess[bytes] = subprocess.run(
-                command, cwd=app.srcdir, check=True, **kwargs
+    jupyterlite_build_command_options: dict[str, Any] = (
+        app.env.config.jupyterlite_build_command_options
+    )
+
+    config = []
+    overrides = []
+    if jupyterlite_config:
+        config = ["--config", jupyterlite_config]
+
+    if jupyterlite_overrides:
+        # JupyterLite's build command does not validate the existence
+        # of the JSON file, so we do it ourselves.
+        # We will raise a FileNotFoundError if the file does not exist
+        # in the Sphinx project directory.
+        overrides_path = Path(app.srcdir) / jupyterlite_overrides
+        if not Path(overrides_path).exists():
+            raise FileNotFoundError(
+                f"Overrides file {overrides_path} does not exist. "
+                "Please check your configuration."
             )
-        except subprocess.CalledProcessError:
-            if app.env.config.jupyterlite_silence:
-                print(
-                    "[jupyterlite-sphinx] `jupyterlite build` failed but its"
-                    " output has been silenced. stdout and stderr are reproduced below."
-                )
-                print(
-                    f"{'-' * 15} stdout {'-' * 15}",
-                    completed_process.stdout.decode(),
-                    sep="\n",
+
+        overrides = ["--settings-overrides", jupyterlite_overrides]
+
+    if jupyterlite_contents is None:
+        jupyterlite_contents = []
+    elif isinstance(jupyterlite_contents, str):
+        jupyterlite_contents = [jupyterlite_contents]
+
+    # Expand globs in the contents strings
+    contents = []
+    contents_files = []
+    contents_entries = {}
+    staging_area = _get_staging_area(app)
+    for pattern in jupyterlite_contents:
+        pattern_path = Path(pattern)
+
+        base_path = (
+            pattern_path.parent
+            if pattern_path.is_absolute()
+            else Path(app.srcdir) / pattern_path.parent
+        )
+        glob_pattern = pattern_path.name
+
+        matched_paths = base_path.glob(glob_pattern)
+
+        for matched_path in matched_paths:
+            if matched_path.is_dir():
+                # Copy directories into the _contents/ staging area so that
+                # the directory name is preserved in the JupyterLite file
+                # system. Passing --contents <dir> directly would cause
+                # JupyterLite to treat it as a content root, placing its
+                # files at the filesystem root rather than under <dir>/.
+                # Only the files which changed since the last build are
+                # copied again.
+                files = [
+                    (
+                        Path(matched_path.name) / source.relative_to(matched_path),
+                        source,
+                    )
+                    for dirpath, _, filenames in os.walk(matched_path)
+                    for source in (Path(dirpath) / name for name in filenames)
+                ]
+                contents_entries.update(
+                    staging_area.stage_files(
+                        files, producer=f"jupyterlite_contents:{pattern}"
+                    )
                 )
-                print(
-                    f"{'-' * 15} stderr {'-' * 15}",
-                    completed_process.stderr.decode(),
-                    sep="\n",
+            else:
+                # For individual files, pass them directly as --contents args.
+                contents_path = (
+                    str(matched_path)
+                    if matched_path.is_absolute()
+                    else str(matched_path.relative_to(app.srcdir))
                 )
-                print(f"{'-' * 15} end output {'-' * 15}")
 
-            # raise the original error without changing the traceback
-            raise
+                contents.extend(["--contents", contents_path])
+                contents_files.append(matched_path)
 
-        print("[jupyterlite-sphinx] JupyterLite build done")
+    _finalize_staging(app, contents_entries)
+
+    ignore_contents = jupyterlite_ignore_contents_args(
+        app.env.config.jupyterlite_ignore_contents,
+    )
+    hidden_contents = jupyterlite_hidden_contents_args(
+        [REPLITE_CODE_DIR]
+        + (
+            [app.env.config.try_examples_notebooks_dir]
+            if app.env.config.try_examples_notebooks_dir
+            else []
+        )
+    )
+
+    apps_option = []
+    for liteapp in ["notebooks", "edit", "lab", "repl", "tree", "consoles"]:
+        apps_option.extend(["--apps", liteapp])
+    if voici is not None:
+        apps_option.extend(["--apps", "voici"])
+
+    build_args = [
+        "--debug",
+        *config,
+        *overrides,
+        *contents,
+        "--contents",
+        os.path.join(app.srcdir, app.env.config.jupyterlite_content_dir),
+        *ignore_contents,
+        *hidden_contents,
+        "--output-dir",
+        os.path.join(app.outdir, JUPYTERLITE_DIR),
+        *apps_option,
+        "--lite-dir",
+        jupyterlite_dir,
+    ]
+
+    if jupyterlite_build_command_options is not None:
+        for key, value in jupyterlite_build_command_options.items():
+            # Check for conflicting options from the default command we use
+            # while building. We don't want to allow these to be overridden
+            # unless they are explicitly set through Sphinx config.
+            if key in ["contents", "output-dir", "lite-dir"]:
+                jupyterlite_command_error_message = f"""
+                Additional option, {key}, passed to `jupyter lite build` through
+                `jupyterlite_build_command_options` in conf.py is already an existing
+                option. "contents", "output_dir", and "lite_dir" can be configured in
+                conf.py as described in the jupyterlite-sphinx documentation:
+                https://jupyterlite-sphinx.readthedocs.io/en/stable/configuration.html
+                """
+                raise RuntimeError(jupyterlite_command_error_message)
+            build_args.extend([f"--{key}", str(value)])
+
+    command = _lite_build_command(build_args)
+
+    assert all(
+        isinstance(s, str) for s in command
+    ), f"Expected all commands arguments to be a str, got {command}"
+
+    input_files = [
+        Path(path)
+        for path in [
+            jupyterlite_config,
+            jupyterlite_overrides,
+            *(jupyterlite_build_command_options or {}).values(),
+        ]
+        if isinstance(path, (str, os.PathLike))
+        and path
+        and (Path(app.srcdir) / path).is_file()
+    ]
+
+    job = _LiteBuildJob(app, build_args)
+
+    if app.env.config.jupyterlite_shell_cache_dir:
+        job.shell_cache = ShellCache(
+            Path(app.confdir) / app.env.config.jupyterlite_shell_cache_dir
+        )
+        job.shell_key = job.shell_cache.key(
+            build_args,
+            cwd=Path(app.srcdir),
+            lite_dir=Path(jupyterlite_dir),
+            input_files=input_files,
+        )
+
+    if not app.env.config.jupyterlite_skip_unchanged_build:
+        return job
+
+    output_dir = Path(app.outdir) / JUPYTERLITE_DIR
+    record_path = Path(app.doctreedir) / FINGERPRINT_FILE
+    record = load_build_record(record_path)
+    job.hasher = FileHasher(record.get("files"))
+    job.fingerprint = compute_build_fingerprint(
+        job.hasher,
+        command=command,
+        cwd=Path(app.srcdir),
+        lite_dir=Path(jupyterlite_dir),
+        content_dirs=[Path(app.srcdir) / app.env.config.jupyterlite_content_dir],
+        content_files=contents_files,
+        input_files=input_files,
+    )
+    if build_is_up_to_date(record, job.fingerprint, output_dir):
+        logger.info(
+            "[jupyterlite-sphinx] JupyterLite inputs are unchanged since the"
+            " last build, skipping the JupyterLite build"
+        )
+        return None
+
+    return job
+
+
+def start_background_lite_build(app: Sphinx, env) -> None:
+    """Start the JupyterLite build as soon as all the contents are staged,
+    at the end of the read phase, so that it runs while Sphinx writes the
+    HTML pages. It is joined in jupyterlite_build."""
+    if not app.config.jupyterlite_build_in_background:
+        return
+    if app.builder.format != "html":
+        return
+
+    logger.info("[jupyterlite-sphinx] Starting JupyterLite build in the background")
+    job = _prepare_lite_build(app)
+    if job is not None:
+        job.start()
+    app.jupyterlite_background_build = job
+
+
+def jupyterlite_build(app: Sphinx, error):
+    background_build = hasattr(app, "jupyterlite_background_build")
+    job = getattr(app, "jupyterlite_background_build", None)
+    if background_build:
+        del app.jupyterlite_background_build
+
+    if error is not None:
+        # Do not build JupyterLite
+        if job is not None:
+            job.cancel()
+        return
+
+    if app.builder.format == "html":
+        if background_build:
+            if job is not None:
+                logger.info("[jupyterlite-sphinx] Waiting for the JupyterLite build")
+                job.wait()
+        else:
+            print("[jupyterlite-sphinx] Running JupyterLite build")
+            job = _prepare_lite_build(app)
+            if job is not None:
+                job.run()
+
+        if job is not None:
+            job.finish()
+
+        _expose_notebook_app(app)
+
+        if app.env.config.jupyterlite_service_worker:
+            _install_service_worker(app)
+
+        _report_sizes(app, lite_built=job is not None)
 
     # Cleanup
     try:
@@ -1210,13 +1954,159 @@ def jupyterlite_build(app: Sphinx, error):
         pass
 
 
+def _expose_notebook_app(app: Sphinx) -> None:
+    """Expose the NotebookLite app to the docs pages, as ``window.jupyterapp``
+    of its iframe, when the try_examples directives share an iframe, so that
+    the other notebooks can be loaded into it. Revert it otherwise."""
+    config_path = Path(app.outdir) / JUPYTERLITE_DIR / "notebooks" / "jupyter-lite.json"
+    try:
+        with open(config_path, encoding="utf-8") as f:
+            lite_config = json.load(f)
+        page_config = lite_config["jupyter-config-data"]
+    except (OSError, ValueError, KeyError):
+        return
+
+    if app.env.config.try_examples_shared_iframe:
+        if str(page_config.get("exposeAppInBrowser", "")).lower() == "true":
+            return
+        page_config["exposeAppInBrowser"] = "true"
+        page_config[SHARED_IFRAME_CONFIG_KEY] = True
+    elif page_config.pop(SHARED_IFRAME_CONFIG_KEY, None):
+        page_config.pop("exposeAppInBrowser", None)
+    else:
+        return
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(lite_config, f, indent=2)
+        f.write("\n")
+
+
+def _install_service_worker(app: Sphinx) -> None:
+    """Add the precaching of the lite output to the JupyterLite service
+    worker."""
+    lite_dir = Path(app.outdir) / JUPYTERLITE_DIR
+    record_path = Path(app.doctreedir) / PRECACHE_RECORD_FILE
+    hasher = FileHasher(load_precache_record(record_path))
+    manifest = build_precache_manifest(
+        lite_dir, hasher, app.env.config.jupyterlite_service_worker_exclude
+    )
+    try:
+        changed = install_service_worker(lite_dir, manifest)
+    except FileNotFoundError:
+        logger.warning(
+            "The JupyterLite output has no service worker, the lite app will not"
+            " be precached"
+        )
+        return
+    save_precache_record(record_path, hasher)
+    if changed:
+        logger.info(
+            f"[jupyterlite-sphinx] Precaching {len(manifest['files'])} files of the"
+            f" JupyterLite output, version {manifest['version']}"
+        )
+
+
+def _report_sizes(app: Sphinx, lite_built: bool) -> None:
+    """Write the size report of the JupyterLite contents and output, and
+    enforce the size budgets. The size of the output is only computed again
+    if the JupyterLite build ran."""
+    config = app.env.config
+    # Budgets given on the command line with -D are strings.
+    max_file_size, max_total_size = (
+        int(size) if size is not None else None
+        for size in (
+            config.jupyterlite_max_file_size,
+            config.jupyterlite_max_total_size,
+        )
+    )
+    staging_area = _get_staging_area(app)
+    lite_dir = Path(app.outdir) / JUPYTERLITE_DIR
+    report_path = Path(app.doctreedir) / REPORT_FILE
+    lite_size = None
+    if not lite_built:
+        previous_report = load_size_report(report_path)
+        if previous_report.get("lite_dir") == str(lite_dir):
+            lite_size = previous_report.get("lite_size")
+    report = build_size_report(
+        staging_area.root, staging_area.manifest, lite_dir, lite_size
+    )
+    problems = check_size_budgets(
+        report,
+        max_file_size=max_file_size,
+        max_total_size=max_total_size,
+    )
+    report["budgets"] = {
+        "max_file_size": max_file_size,
+        "max_total_size": max_total_size,
+    }
+    report["over_budget"] = problems
+    write_size_report(report_path, report)
+
+    logger.info(
+        f"[jupyterlite-sphinx] JupyterLite contents: {len(report['files'])} staged"
+        f" file(s), {format_size(report['contents_size'])}; JupyterLite output:"
+        f" {format_size(report['lite_size'])} (report in {report_path})"
+    )
+    if report["transform_savings"]:
+        savings = ", ".join(
+            f"{name} {format_size(size)}"
+            for name, size in sorted(
+                report["transform_savings"].items(), key=lambda item: -item[1]
+            )
+        )
+        logger.info(f"[jupyterlite-sphinx] Saved by the notebook transforms: {savings}")
+
+    if not problems:
+        return
+    if config.jupyterlite_size_budget_action == "error":
+        raise SizeBudgetError(
+            "The JupyterLite size budgets are exceeded:\n" + "\n".join(problems)
+        )
+    for problem in problems:
+        logger.warning(f"[jupyterlite-sphinx] {problem}")
+
+
+def _report_silenced_output(log: BuildLog) -> None:
+    print(
+        "[jupyterlite-sphinx] `jupyterlite build` failed but its"
+        f" output has been silenced. Its last {len(log.tail)} lines are"
+        f" reproduced below, the full output is in {log.path}."
+    )
+    print(f"{'-' * 15} output {'-' * 15}", log.format_tail(), sep="\n")
+    print(f"{'-' * 15} end output {'-' * 15}")
+
+
+def _report_task_timings(timings: TaskTimings, log_path: Optional[Path] = None):
+    by_addon = timings.by_addon()
+    if not by_addon:
+        return
+    summary = ", ".join(
+        f"{addon} {duration:.1f}s" for addon, duration in list(by_addon.items())[:5]
+    )
+    if log_path is not None:
+        summary += f" (the timings of every task are in {log_path})"
+    logger.info(f"[jupyterlite-sphinx] Slowest JupyterLite addons: {summary}")
+    if log_path is None:
+        logger.verbose(
+            f"[jupyterlite-sphinx] JupyterLite task timings:\n{timings.format_table()}"
+        )
+
+
 def setup(app):
     # Initialize NotebookLite parser
     app.add_source_parser(NotebookLiteParser)
 
     app.connect("config-inited", inited)
+    app.connect("env-purge-doc", _purge_env_state)
+    app.connect("env-merge-info", _merge_env_state)
+    app.connect("env-get-outdated", _docs_with_missing_staged_files)
+    app.connect("env-get-outdated", _docs_with_stale_try_examples_config)
+    # Stage the notebooks referenced by the directives once all the documents
+    # are read
+    app.connect("env-updated", _stage_notebooks)
     # We need to build JupyterLite at the end, when all the content was created
     app.connect("build-finished", jupyterlite_build)
+    # Or start it early, while Sphinx writes the HTML pages
+    app.connect("env-updated", start_background_lite_build)
 
     # Config options
     app.add_config_value("jupyterlite_config", None, rebuild="html")
@@ -1226,7 +2116,27 @@ def setup(app):
     app.add_config_value("jupyterlite_ignore_contents", None, rebuild="html")
     app.add_config_value("jupyterlite_bind_ipynb_suffix", True, rebuild="html")
     app.add_config_value("jupyterlite_silence", True, rebuild=True)
+    app.add_config_value("jupyterlite_skip_unchanged_build", True, rebuild="html")
+    app.add_config_value("jupyterlite_build_in_process", False, rebuild="html")
+    app.add_config_value("jupyterlite_build_in_background", False, rebuild="html")
+    app.add_config_value("jupyterlite_shell_cache_dir", None, rebuild="html")
+    app.add_config_value("jupyterlite_max_file_size", None, rebuild="html")
+    app.add_config_value("jupyterlite_max_total_size", None, rebuild="html")
+    app.add_config_value("jupyterlite_size_budget_action", "warning", rebuild="html")
+    app.add_config_value("jupyterlite_iframe_loading", "eager", rebuild=True)
+    app.add_config_value("jupyterlite_max_concurrent_iframes", None, rebuild="html")
+    app.add_config_value("jupyterlite_warmup", "none", rebuild=True)
+    app.add_config_value("jupyterlite_warmup_triggers", ["interaction"], rebuild="html")
+    app.add_config_value("jupyterlite_service_worker", False, rebuild="html")
+    app.add_config_value("jupyterlite_service_worker_exclude", [], rebuild="html")
     app.add_config_value("strip_tagged_cells", False, rebuild=True)
+    app.add_config_value("jupyterlite_notebook_transforms", [], rebuild=True)
+    app.add_config_value(
+        "jupyterlite_max_output_size", DEFAULT_MAX_OUTPUT_SIZE, rebuild=True
+    )
+    app.add_config_value("jupyterlite_staging_strategy", "reflink", rebuild="html")
+    app.add_config_value("jupyterlite_staging_workers", None, rebuild="")
+    app.add_config_value("jupyterlite_staging_cache_dir", None, rebuild="")
 
     # Pass a dictionary of additional options to the JupyterLite build command
     app.add_config_value("jupyterlite_build_command_options", None, rebuild="html")
@@ -1240,6 +2150,12 @@ def setup(app):
         rebuild="html",
     )
     app.add_config_value("try_examples_preamble", default=None, rebuild="html")
+    app.add_config_value("try_examples_shared_iframe", default=False, rebuild="html")
+    app.add_config_value("try_examples_config_max_age", default=0, rebuild="html")
+    app.add_config_value("try_examples_config_inline", default=False, rebuild="html")
+    app.add_config_value(
+        "try_examples_notebooks_dir", default="_try_examples", rebuild=True
+    )
     app.add_config_value("jupyterlite_content_dir", default=CONTENT_DIR, rebuild="html")
 
     # Allow customising the button text for each directive (this is useful
@@ -1262,6 +2178,8 @@ def setup(app):
     app.add_config_value("replite_hide_code_input", False, rebuild="html")
     app.add_config_value("replite_prompt_cell_position", "bottom", rebuild="html")
     app.add_config_value("replite_show_banner", True, rebuild="html")
+    app.add_config_value("replite_code_payload", "auto", rebuild="html")
+    app.add_config_value("replite_code_payload_threshold", 1024, rebuild="html")
 
     # Initialize NotebookLite and JupyterLite directives
     app.add_node(
@@ -1346,11 +2264,9 @@ def setup(app):
     app.add_js_file("jupyterlite_sphinx.js")
 
     # Copy optional try examples runtime config if it exists.
-    try_examples_config_path = Path(app.srcdir) / "try_examples.json"
-    if try_examples_config_path.exists():
-        copy_asset(str(try_examples_config_path), app.outdir)
+    _copy_try_examples_config(app)
 
-    return {"parallel_read_safe": True}
+    return {"parallel_read_safe": True, "env_version": ENV_VERSION}
 
 
 def search_params_parser(search_params: str) -> str:
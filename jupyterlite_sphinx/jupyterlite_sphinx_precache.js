@@ -0,0 +1,146 @@
+// Precaching of the JupyterLite output, prepended by jupyterlite-sphinx to
+// the service worker of JupyterLite. Every file of the precache manifest is
+// fetched when the service worker is installed, and then served from Cache
+// Storage without any network round trip. The other requests are left to the
+// handlers of the JupyterLite service worker.
+(() => {
+  "use strict";
+
+  // Replaced by the precache manifest when the service worker is generated.
+  const PRECACHE = __JUPYTERLITE_SPHINX_PRECACHE__;
+
+  const CACHE_PREFIX = "jupyterlite-sphinx-precache-";
+  const CACHE_NAME = CACHE_PREFIX + PRECACHE.version;
+  // Key of the manifest in the cache, to reuse the unchanged files of a
+  // previous version.
+  const MANIFEST_KEY = "/__jupyterlite_sphinx_precache_manifest__";
+  const MAX_CONCURRENT_FETCHES = 8;
+
+  // The lite output directory, where the service worker is served from.
+  const base = new URL("./", self.location.href);
+
+  const precachedPath = (url) => {
+    if (url.origin !== base.origin || !url.pathname.startsWith(base.pathname)) {
+      return null;
+    }
+    let path;
+    try {
+      path = decodeURIComponent(url.pathname.slice(base.pathname.length));
+    } catch (e) {
+      return null;
+    }
+    // The contents are left to the JupyterLite service worker.
+    if (path.startsWith("files/") || path.startsWith("api/contents/")) {
+      return null;
+    }
+    if (path === "" || path.endsWith("/")) {
+      path += "index.html";
+    }
+    return Object.prototype.hasOwnProperty.call(PRECACHE.files, path)
+      ? path
+      : null;
+  };
+
+  const previousCaches = async () => {
+    const previous = [];
+    for (const name of await caches.keys()) {
+      if (!name.startsWith(CACHE_PREFIX) || name === CACHE_NAME) {
+        continue;
+      }
+      const cache = await caches.open(name);
+      const manifest = await cache.match(MANIFEST_KEY);
+      if (manifest) {
+        previous.push({ cache, files: (await manifest.json()).files });
+      }
+    }
+    return previous;
+  };
+
+  const precache = async () => {
+    const cache = await caches.open(CACHE_NAME);
+    const previous = await previousCaches();
+    const paths = Object.keys(PRECACHE.files);
+    let next = 0;
+
+    const fetchOne = async (path) => {
+      const url = new URL(path, base).href;
+      if (await cache.match(url)) {
+        return;
+      }
+      // Files which did not change since a previous version are copied from
+      // its cache instead of being downloaded again.
+      for (const { cache: previousCache, files } of previous) {
+        if (files[path] === PRECACHE.files[path]) {
+          const response = await previousCache.match(url);
+          if (response) {
+            await cache.put(url, response);
+            return;
+          }
+        }
+      }
+      const response = await fetch(url, { cache: "no-cache" });
+      // Redirected responses can't be used for navigations.
+      if (response.ok && !response.redirected) {
+        await cache.put(url, response);
+      }
+    };
+
+    const worker = async () => {
+      while (next < paths.length) {
+        await fetchOne(paths[next++]);
+      }
+    };
+
+    await Promise.all(
+      Array.from({ length: MAX_CONCURRENT_FETCHES }, () => worker()),
+    );
+    await cache.put(MANIFEST_KEY, new Response(JSON.stringify(PRECACHE)));
+  };
+
+  const fromPrecache = async (request, path) => {
+    const cache = await caches.open(CACHE_NAME);
+    const response = await cache.match(new URL(path, base).href);
+    return response || fetch(request);
+  };
+
+  self.addEventListener("install", (event) => {
+    // A failure to precache must not prevent the JupyterLite service worker
+    // from being installed: the files missing from the cache are fetched
+    // from the network.
+    event.waitUntil(
+      precache().catch((error) =>
+        console.warn("jupyterlite-sphinx: precaching failed", error),
+      ),
+    );
+  });
+
+  self.addEventListener("activate", (event) => {
+    event.waitUntil(
+      caches
+        .keys()
+        .then((names) =>
+          Promise.all(
+            names
+              .filter(
+                (name) => name.startsWith(CACHE_PREFIX) && name !== CACHE_NAME,
+              )
+              .map((name) => caches.delete(name)),
+          ),
+        ),
+    );
+  });
+
+  self.addEventListener("fetch", (event) => {
+    const { request } = event;
+    if (request.method !== "GET") {
+      return;
+    }
+    const path = precachedPath(new URL(request.url));
+    if (path === null) {
+      return;
+    }
+    event.respondWith(fromPrecache(request, path));
+    // The fetch handler of JupyterLite would respond a second time.
+    event.stopImmediatePropagation();
+  });
+})();